@@ -0,0 +1,221 @@
+from __future__ import annotations
+
+import json
+import re
+import sqlite3
+from datetime import date
+from typing import Any
+
+from .data import blog_posts as seed_posts
+from .db import db_path, get_connection, transaction
+from .ids import id_allocator
+
+DEFAULT_BLOG_PAGE_SIZE = 20
+# Поля, которых нет в списке: полный текст отдаёт /api/blog/{id}
+DETAIL_ONLY_FIELDS = ("content",)
+
+_MONTHS = ("янв", "фев", "мар", "апр", "май", "июн", "июл", "авг", "сен", "окт", "ноя", "дек")
+
+_SCHEMA = (
+    """
+    CREATE TABLE IF NOT EXISTS blog_posts (
+        id INTEGER PRIMARY KEY,
+        category TEXT NOT NULL,
+        published TEXT NOT NULL,
+        data TEXT NOT NULL
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS idx_blog_published ON blog_posts (published, id)",
+    "CREATE INDEX IF NOT EXISTS idx_blog_category ON blog_posts (category, published, id)",
+    "CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)",
+    "INSERT OR IGNORE INTO meta (key, value) VALUES ('blog_version', '0')",
+)
+
+
+def parse_post_date(value: str) -> date:
+    """Дата поста: «15 Фев 2026», «15.02.2026» или ISO «2026-02-15»."""
+    text = value.strip().lower()
+    match = re.fullmatch(r"(\d{1,2})\s+([а-яё]{3})[а-яё]*\.?\s+(\d{4})", text)
+    try:
+        # «мая» — родительный падеж, остальные месяцы узнаются по первым трём буквам
+        month = match.group(2).replace("мая", "май") if match else ""
+        if month in _MONTHS:
+            return date(int(match.group(3)), _MONTHS.index(month) + 1, int(match.group(1)))
+        match = re.fullmatch(r"(\d{1,2})\.(\d{1,2})\.(\d{4})", text)
+        if match:
+            return date(int(match.group(3)), int(match.group(2)), int(match.group(1)))
+        return date.fromisoformat(text)
+    except ValueError:
+        pass
+    raise ValueError("Дата должна быть в формате «15 Фев 2026» или «15.02.2026»")
+
+
+def _encode_cursor(published: str, post_id: int) -> str:
+    return f"{published}_{post_id}"
+
+
+def _decode_cursor(cursor: str) -> tuple[str, int]:
+    published, _, post_id = cursor.partition("_")
+    try:
+        date.fromisoformat(published)
+        return published, int(post_id)
+    except ValueError:
+        raise ValueError("Некорректный курсор") from None
+
+
+def excerpt(post: dict[str, Any]) -> dict[str, Any]:
+    return {key: value for key, value in post.items() if key not in DETAIL_ONLY_FIELDS}
+
+
+class BlogStore:
+    """Посты журнала в SQLite: индексы по id, рубрике и дате публикации.
+
+    Список идёт от новых постов к старым, страницы выбираются курсором по
+    (дате, id). Главный пост — одна строка ``blog_featured`` в meta, поэтому
+    смена главного поста не трогает остальные записи; поле ``featured`` в
+    ответах выводится из неё. Версия ``blog_version`` общая для воркеров.
+    """
+
+    def __init__(self) -> None:
+        self._ready_for: str | None = None
+
+    def _setup(self) -> None:
+        if self._ready_for == db_path():
+            return
+        with transaction() as conn:
+            for statement in _SCHEMA:
+                conn.execute(statement)
+            if not conn.execute("SELECT 1 FROM meta WHERE key = 'blog_seeded'").fetchone():
+                for post in seed_posts:
+                    fields = {key: value for key, value in post.items() if key != "featured"}
+                    self._write(conn, fields)
+                    if post.get("featured"):
+                        self._set_featured(conn, post["id"])
+                conn.execute("INSERT INTO meta (key, value) VALUES ('blog_seeded', '1')")
+        self._ready_for = db_path()
+
+    @staticmethod
+    def _write(conn: sqlite3.Connection, post: dict[str, Any]) -> None:
+        conn.execute(
+            "INSERT OR REPLACE INTO blog_posts (id, category, published, data) VALUES (?, ?, ?, ?)",
+            (
+                post["id"],
+                post["category"],
+                parse_post_date(post["date"]).isoformat(),
+                json.dumps(post, ensure_ascii=False),
+            ),
+        )
+
+    @staticmethod
+    def _set_featured(conn: sqlite3.Connection, post_id: int | None) -> None:
+        conn.execute(
+            "INSERT OR REPLACE INTO meta (key, value) VALUES ('blog_featured', ?)",
+            ("" if post_id is None else str(post_id),),
+        )
+
+    @staticmethod
+    def _featured_id(conn: sqlite3.Connection) -> int | None:
+        row = conn.execute("SELECT value FROM meta WHERE key = 'blog_featured'").fetchone()
+        return int(row["value"]) if row and row["value"] else None
+
+    @staticmethod
+    def _bump_version(conn: sqlite3.Connection) -> None:
+        conn.execute("UPDATE meta SET value = CAST(value AS INTEGER) + 1 WHERE key = 'blog_version'")
+
+    @property
+    def version(self) -> int:
+        self._setup()
+        return get_connection().execute(
+            "SELECT CAST(value AS INTEGER) FROM meta WHERE key = 'blog_version'"
+        ).fetchone()[0]
+
+    def _decode(self, data: str, featured_id: int | None) -> dict[str, Any]:
+        post = json.loads(data)
+        post["featured"] = post["id"] == featured_id
+        return post
+
+    def get(self, post_id: int) -> dict[str, Any] | None:
+        self._setup()
+        with transaction("DEFERRED") as conn:
+            row = conn.execute("SELECT data FROM blog_posts WHERE id = ?", (post_id,)).fetchone()
+            return self._decode(row["data"], self._featured_id(conn)) if row else None
+
+    def list(
+        self,
+        category: str | None = None,
+        limit: int = DEFAULT_BLOG_PAGE_SIZE,
+        cursor: str | None = None,
+    ) -> dict[str, Any]:
+        """Страница постов без полного текста; на первой странице — главный пост и рубрики."""
+        self._setup()
+        conditions: list[str] = []
+        params: list[Any] = []
+        if category:
+            conditions.append("category = ?")
+            params.append(category)
+        if cursor:
+            published, post_id = _decode_cursor(cursor)
+            conditions.append("(published, id) < (?, ?)")
+            params.extend((published, post_id))
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+
+        with transaction("DEFERRED") as conn:
+            featured_id = self._featured_id(conn)
+            rows = conn.execute(
+                f"SELECT id, published, data FROM blog_posts {where} ORDER BY published DESC, id DESC LIMIT ?",
+                (*params, limit + 1),
+            ).fetchall()
+            page: dict[str, Any] = {}
+            if not cursor:
+                featured = conn.execute(
+                    "SELECT data FROM blog_posts WHERE id = ?", (featured_id,)
+                ).fetchone() if featured_id is not None else None
+                page["featured"] = excerpt(self._decode(featured["data"], featured_id)) if featured else None
+                page["categories"] = [
+                    row["category"] for row in conn.execute("SELECT DISTINCT category FROM blog_posts ORDER BY category")
+                ]
+
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+        return {
+            "items": [excerpt(self._decode(row["data"], featured_id)) for row in rows],
+            "limit": limit,
+            "next_cursor": _encode_cursor(rows[-1]["published"], rows[-1]["id"]) if has_more else None,
+            **page,
+        }
+
+    def save(self, post_id: int | None, fields: dict[str, Any], featured: bool) -> dict[str, Any] | None:
+        """Создаёт пост (``post_id`` None) или заменяет существующий; None, если поста нет."""
+        self._setup()
+        parse_post_date(fields["date"])
+        with transaction() as conn:
+            if post_id is None:
+                post_id = id_allocator.allocate("blog_posts")
+            elif not conn.execute("SELECT 1 FROM blog_posts WHERE id = ?", (post_id,)).fetchone():
+                return None
+            post = {"id": post_id, **{key: value for key, value in fields.items() if value is not None}}
+            self._write(conn, post)
+            featured_id = self._featured_id(conn)
+            if featured:
+                self._set_featured(conn, post_id)
+            elif featured_id == post_id:
+                self._set_featured(conn, None)
+            self._bump_version(conn)
+        return {**post, "featured": featured}
+
+    def delete(self, post_id: int) -> bool:
+        self._setup()
+        with transaction() as conn:
+            deleted = conn.execute("DELETE FROM blog_posts WHERE id = ?", (post_id,)).rowcount > 0
+            if deleted:
+                if self._featured_id(conn) == post_id:
+                    self._set_featured(conn, None)
+                self._bump_version(conn)
+        return deleted
+
+
+blog_store = BlogStore()
+# Счётчик постов продолжает нумерацию уже сохранённых записей
+id_allocator.register(
+    "blog_posts", lambda conn: conn.execute("SELECT COALESCE(MAX(id), 0) FROM blog_posts").fetchone()[0]
+)
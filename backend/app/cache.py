@@ -0,0 +1,96 @@
+from __future__ import annotations
+
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Hashable, NamedTuple
+
+from fastapi import Request, Response
+
+from .db import db_path, get_connection
+from .serialization import JSON_MEDIA_TYPE, encode_json
+
+
+class CachedResponse(NamedTuple):
+    body: bytes
+    etag: str
+    validators: tuple[Hashable, ...]
+
+
+class ResponseCache:
+    """Кеш готовых JSON-ответов для редко меняющихся эндпоинтов.
+
+    Каждый ответ помечается тегами данных, от которых он зависит. Версия
+    тега — строка в таблице meta, общая для всех воркеров (``catalog_version``,
+    ``stock_version`` и т. д.), поэтому запись в любом воркере делает
+    устаревшими ответы во всех. Версии всех тегов ответа читаются одним
+    запросом; запись действительна, пока они не изменились.
+    """
+
+    def __init__(self, max_entries: int = 512) -> None:
+        self._lock = threading.Lock()
+        self._max_entries = max_entries
+        self._entries: OrderedDict[str, CachedResponse] = OrderedDict()
+        self._sources: dict[str, str] = {}
+        self._ready_for: str | None = None
+
+    def register_source(self, tag: str, version_key: str) -> None:
+        """Связывает тег с ключом версии в таблице meta."""
+        self._sources[tag] = version_key
+
+    def _validators(self, tags: tuple[str, ...]) -> tuple[Hashable, ...]:
+        if not tags:
+            return ()
+        conn = get_connection()
+        if self._ready_for != db_path():
+            conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+            self._ready_for = db_path()
+        keys = [self._sources[tag] for tag in tags]
+        rows = conn.execute(
+            f"SELECT key, value FROM meta WHERE key IN ({', '.join('?' * len(keys))})", keys
+        ).fetchall()
+        versions = {row["key"]: row["value"] for row in rows}
+        return tuple(versions.get(key) for key in keys)
+
+    def respond(
+        self,
+        request: Request,
+        tags: tuple[str, ...],
+        build: Callable[[], Any],
+        max_age: int = 30,
+    ) -> Response:
+        key = request.url.path + "?" + "&".join(sorted(f"{k}={v}" for k, v in request.query_params.multi_items()))
+        validators = self._validators(tags)
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry.validators == validators:
+                self._entries.move_to_end(key)
+            else:
+                entry = None
+
+        if entry is None:
+            body = encode_json(build())
+            entry = CachedResponse(body, f'"{hashlib.blake2b(body, digest_size=12).hexdigest()}"', validators)
+            with self._lock:
+                self._entries[key] = entry
+                self._entries.move_to_end(key)
+                while len(self._entries) > self._max_entries:
+                    self._entries.popitem(last=False)
+
+        headers = {"ETag": entry.etag, "Cache-Control": f"public, max-age={max_age}, must-revalidate"}
+        if_none_match = request.headers.get("if-none-match")
+        if if_none_match and (
+            if_none_match.strip() == "*"
+            or entry.etag in {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}
+        ):
+            return Response(status_code=304, headers=headers)
+        return Response(content=entry.body, media_type=JSON_MEDIA_TYPE, headers=headers)
+
+
+response_cache = ResponseCache()
+response_cache.register_source("catalog", "catalog_version")
+response_cache.register_source("popularity", "popularity_version")
+response_cache.register_source("stock", "stock_version")
+response_cache.register_source("images", "images_version")
+response_cache.register_source("blog", "blog_version")
@@ -0,0 +1,260 @@
+from __future__ import annotations
+
+import json
+import os
+import secrets
+import threading
+import time
+from typing import Any, Callable, Protocol
+
+from .catalog import catalog
+from .db import db_path, transaction
+from .stock import stock_levels
+
+CART_COOKIE = "cart_session"
+CART_HEADER = "X-Cart-Session"
+CART_TTL_SECONDS = int(os.environ.get("CART_TTL_SECONDS", str(14 * 24 * 3600)))
+_SWEEP_INTERVAL = 300.0
+
+# В хранилище лежит состояние корзины и накопленная сумма товаров в копейках;
+# скидка, доставка и итог выводятся из неё при чтении
+CART_KEYS = ("items", "promo_code", "delivery_method", "delivery_zone", "subtotal_cents", "priced_version")
+
+
+# Служебное состояние оценки, которое не отдаётся клиенту: суммы в копейках
+# и версия каталога, по которой оценены строки
+PRIVATE_CART_KEYS = ("subtotal_cents", "priced_version")
+
+
+def new_session_token() -> str:
+    return secrets.token_urlsafe(24)
+
+
+def _blank_state() -> dict[str, Any]:
+    return {
+        "items": [],
+        "promo_code": None,
+        "delivery_method": "courier",
+        "delivery_zone": None,
+        "subtotal_cents": 0,
+        "priced_version": None,
+    }
+
+
+def _stored(cart: dict[str, Any]) -> dict[str, Any]:
+    state = _blank_state()
+    state.update({key: cart[key] for key in CART_KEYS if key in cart})
+    state["items"] = [
+        {"product_id": line["product_id"], "qty": line["qty"], "price": line.get("price", 0)}
+        for line in state["items"]
+    ]
+    return state
+
+
+class CartStore(Protocol):
+    def load(self, token: str) -> dict[str, Any]: ...
+
+    def update(self, token: str, mutate: Callable[[dict[str, Any]], Any]) -> dict[str, Any]:
+        """Атомарно применяет ``mutate`` к корзине и сохраняет результат.
+
+        Если ``mutate`` бросает исключение, корзина остаётся прежней.
+        """
+        ...
+
+
+class MemoryCartStore:
+    """Корзины в памяти процесса с вытеснением по TTL. Подходит для разработки с одним воркером."""
+
+    def __init__(self, ttl: float = CART_TTL_SECONDS) -> None:
+        self._ttl = ttl
+        self._lock = threading.Lock()
+        self._carts: dict[str, tuple[float, dict[str, Any]]] = {}
+        self._next_sweep = time.monotonic() + _SWEEP_INTERVAL
+
+    def _sweep(self, now: float) -> None:
+        if now < self._next_sweep:
+            return
+        self._next_sweep = now + _SWEEP_INTERVAL
+        for token in [token for token, (expires, _) in self._carts.items() if expires <= now]:
+            del self._carts[token]
+
+    def _get(self, token: str, now: float) -> dict[str, Any]:
+        entry = self._carts.get(token)
+        if entry is None or entry[0] <= now:
+            return _blank_state()
+        return _stored(entry[1])
+
+    def load(self, token: str) -> dict[str, Any]:
+        now = time.monotonic()
+        with self._lock:
+            self._sweep(now)
+            return self._get(token, now)
+
+    def update(self, token: str, mutate: Callable[[dict[str, Any]], Any]) -> dict[str, Any]:
+        now = time.monotonic()
+        with self._lock:
+            self._sweep(now)
+            cart = self._get(token, now)
+            mutate(cart)
+            self._carts[token] = (now + self._ttl, _stored(cart))
+            return cart
+
+
+class SqliteCartStore:
+    """Корзины в общей базе SQLite: одна корзина видна всем воркерам gunicorn.
+
+    Изменение выполняется внутри транзакции ``BEGIN IMMEDIATE``, поэтому
+    параллельные запросы к одной корзине не теряют обновления друг друга.
+    """
+
+    def __init__(self, ttl: float = CART_TTL_SECONDS) -> None:
+        self._ttl = ttl
+        self._ready_for: str | None = None
+        self._next_sweep = 0.0
+
+    def _setup(self) -> None:
+        if self._ready_for == db_path():
+            return
+        with transaction() as conn:
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS carts (
+                    token TEXT PRIMARY KEY,
+                    data TEXT NOT NULL,
+                    expires_at REAL NOT NULL
+                )
+                """
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_carts_expires ON carts (expires_at)")
+        self._ready_for = db_path()
+
+    def _get(self, conn: Any, token: str, now: float) -> dict[str, Any]:
+        row = conn.execute(
+            "SELECT data FROM carts WHERE token = ? AND expires_at > ?", (token, now)
+        ).fetchone()
+        return _stored(json.loads(row["data"])) if row else _blank_state()
+
+    def load(self, token: str) -> dict[str, Any]:
+        self._setup()
+        with transaction("DEFERRED") as conn:
+            return self._get(conn, token, time.time())
+
+    def update(self, token: str, mutate: Callable[[dict[str, Any]], Any]) -> dict[str, Any]:
+        self._setup()
+        now = time.time()
+        with transaction() as conn:
+            cart = self._get(conn, token, now)
+            mutate(cart)
+            conn.execute(
+                "INSERT OR REPLACE INTO carts (token, data, expires_at) VALUES (?, ?, ?)",
+                (token, json.dumps(_stored(cart), ensure_ascii=False), now + self._ttl),
+            )
+            if now >= self._next_sweep:
+                self._next_sweep = now + _SWEEP_INTERVAL
+                conn.execute("DELETE FROM carts WHERE expires_at <= ?", (now,))
+        return cart
+
+
+def create_cart_store(kind: str | None = None) -> CartStore:
+    kind = kind or os.environ.get("CART_STORE", "sqlite")
+    if kind == "memory":
+        return MemoryCartStore()
+    if kind == "sqlite":
+        return SqliteCartStore()
+    raise ValueError(f"Неизвестное хранилище корзин: {kind}")
+
+
+def _cents(product: dict[str, Any] | None) -> int:
+    # Удалённый товар ничего не стоит и не попадает в детализацию, как и раньше
+    return round(float(product["price"]) * 100) if product else 0
+
+
+def _line_qty(line: dict[str, Any]) -> int:
+    return max(1, int(line.get("qty", 1)))
+
+
+def ensure_priced(cart: dict[str, Any]) -> None:
+    """Переоценивает строки корзины, товары которых изменились с прошлой оценки.
+
+    Запись каталога, не касающаяся товаров корзины, только сдвигает
+    ``priced_version``; неизвестная версия оценки — полная переоценка.
+    """
+    version = catalog.version
+    priced = cart.get("priced_version")
+    if priced == version:
+        return
+    if priced is not None and priced > version:
+        # Версия из другой базы: сравнивать изменения не с чем
+        priced = None
+
+    product_ids = {line["product_id"] for line in cart["items"]}
+    if priced is not None and product_ids:
+        changed, deleted = catalog.changed_since(priced)
+        product_ids &= {*changed, *deleted}
+    if priced is None:
+        cart["subtotal_cents"] = sum(line.get("price", 0) * _line_qty(line) for line in cart["items"])
+    if product_ids:
+        products = {product["id"]: product for product in catalog.get_many(product_ids)}
+        for line in cart["items"]:
+            if line["product_id"] in product_ids:
+                price = _cents(products.get(line["product_id"]))
+                cart["subtotal_cents"] += (price - line.get("price", 0)) * _line_qty(line)
+                line["price"] = price
+    cart["priced_version"] = version
+
+
+def public_cart(cart: dict[str, Any]) -> dict[str, Any]:
+    """Корзина для ответа API: без цен строк в копейках и служебной версии оценки."""
+    public = {key: value for key, value in cart.items() if key not in PRIVATE_CART_KEYS}
+    public["items"] = [{"product_id": line["product_id"], "qty": line["qty"]} for line in cart["items"]]
+    return public
+
+
+def _hold(token: str | None, line: dict[str, Any]) -> None:
+    # Резерв на складе повторяет количество в корзине; при нехватке бросает
+    # ValueError, и хранилище не сохраняет изменение корзины
+    if token is not None:
+        stock_levels.reserve(token, line["product_id"], _line_qty(line))
+
+
+def add_line(cart: dict[str, Any], product_id: int, qty: int, token: str | None = None) -> None:
+    ensure_priced(cart)
+    for line in cart["items"]:
+        if line["product_id"] == product_id:
+            before = _line_qty(line)
+            line["qty"] += qty
+            cart["subtotal_cents"] += line["price"] * (_line_qty(line) - before)
+            _hold(token, line)
+            return
+    line = {"product_id": product_id, "qty": qty, "price": _cents(catalog.get(product_id))}
+    cart["items"].append(line)
+    cart["subtotal_cents"] += line["price"] * _line_qty(line)
+    _hold(token, line)
+
+
+def set_line_qty(cart: dict[str, Any], product_id: int, qty: int, token: str | None = None) -> None:
+    ensure_priced(cart)
+    for line in cart["items"]:
+        if line["product_id"] == product_id:
+            before = _line_qty(line)
+            line["qty"] = qty
+            cart["subtotal_cents"] += line["price"] * (_line_qty(line) - before)
+            _hold(token, line)
+            return
+    raise LookupError("Позиция в корзине не найдена")
+
+
+def remove_line(cart: dict[str, Any], product_id: int, token: str | None = None) -> None:
+    ensure_priced(cart)
+    if token is not None:
+        stock_levels.release(token, (product_id,))
+    kept: list[dict[str, Any]] = []
+    for line in cart["items"]:
+        if line["product_id"] == product_id:
+            cart["subtotal_cents"] -= line["price"] * _line_qty(line)
+        else:
+            kept.append(line)
+    cart["items"] = kept
+
+
+cart_store = create_cart_store()
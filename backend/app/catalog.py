@@ -0,0 +1,367 @@
+from __future__ import annotations
+
+import json
+import sqlite3
+import threading
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from types import MappingProxyType
+from typing import Any, Iterable, Iterator, Mapping, Protocol
+
+from .data import products as seed_products
+from .db import db_path, get_connection, transaction
+from .ids import id_allocator
+
+_SCHEMA = (
+    """
+    CREATE TABLE IF NOT EXISTS products (
+        id INTEGER PRIMARY KEY,
+        category TEXT NOT NULL,
+        brand TEXT NOT NULL DEFAULT '',
+        updated_at TEXT NOT NULL,
+        data TEXT NOT NULL
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS idx_products_category ON products (category, id)",
+    "CREATE INDEX IF NOT EXISTS idx_products_brand ON products (brand, id)",
+    # Удалённые товары: другие воркеры узнают из них, что убрать из памяти
+    "CREATE TABLE IF NOT EXISTS product_tombstones (id INTEGER PRIMARY KEY, version INTEGER NOT NULL)",
+    "CREATE INDEX IF NOT EXISTS idx_product_tombstones_version ON product_tombstones (version)",
+    "CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)",
+    "INSERT OR IGNORE INTO meta (key, value) VALUES ('catalog_version', '0')",
+)
+
+# Если с прошлой синхронизации изменилась заметная часть каталога, дешевле перечитать его целиком
+_FULL_RELOAD_RATIO = 0.25
+
+
+def _now() -> str:
+    return format_timestamp(datetime.utcnow())
+
+
+def format_timestamp(moment: datetime) -> str:
+    # Фиксированная ширина с микросекундами: строки сравниваются в SQL как время
+    if moment.tzinfo is not None:
+        moment = moment.astimezone(timezone.utc).replace(tzinfo=None)
+    return moment.strftime("%Y-%m-%dT%H:%M:%S.%fZ")
+
+
+def _brand_key(value: Any) -> str:
+    return str(value or "").strip().lower()
+
+
+class FrozenRecord(dict):
+    """Запись каталога только для чтения: её можно отдавать всем запросам без копирования."""
+
+    __slots__ = ()
+
+    def _readonly(self, *args: Any, **kwargs: Any) -> Any:
+        raise TypeError("Запись каталога доступна только для чтения")
+
+    __setitem__ = __delitem__ = __ior__ = _readonly
+    clear = pop = popitem = setdefault = update = _readonly
+
+    def __copy__(self) -> FrozenRecord:
+        return self
+
+    def __deepcopy__(self, memo: dict[int, Any]) -> FrozenRecord:
+        return self
+
+
+def freeze(value: Any) -> Any:
+    if isinstance(value, dict):
+        return FrozenRecord({key: freeze(item) for key, item in value.items()})
+    if isinstance(value, (list, tuple)):
+        return tuple(freeze(item) for item in value)
+    return value
+
+
+class CatalogListener(Protocol):
+    def reset(self, records: Iterable[FrozenRecord]) -> None: ...
+
+    def apply(self, old: FrozenRecord | None, new: FrozenRecord | None) -> None: ...
+
+
+class CatalogRepository:
+    """Хранилище каталога в SQLite с индексами по id, категории и бренду.
+
+    Чтение идёт из индекса id → неизменяемая запись в памяти процесса.
+    Каждая запись увеличивает ``catalog_version`` в базе и помечает строку
+    этой версией (удаление оставляет tombstone). Свои изменения воркер
+    применяет к памяти сразу, а чужие подтягивает при чтении: выбирает
+    строки с версией новее своей и передаёт их подписчикам (индексам)
+    так же точечно. По ``version`` читатели видят, что каталог изменился.
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.RLock()
+        self._ready_for: str | None = None
+        self._version: int | None = None
+        self._records: dict[int, FrozenRecord] = {}
+        self._ordered: tuple[FrozenRecord, ...] | None = None
+        self._listeners: list[CatalogListener] = []
+
+    def _conn(self) -> sqlite3.Connection:
+        if self._ready_for != db_path():
+            self._setup()
+        return get_connection()
+
+    def _setup(self) -> None:
+        with self._lock, transaction() as conn:
+            for statement in _SCHEMA:
+                conn.execute(statement)
+            columns = {row["name"] for row in conn.execute("PRAGMA table_info(products)")}
+            if "version" not in columns:
+                conn.execute("ALTER TABLE products ADD COLUMN version INTEGER NOT NULL DEFAULT 0")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_products_version ON products (version)")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_products_updated ON products (updated_at)")
+            seeded = conn.execute("SELECT 1 FROM meta WHERE key = 'catalog_seeded'").fetchone()
+            if not seeded:
+                for product in seed_products:
+                    self._write(conn, dict(product), 0)
+                conn.execute("INSERT INTO meta (key, value) VALUES ('catalog_seeded', ?)", (_now(),))
+            self._ready_for = db_path()
+            self._version = None
+
+    @staticmethod
+    def _write(conn: sqlite3.Connection, product: dict[str, Any], version: int) -> None:
+        conn.execute(
+            "INSERT OR REPLACE INTO products (id, category, brand, updated_at, data, version) VALUES (?, ?, ?, ?, ?, ?)",
+            (
+                int(product["id"]),
+                product["category"],
+                _brand_key(product.get("brand")),
+                _now(),
+                json.dumps(product, ensure_ascii=False),
+                version,
+            ),
+        )
+        conn.execute("DELETE FROM product_tombstones WHERE id = ?", (int(product["id"]),))
+
+    @staticmethod
+    def _bump_version(conn: sqlite3.Connection) -> int:
+        conn.execute("UPDATE meta SET value = CAST(value AS INTEGER) + 1 WHERE key = 'catalog_version'")
+        return CatalogRepository._current_version(conn)
+
+    @staticmethod
+    def _current_version(conn: sqlite3.Connection) -> int:
+        row = conn.execute("SELECT CAST(value AS INTEGER) FROM meta WHERE key = 'catalog_version'").fetchone()
+        return row[0]
+
+    def subscribe(self, listener: CatalogListener) -> None:
+        with self._lock:
+            self._listeners.append(listener)
+            if self._version is not None:
+                listener.reset(self._records.values())
+
+    def sync(self) -> None:
+        conn = self._conn()
+        if self._version == self._current_version(conn):
+            return
+
+        with self._lock:
+            # Транзакция нужна только для согласованного чтения; подписчиков вызываем после неё,
+            # чтобы их собственные запросы к базе не выполнялись внутри чужого чтения
+            with transaction("DEFERRED") as conn:
+                version = self._current_version(conn)
+                if self._version == version:
+                    return
+                changed = self._read_delta(conn, self._version) if self._version is not None else None
+                rows = conn.execute("SELECT data FROM products").fetchall() if changed is None else None
+
+            if changed is not None:
+                self._apply_delta(changed)
+            else:
+                self._records = {record["id"]: record for record in (freeze(json.loads(row["data"])) for row in rows)}
+                for listener in self._listeners:
+                    listener.reset(self._records.values())
+            self._ordered = None
+            self._version = version
+
+    def _read_delta(self, conn: sqlite3.Connection, since: int) -> list[sqlite3.Row] | None:
+        changed = conn.execute(
+            """
+            SELECT id, data, version FROM products WHERE version > ?
+            UNION ALL
+            SELECT id, NULL, version FROM product_tombstones WHERE version > ?
+            ORDER BY version
+            """,
+            (since, since),
+        ).fetchall()
+        if len(changed) > max(16, len(self._records) * _FULL_RELOAD_RATIO):
+            return None
+        return changed
+
+    def _apply_delta(self, changed: list[sqlite3.Row]) -> None:
+        for row in changed:
+            old = self._records.get(row["id"])
+            new = freeze(json.loads(row["data"])) if row["data"] is not None else None
+            if new is None:
+                if old is None:
+                    continue
+                del self._records[row["id"]]
+            else:
+                self._records[row["id"]] = new
+            for listener in self._listeners:
+                listener.apply(old, new)
+
+    def _apply_local(self, changes: dict[int, dict[str, Any] | None], version: int) -> None:
+        with self._lock:
+            if self._version is None or self._version + 1 != version:
+                # Между нашими записями успел записать другой воркер: перечитаем при следующем чтении
+                return
+            if len(changes) > max(16, len(self._records) * _FULL_RELOAD_RATIO):
+                # Крупная пачка: индексы дешевле перестроить один раз, чем править построчно
+                for product_id, product in changes.items():
+                    if product is None:
+                        self._records.pop(product_id, None)
+                    else:
+                        self._records[product_id] = freeze(product)
+                for listener in self._listeners:
+                    listener.reset(self._records.values())
+            else:
+                for product_id, product in changes.items():
+                    old = self._records.get(product_id)
+                    new = freeze(product) if product is not None else None
+                    if new is None:
+                        if old is None:
+                            continue
+                        del self._records[product_id]
+                    else:
+                        self._records[product_id] = new
+                    for listener in self._listeners:
+                        listener.apply(old, new)
+            self._ordered = None
+            self._version = version
+
+    @property
+    def version(self) -> int:
+        self.sync()
+        return self._version or 0
+
+    @property
+    def index(self) -> Mapping[int, FrozenRecord]:
+        """Индекс id → запись только для чтения; не пересобирается на каждый запрос."""
+        self.sync()
+        return MappingProxyType(self._records)
+
+    def get(self, product_id: int) -> FrozenRecord | None:
+        self.sync()
+        return self._records.get(product_id)
+
+    def get_many(self, product_ids: Iterable[int]) -> list[FrozenRecord]:
+        self.sync()
+        records = self._records
+        return [records[pid] for pid in product_ids if pid in records]
+
+    def list(self) -> tuple[FrozenRecord, ...]:
+        self.sync()
+        ordered = self._ordered
+        if ordered is None:
+            with self._lock:
+                ordered = tuple(sorted(self._records.values(), key=lambda item: item["id"], reverse=True))
+                self._ordered = ordered
+        return ordered
+
+    def count(self) -> int:
+        self.sync()
+        return len(self._records)
+
+    def changed_since(self, version: int) -> tuple[list[int], list[int]]:
+        """Id товаров, изменённых и удалённых после версии каталога ``version``."""
+        self._conn()
+        with transaction("DEFERRED") as conn:
+            changed = [row["id"] for row in conn.execute("SELECT id FROM products WHERE version > ?", (version,))]
+            deleted = [
+                row["id"] for row in conn.execute("SELECT id FROM product_tombstones WHERE version > ?", (version,))
+            ]
+        return changed, deleted
+
+    def updated_after(self, moment: datetime) -> list[int]:
+        conn = self._conn()
+        rows = conn.execute("SELECT id FROM products WHERE updated_at > ?", (format_timestamp(moment),))
+        return [row["id"] for row in rows]
+
+    @contextmanager
+    def batch(self) -> Iterator[CatalogBatch]:
+        """Пачка изменений в одной транзакции с одной новой версией каталога.
+
+        Индексы в памяти обновляются один раз, после фиксации транзакции.
+        """
+        self._conn()
+        with transaction() as conn:
+            batch = CatalogBatch(conn)
+            yield batch
+        if batch.changes:
+            self._apply_local(batch.changes, batch.version)
+
+    def create(self, fields: dict[str, Any]) -> dict[str, Any]:
+        with self.batch() as batch:
+            return batch.create(fields)
+
+    def update(
+        self,
+        product_id: int,
+        changes: dict[str, Any],
+        remove: Iterable[str] = (),
+    ) -> dict[str, Any] | None:
+        with self.batch() as batch:
+            return batch.update(product_id, changes, remove)
+
+    def delete(self, product_id: int) -> bool:
+        with self.batch() as batch:
+            return batch.delete(product_id)
+
+
+class CatalogBatch:
+    """Изменения каталога внутри одной транзакции; создаётся через ``CatalogRepository.batch``."""
+
+    def __init__(self, conn: sqlite3.Connection) -> None:
+        self._conn = conn
+        self._version: int | None = None
+        self.changes: dict[int, dict[str, Any] | None] = {}
+
+    @property
+    def version(self) -> int:
+        # Версия увеличивается один раз на всю пачку и только если что-то изменилось
+        if self._version is None:
+            self._version = CatalogRepository._bump_version(self._conn)
+        return self._version
+
+    def create(self, fields: dict[str, Any]) -> dict[str, Any]:
+        new_id = id_allocator.allocate("products")
+        product = {"id": new_id, **fields}
+        CatalogRepository._write(self._conn, product, self.version)
+        self.changes[new_id] = product
+        return product
+
+    def update(
+        self,
+        product_id: int,
+        changes: dict[str, Any],
+        remove: Iterable[str] = (),
+    ) -> dict[str, Any] | None:
+        row = self._conn.execute("SELECT data FROM products WHERE id = ?", (product_id,)).fetchone()
+        if not row:
+            return None
+        product = json.loads(row["data"])
+        product.update(changes)
+        for key in remove:
+            product.pop(key, None)
+        CatalogRepository._write(self._conn, product, self.version)
+        self.changes[product_id] = product
+        return product
+
+    def delete(self, product_id: int) -> bool:
+        cursor = self._conn.execute("DELETE FROM products WHERE id = ?", (product_id,))
+        if cursor.rowcount == 0:
+            return False
+        self._conn.execute(
+            "INSERT OR REPLACE INTO product_tombstones (id, version) VALUES (?, ?)", (product_id, self.version)
+        )
+        self.changes[product_id] = None
+        return True
+
+
+catalog = CatalogRepository()
+id_allocator.register("products", lambda conn: conn.execute("SELECT COALESCE(MAX(id), 0) FROM products").fetchone()[0])
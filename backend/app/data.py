@@ -157,12 +157,31 @@ promo_codes: dict[str, dict[str, Any]] = {
     "ARTSTART": {"type": "percent", "value": 10},
     "GIFT500": {"type": "fixed", "value": 500},
     "CREAM": {"type": "percent", "value": 7},
+    "BRUSH3": {"type": "bogo", "buy": 2, "get": 1, "categories": ["Кисти"]},
+    "AQUA15": {"type": "percent", "value": 15, "categories": ["Акварель"], "min_subtotal": 2000, "expires_at": "2026-12-31"},
+    "WELCOME300": {"type": "fixed", "value": 300, "min_subtotal": 1500, "per_customer_limit": 1},
 }
 
-orders_demo: list[dict[str, Any]] = [
-
+# Зоны доставки проверяются по порядку: первая, чьё слово встретилось в адресе
+delivery_zones: list[dict[str, Any]] = [
+    {"id": "region", "name": "Курская область", "keywords": ["курская обл", "железногорск", "курчатов", "льгов"]},
+    {"id": "city", "name": "Курск", "keywords": ["курск"]},
+    {"id": "russia", "name": "Россия", "keywords": []},
 ]
 
+# Тарифы: способ → зона → цена по весовым корзинам (WEIGHT_BUCKETS_KG и «тяжелее»),
+# порог бесплатной доставки и срок в днях; зона «*» — для всех остальных
+delivery_rates: dict[str, dict[str, dict[str, Any]]] = {
+    "courier": {
+        "city": {"prices": [350, 350, 550, 850, 1200], "free_from": 3500, "eta_days": 1},
+        "region": {"prices": [450, 450, 700, 1100, 1500], "free_from": 5000, "eta_days": 2},
+        "russia": {"prices": [450, 750, 1200, 1900, 2800], "free_from": 10000, "eta_days": 5},
+    },
+    "pickup": {
+        "*": {"prices": [0, 0, 0, 0, 0], "free_from": None, "eta_days": 0},
+    },
+}
+
 favorites_demo: list[int] = [10, 11, 16]
 
 account_demo: dict[str, Any] = {
@@ -0,0 +1,53 @@
+from __future__ import annotations
+
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Iterator
+
+# Файл базы лежит рядом с приложением, чтобы его можно было вынести в volume
+DEFAULT_DB_PATH = Path(__file__).resolve().parent.parent / "var" / "shop.sqlite3"
+
+_local = threading.local()
+
+
+def db_path() -> str:
+    return os.environ.get("SHOP_DB_PATH", str(DEFAULT_DB_PATH))
+
+
+def get_connection() -> sqlite3.Connection:
+    # Одно соединение на поток: FastAPI выполняет sync-хендлеры в threadpool
+    path = db_path()
+    conn: sqlite3.Connection | None = getattr(_local, "conn", None)
+    if conn is not None and getattr(_local, "path", None) == path:
+        return conn
+
+    Path(path).parent.mkdir(parents=True, exist_ok=True)
+    conn = sqlite3.connect(path, timeout=30.0, isolation_level=None, check_same_thread=False)
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    _local.conn = conn
+    _local.path = path
+    return conn
+
+
+@contextmanager
+def transaction(mode: str = "IMMEDIATE") -> Iterator[sqlite3.Connection]:
+    conn = get_connection()
+    if conn.in_transaction:
+        # Вложенный вызов работает внутри уже открытой транзакции
+        yield conn
+        return
+
+    # IMMEDIATE сразу берёт блокировку записи, поэтому воркеры gunicorn не гоняются;
+    # DEFERRED подходит для согласованного чтения нескольких запросов
+    conn.execute(f"BEGIN {mode}")
+    try:
+        yield conn
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+    conn.execute("COMMIT")
@@ -0,0 +1,161 @@
+from __future__ import annotations
+
+import os
+import threading
+import time
+from bisect import bisect_left
+from dataclasses import dataclass
+from typing import Any, Iterable, Mapping, NamedTuple, Protocol, Sequence
+
+from .data import delivery_rates, delivery_zones
+from .metrics import metrics
+
+DELIVERY_METHODS = ("courier", "pickup")
+# Зона корзины, для которой ещё не указан адрес
+DEFAULT_DELIVERY_ZONE = "city"
+DELIVERY_QUOTE_TTL = float(os.environ.get("DELIVERY_QUOTE_TTL", "600"))
+DELIVERY_MEMO_SIZE = 4096
+# Верхние границы весовых корзин; всё тяжелее последней — отдельная корзина
+WEIGHT_BUCKETS_KG = (1.0, 5.0, 15.0, 30.0)
+# Вес товара без поля weight_kg
+DEFAULT_ITEM_WEIGHT_KG = 0.5
+
+
+class QuoteRequest(NamedTuple):
+    method: str
+    zone: str
+    bucket: int
+
+
+@dataclass(frozen=True)
+class Quote:
+    method: str
+    zone: str
+    cost_cents: int
+    free_from_cents: int | None
+    eta_days: int
+    carrier: str
+
+    def cost_for(self, subtotal_cents: int) -> int:
+        if self.free_from_cents is not None and subtotal_cents >= self.free_from_cents:
+            return 0
+        return self.cost_cents
+
+
+class Carrier(Protocol):
+    name: str
+
+    def quote(self, requests: Sequence[QuoteRequest]) -> list[Quote | None]:
+        """Расчёт для пачки запросов; None — способ недоступен в зоне."""
+        ...
+
+
+class LocalCarrier:
+    """Расчёт по таблицам ``delivery_rates`` без внешних вызовов — для магазина и тестов."""
+
+    name = "local"
+
+    def __init__(self, rates: Mapping[str, Mapping[str, Mapping[str, Any]]] = delivery_rates) -> None:
+        self._rates = rates
+
+    def quote(self, requests: Sequence[QuoteRequest]) -> list[Quote | None]:
+        quotes: list[Quote | None] = []
+        for request in requests:
+            zones = self._rates.get(request.method, {})
+            rate = zones.get(request.zone) or zones.get("*")
+            if rate is None:
+                quotes.append(None)
+                continue
+            prices = rate["prices"]
+            free_from = rate.get("free_from")
+            quotes.append(
+                Quote(
+                    method=request.method,
+                    zone=request.zone,
+                    cost_cents=round(prices[min(request.bucket, len(prices) - 1)] * 100),
+                    free_from_cents=None if free_from is None else round(free_from * 100),
+                    eta_days=int(rate.get("eta_days", 0)),
+                    carrier=self.name,
+                )
+            )
+        return quotes
+
+
+def create_carrier(kind: str | None = None) -> Carrier:
+    kind = kind or os.environ.get("DELIVERY_CARRIER", "local")
+    if kind == "local":
+        return LocalCarrier()
+    raise ValueError(f"Неизвестная служба доставки: {kind}")
+
+
+def resolve_zone(address: str | None) -> str:
+    """Зона по адресу: первая из ``delivery_zones``, чьё ключевое слово есть в адресе."""
+    if not address or not address.strip():
+        return DEFAULT_DELIVERY_ZONE
+    text = address.lower().replace("ё", "е")
+    for zone in delivery_zones:
+        if not zone["keywords"] or any(keyword in text for keyword in zone["keywords"]):
+            return zone["id"]
+    return delivery_zones[-1]["id"]
+
+
+def weight_bucket(weight_kg: float) -> int:
+    return bisect_left(WEIGHT_BUCKETS_KG, weight_kg)
+
+
+def cart_weight(lines: Iterable[Mapping[str, Any]], products: Mapping[int, Mapping[str, Any]]) -> float:
+    weight = 0.0
+    for line in lines:
+        product = products.get(line["product_id"])
+        if product is not None:
+            weight += float(product.get("weight_kg") or DEFAULT_ITEM_WEIGHT_KG) * max(1, int(line.get("qty", 1)))
+    return weight
+
+
+class DeliveryQuoter:
+    """Расчёты доставки через службу ``carrier`` с запоминанием на ``ttl`` секунд.
+
+    Ключ расчёта — (способ, зона, весовая корзина): изменения корзины, не
+    переводящие её в другую весовую корзину, берут готовый расчёт и не
+    обращаются к службе. ``quote_many`` отправляет службе одной пачкой
+    только те способы, которых нет в памяти. Порог бесплатной доставки
+    применяется к сумме товаров уже после расчёта, поэтому не входит в ключ.
+    """
+
+    def __init__(self, carrier: Carrier, ttl: float = DELIVERY_QUOTE_TTL) -> None:
+        self._carrier = carrier
+        self._ttl = ttl
+        self._lock = threading.Lock()
+        self._memo: dict[QuoteRequest, tuple[float, Quote | None]] = {}
+
+    def quote_many(self, methods: Sequence[str], zone: str, weight_kg: float) -> dict[str, Quote | None]:
+        bucket = weight_bucket(weight_kg)
+        requests = [QuoteRequest(method, zone, bucket) for method in methods]
+        now = time.monotonic()
+        found: dict[str, Quote | None] = {}
+        with self._lock:
+            for request in requests:
+                entry = self._memo.get(request)
+                if entry is not None and entry[0] > now:
+                    found[request.method] = entry[1]
+        missing = [request for request in requests if request.method not in found]
+        if missing:
+            with metrics.span("delivery_quote"):
+                quotes = self._carrier.quote(missing)
+            with self._lock:
+                if len(self._memo) + len(missing) > DELIVERY_MEMO_SIZE:
+                    self._memo.clear()
+                for request, quote in zip(missing, quotes):
+                    self._memo[request] = (now + self._ttl, quote)
+                    found[request.method] = quote
+        return {method: found[method] for method in methods}
+
+    def quote(self, method: str, zone: str, weight_kg: float) -> Quote | None:
+        return self.quote_many((method,), zone, weight_kg)[method]
+
+    def clear(self) -> None:
+        with self._lock:
+            self._memo.clear()
+
+
+delivery_quoter = DeliveryQuoter(create_carrier())
@@ -0,0 +1,73 @@
+from __future__ import annotations
+
+import csv
+import io
+import json
+from typing import Any, Iterable, Iterator
+
+from .catalog import catalog
+from .serialization import dumps
+
+EXPORT_CHUNK_SIZE = 500
+
+# Колонки CSV-выгрузки: плоские поля карточки и описание; deleted = 1 — строка-tombstone
+# удалённого товара в инкрементальной выгрузке, в ней заполнен только id
+CSV_FIELDS = (
+    "id",
+    "name",
+    "price",
+    "old_price",
+    "category",
+    "brand",
+    "type",
+    "color",
+    "shape",
+    "size",
+    "hardness",
+    "slug",
+    "image",
+    "in_stock",
+    "description",
+    "deleted",
+)
+
+
+def _chunks(ids: list[int]) -> Iterator[list[Any]]:
+    # Записи берутся из каталога порциями: в памяти не больше одной порции закодированных строк.
+    # Товар, удалённый во время выгрузки, просто пропускается
+    for start in range(0, len(ids), EXPORT_CHUNK_SIZE):
+        yield catalog.get_many(ids[start:start + EXPORT_CHUNK_SIZE])
+
+
+def iter_ndjson(ids: list[int], deleted: Iterable[int] = ()) -> Iterator[bytes]:
+    for records in _chunks(ids):
+        # Мимо кеша фрагментов: разовая выгрузка не должна раздувать его на весь каталог
+        yield b"".join(dumps(record) + b"\n" for record in records)
+    tombstones = [dumps({"id": product_id, "deleted": True}) + b"\n" for product_id in deleted]
+    if tombstones:
+        yield b"".join(tombstones)
+
+
+def _csv_value(value: Any) -> Any:
+    if isinstance(value, bool):
+        return int(value)
+    if isinstance(value, (list, tuple, dict)):
+        return json.dumps(value, ensure_ascii=False)
+    return value
+
+
+def iter_csv(ids: list[int], deleted: Iterable[int] = ()) -> Iterator[bytes]:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(CSV_FIELDS)
+    for records in _chunks(ids):
+        writer.writerows(
+            [_csv_value(record.get(key)) for key in CSV_FIELDS[:-1]] + [0] for record in records
+        )
+        yield buffer.getvalue().encode("utf-8")
+        buffer.seek(0)
+        buffer.truncate()
+    blank = [None] * (len(CSV_FIELDS) - 2)
+    writer.writerows([product_id, *blank, 1] for product_id in deleted)
+    if buffer.tell():
+        yield buffer.getvalue().encode("utf-8")
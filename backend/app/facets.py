@@ -0,0 +1,119 @@
+from __future__ import annotations
+
+import threading
+from typing import Any, Iterable, Mapping
+
+from .catalog import CatalogRepository, FrozenRecord, catalog
+
+FACET_KEYS = ("type", "brand", "color", "shape", "size", "hardness")
+
+
+class FacetIndex:
+    """Индекс фасетов: категория → атрибут → значение → множество id товаров.
+
+    Обновляется точечно через подписку на изменения каталога, поэтому списки
+    значений фильтров и точные фильтры не требуют прохода по всем товарам.
+    """
+
+    def __init__(self, repository: CatalogRepository) -> None:
+        self._repository = repository
+        self._lock = threading.Lock()
+        self._categories: dict[str, set[int]] = {}
+        # Значения фасетов хранятся как в выдаче: str(value).strip()
+        self._facets: dict[str, dict[str, dict[str, set[int]]]] = {}
+        # Для точных фильтров значение сравнивается без учёта регистра
+        self._exact: dict[str, dict[str, set[int]]] = {}
+        self._facet_cache: dict[str, dict[str, list[dict[str, Any]]]] = {}
+        repository.subscribe(self)
+
+    def reset(self, records: Iterable[FrozenRecord]) -> None:
+        with self._lock:
+            self._categories = {}
+            self._facets = {}
+            self._exact = {}
+            self._facet_cache = {}
+            for record in records:
+                self._add(record)
+
+    def apply(self, old: FrozenRecord | None, new: FrozenRecord | None) -> None:
+        with self._lock:
+            if old is not None:
+                self._remove(old)
+                self._facet_cache.pop(old["category"], None)
+            if new is not None:
+                self._add(new)
+                self._facet_cache.pop(new["category"], None)
+
+    def _add(self, record: FrozenRecord) -> None:
+        product_id = record["id"]
+        category = record["category"]
+        self._categories.setdefault(category, set()).add(product_id)
+        facets = self._facets.setdefault(category, {})
+        for key in FACET_KEYS:
+            if key not in record:
+                continue
+            self._exact.setdefault(key, {}).setdefault(str(record[key]).lower(), set()).add(product_id)
+            value = str(record[key]).strip()
+            if value:
+                facets.setdefault(key, {}).setdefault(value, set()).add(product_id)
+
+    def _remove(self, record: FrozenRecord) -> None:
+        product_id = record["id"]
+        category = record["category"]
+        _discard(self._categories, category, product_id)
+        facets = self._facets.get(category, {})
+        for key in FACET_KEYS:
+            if key not in record:
+                continue
+            _discard(self._exact.get(key, {}), str(record[key]).lower(), product_id)
+            _discard(facets.get(key, {}), str(record[key]).strip(), product_id)
+
+    def facet_counts(self, category: str, keys: Iterable[str]) -> dict[str, list[dict[str, Any]]]:
+        self._repository.sync()
+        with self._lock:
+            cached = self._facet_cache.get(category)
+            if cached is None:
+                cached = {
+                    key: [
+                        {"value": value, "count": len(ids)}
+                        for value, ids in sorted(values.items())
+                    ]
+                    for key, values in self._facets.get(category, {}).items()
+                }
+                self._facet_cache[category] = cached
+        return {key: cached.get(key, []) for key in keys}
+
+    def match(self, category: str | None, filters: Mapping[str, str]) -> set[int] | None:
+        """Возвращает id товаров, подходящих под категорию и точные фильтры.
+
+        ``None`` означает, что ограничений нет и подходит весь каталог.
+        """
+        self._repository.sync()
+        with self._lock:
+            candidates: list[set[int]] = []
+            if category:
+                candidates.append(self._categories.get(category, set()))
+            for key, value in filters.items():
+                candidates.append(self._exact.get(key, {}).get(value.lower(), set()))
+            if not candidates:
+                return None
+
+            candidates.sort(key=len)
+            result = set(candidates[0])
+            for ids in candidates[1:]:
+                if not result:
+                    break
+                result &= ids
+            return result
+
+
+def _discard(index: dict[str, set[int]], value: str, product_id: int) -> None:
+    ids = index.get(value)
+    if ids is None:
+        return
+    ids.discard(product_id)
+    if not ids:
+        del index[value]
+
+
+facet_index = FacetIndex(catalog)
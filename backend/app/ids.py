@@ -0,0 +1,48 @@
+from __future__ import annotations
+
+import sqlite3
+from typing import Callable
+
+from .db import db_path, transaction
+
+
+class IdAllocator:
+    """Монотонные счётчики id в SQLite, общие для всех воркеров.
+
+    Выдача id — один ``UPDATE ... RETURNING`` внутри транзакции записи,
+    поэтому параллельные воркеры не получат одинаковый id, а после
+    удаления или перезапуска номера не переиспользуются. При первом
+    обращении счётчик начинается с ``floor`` — наибольшего уже занятого id.
+    """
+
+    def __init__(self) -> None:
+        self._ready_for: str | None = None
+        self._floors: dict[str, Callable[[sqlite3.Connection], int]] = {}
+
+    def register(self, name: str, floor: Callable[[sqlite3.Connection], int]) -> None:
+        self._floors[name] = floor
+
+    def _setup(self) -> None:
+        if self._ready_for == db_path():
+            return
+        with transaction() as conn:
+            conn.execute("CREATE TABLE IF NOT EXISTS id_counters (name TEXT PRIMARY KEY, value INTEGER NOT NULL)")
+        self._ready_for = db_path()
+
+    def allocate(self, name: str, count: int = 1) -> int:
+        """Резервирует ``count`` подряд идущих id и возвращает первый из них."""
+        self._setup()
+        with transaction() as conn:
+            row = conn.execute(
+                "UPDATE id_counters SET value = value + ? WHERE name = ? RETURNING value", (count, name)
+            ).fetchone()
+            if row is not None:
+                value = row[0]
+            else:
+                floor = self._floors.get(name)
+                value = (floor(conn) if floor else 0) + count
+                conn.execute("INSERT INTO id_counters (name, value) VALUES (?, ?)", (name, value))
+        return value - count + 1
+
+
+id_allocator = IdAllocator()
@@ -0,0 +1,383 @@
+from __future__ import annotations
+
+import hashlib
+import io
+import json
+import mimetypes
+import os
+import re
+import sqlite3
+import threading
+import urllib.parse
+import urllib.request
+from pathlib import Path
+from typing import Any, Callable, Iterable
+
+from .catalog import CatalogRepository, FrozenRecord, catalog
+from .db import db_path, get_connection, transaction
+from .jobs import job_queue
+
+try:
+    from PIL import Image, features
+except ImportError:  # Pillow необязателен: без него оригиналы раздаются как есть, без вариантов
+    Image = None
+    features = None
+
+IMAGE_STORE_DIR = Path(os.environ.get("IMAGE_STORE_DIR", str(Path(db_path()).parent / "images")))
+IMAGE_URL_PREFIX = "/api/images/"
+# Ширины вариантов для srcset; ширина по умолчанию — для поля image
+IMAGE_WIDTHS = (320, 640, 960, 1280, 1920)
+DEFAULT_IMAGE_WIDTH = 640
+IMAGE_MAX_BYTES = 20 * 1024 * 1024
+_FETCH_TIMEOUT = 15.0
+_FETCH_SCHEMES = ("http", "https")
+_QUALITY = {"webp": 80, "avif": 60}
+_FORMATS = {"webp": "WEBP", "avif": "AVIF"}
+_LOOKUP_CHUNK = 500
+_NAME_RE = re.compile(r"^[0-9a-f]{32}(?:-\d+)?\.[a-z0-9]+$")
+
+_SCHEMA = (
+    """
+    CREATE TABLE IF NOT EXISTS images (
+        url TEXT PRIMARY KEY,
+        status TEXT NOT NULL DEFAULT 'pending',
+        hash TEXT,
+        ext TEXT,
+        width INTEGER,
+        variants TEXT NOT NULL DEFAULT '{}',
+        error TEXT,
+        version INTEGER NOT NULL DEFAULT 0
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS idx_images_version ON images (version)",
+    "CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)",
+    "INSERT OR IGNORE INTO meta (key, value) VALUES ('images_version', '0')",
+)
+
+
+def variant_formats() -> tuple[str, ...]:
+    """Форматы вариантов, которые умеет кодировать установленный Pillow."""
+    if Image is None:
+        return ()
+    return tuple(fmt for fmt in ("avif", "webp") if features.check(fmt))
+
+
+def _build_opener() -> urllib.request.OpenerDirector:
+    # Только HTTP(S): без обработчиков file:// и ftp:// их не откроет и перенаправление
+    opener = urllib.request.OpenerDirector()
+    for handler in (
+        urllib.request.HTTPHandler,
+        urllib.request.HTTPSHandler,
+        urllib.request.HTTPRedirectHandler,
+        urllib.request.HTTPDefaultErrorHandler,
+        urllib.request.HTTPErrorProcessor,
+    ):
+        opener.add_handler(handler())
+    return opener
+
+
+_opener = _build_opener()
+
+
+def fetch_url(url: str) -> bytes:
+    """Скачивает оригинал по адресу http(s); другие схемы отклоняются."""
+    if urllib.parse.urlsplit(url).scheme not in _FETCH_SCHEMES:
+        raise ValueError("Изображение можно загрузить только по http или https")
+    request = urllib.request.Request(url, headers={"User-Agent": "artistic-shop-images/1.0"})
+    with _opener.open(request, timeout=_FETCH_TIMEOUT) as response:
+        data = response.read(IMAGE_MAX_BYTES + 1)
+    if len(data) > IMAGE_MAX_BYTES:
+        raise ValueError("Изображение слишком большое")
+    return data
+
+
+class ImageStore:
+    """Локальное хранилище изображений каталога с адресацией по содержимому.
+
+    Оригинал скачивается один раз (в фоновом задании) и сохраняется под
+    хешем содержимого; одинаковые картинки по разным адресам хранятся
+    однократно. При наличии Pillow для каждой ширины из ``IMAGE_WIDTHS``
+    строятся варианты WebP и AVIF. Состояние общее для воркеров через
+    SQLite, в памяти — карта адрес → готовые варианты, подтягиваемая по
+    версии. Пока оригинал не загружен, в ответах остаётся исходный адрес.
+
+    Как подписчик каталога хранилище только запоминает адреса: подписчики
+    вызываются под блокировкой каталога, и транзакция записи там ждала бы
+    воркер, который сам ждёт эту блокировку. Загрузку запомненных адресов
+    ставит ``flush_pending`` — периодическая задача очереди заданий.
+    """
+
+    def __init__(
+        self,
+        repository: CatalogRepository,
+        directory: Path = IMAGE_STORE_DIR,
+        fetch: Callable[[str], bytes] = fetch_url,
+    ) -> None:
+        self.directory = directory
+        self.fetch = fetch
+        self._lock = threading.Lock()
+        self._ready_for: str | None = None
+        self._version: int | None = None
+        self._entries: dict[str, dict[str, Any]] = {}
+        self._pending: set[str] = set()
+        repository.subscribe(self)
+
+    def _setup(self) -> None:
+        if self._ready_for == db_path():
+            return
+        with transaction() as conn:
+            for statement in _SCHEMA:
+                conn.execute(statement)
+        with self._lock:
+            self._ready_for = db_path()
+            self._version = None
+            self._entries = {}
+
+    @staticmethod
+    def _bump_version(conn: sqlite3.Connection) -> int:
+        conn.execute("UPDATE meta SET value = CAST(value AS INTEGER) + 1 WHERE key = 'images_version'")
+        return conn.execute("SELECT CAST(value AS INTEGER) FROM meta WHERE key = 'images_version'").fetchone()[0]
+
+    def sync(self) -> None:
+        self._setup()
+        current = get_connection().execute(
+            "SELECT CAST(value AS INTEGER) FROM meta WHERE key = 'images_version'"
+        ).fetchone()[0]
+        if self._version == current:
+            return
+        with transaction("DEFERRED") as conn:
+            rows = conn.execute(
+                "SELECT url, hash, ext, width, variants FROM images WHERE status = 'ready' AND version > ?",
+                (self._version if self._version is not None else -1,),
+            ).fetchall()
+        with self._lock:
+            for row in rows:
+                self._entries[row["url"]] = {
+                    "hash": row["hash"],
+                    "ext": row["ext"],
+                    "width": row["width"],
+                    "variants": json.loads(row["variants"]),
+                }
+            self._version = current
+
+    @property
+    def version(self) -> int:
+        self.sync()
+        return self._version or 0
+
+    # --- загрузка оригиналов -------------------------------------------------
+
+    def request(self, urls: Iterable[str]) -> int:
+        """Ставит в очередь загрузку ещё не известных адресов; возвращает их число."""
+        self._setup()
+        candidates = list(dict.fromkeys(url for url in urls if url and not url.startswith(IMAGE_URL_PREFIX)))
+        if not candidates:
+            return 0
+        # Сначала сверка с таблицей чтением: если всё уже известно, транзакция записи не нужна
+        known: set[str] = set()
+        with transaction("DEFERRED") as conn:
+            for start in range(0, len(candidates), _LOOKUP_CHUNK):
+                chunk = candidates[start : start + _LOOKUP_CHUNK]
+                rows = conn.execute(
+                    f"SELECT url FROM images WHERE url IN ({', '.join('?' * len(chunk))})", chunk
+                )
+                known.update(row["url"] for row in rows)
+        missing = [url for url in candidates if url not in known]
+        if not missing:
+            return 0
+        queued = 0
+        with transaction() as conn:
+            for url in missing:
+                inserted = conn.execute("INSERT OR IGNORE INTO images (url) VALUES (?)", (url,)).rowcount
+                if inserted:
+                    job_queue.enqueue("image_ingest", {"url": url})
+                    queued += 1
+        return queued
+
+    def flush_pending(self) -> int:
+        """Ставит загрузку адресов, запомненных при изменениях каталога."""
+        with self._lock:
+            pending, self._pending = self._pending, set()
+        try:
+            return self.request(pending)
+        except Exception:
+            with self._lock:
+                self._pending |= pending
+            raise
+
+    def ingest(self, url: str, data: bytes | None = None) -> dict[str, Any]:
+        """Сохраняет оригинал и строит варианты; ``data`` позволяет передать байты без скачивания."""
+        self._setup()
+        try:
+            original = data if data is not None else self.fetch(url)
+            entry = self._store(original)
+        except Exception as exc:
+            with transaction() as conn:
+                conn.execute(
+                    """
+                    INSERT INTO images (url, status, error) VALUES (?, 'failed', ?)
+                    ON CONFLICT (url) DO UPDATE SET status = 'failed', error = excluded.error
+                    """,
+                    (url, f"{type(exc).__name__}: {exc}"),
+                )
+            raise
+        with transaction() as conn:
+            version = self._bump_version(conn)
+            conn.execute(
+                """
+                INSERT INTO images (url, status, hash, ext, width, variants, error, version)
+                VALUES (?, 'ready', ?, ?, ?, ?, NULL, ?)
+                ON CONFLICT (url) DO UPDATE SET
+                    status = 'ready', hash = excluded.hash, ext = excluded.ext, width = excluded.width,
+                    variants = excluded.variants, error = NULL, version = excluded.version
+                """,
+                (url, entry["hash"], entry["ext"], entry["width"], json.dumps(entry["variants"]), version),
+            )
+        return entry
+
+    def _store(self, data: bytes) -> dict[str, Any]:
+        digest = hashlib.blake2b(data, digest_size=16).hexdigest()
+        ext, width, image = "bin", None, None
+        if Image is not None:
+            image = Image.open(io.BytesIO(data))
+            image.load()
+            ext = (image.format or "bin").lower().replace("jpeg", "jpg")
+            width = image.width
+        else:
+            ext = _sniff_ext(data)
+
+        originals = self.directory / "originals"
+        originals.mkdir(parents=True, exist_ok=True)
+        _write_once(originals / f"{digest}.{ext}", data)
+
+        variants: dict[str, list[int]] = {}
+        if image is not None:
+            # Варианты шире оригинала не нужны; сам оригинал заменяет самую широкую ступень
+            widths = sorted({min(target, image.width) for target in IMAGE_WIDTHS})
+            for fmt in variant_formats():
+                for target in widths:
+                    path = self.directory / "variants" / f"{digest}-{target}.{fmt}"
+                    if not path.exists():
+                        _write_once(path, _encode(image, target, fmt))
+                variants[fmt] = widths
+        return {"hash": digest, "ext": ext, "width": width, "variants": variants}
+
+    def path_for(self, name: str) -> Path | None:
+        """Файл по имени из URL: ``<hash>.<ext>`` — оригинал, ``<hash>-<width>.<fmt>`` — вариант."""
+        if not _NAME_RE.match(name):
+            return None
+        folder = "variants" if "-" in name else "originals"
+        path = self.directory / folder / name
+        return path if path.is_file() else None
+
+    # --- подписка на каталог -------------------------------------------------
+
+    # Вызываются под блокировкой каталога, поэтому не обращаются к базе
+
+    def reset(self, records: Iterable[FrozenRecord]) -> None:
+        # После полной перезагрузки весь снимок сверяется с таблицей images:
+        # в очередь попадёт только то, чего там ещё нет
+        urls = [url for record in records for url in image_urls(record)]
+        with self._lock:
+            self._pending.update(urls)
+
+    def apply(self, old: FrozenRecord | None, new: FrozenRecord | None) -> None:
+        if new is not None:
+            urls = image_urls(new)
+            with self._lock:
+                self._pending.update(urls)
+
+    # --- переписывание адресов -----------------------------------------------
+
+    def srcset(self, url: str) -> dict[str, Any] | None:
+        """Адрес для ``src`` и строки srcset по форматам для загруженного изображения.
+
+        Не обращается к базе: вызывающий код один раз делает ``sync()`` (или
+        читает ``version``) перед обработкой пачки записей.
+        """
+        entry = self._entries.get(url)
+        if entry is None:
+            return None
+        variants = entry["variants"]
+        if not variants:
+            return {"src": f"{IMAGE_URL_PREFIX}{entry['hash']}.{entry['ext']}", "srcset": {}}
+        # src — совместимый WebP ширины по умолчанию (или самый широкий из меньших)
+        fallback = "webp" if "webp" in variants else next(iter(variants))
+        widths = variants[fallback]
+        default = max((width for width in widths if width <= DEFAULT_IMAGE_WIDTH), default=widths[0])
+        return {
+            "src": f"{IMAGE_URL_PREFIX}{entry['hash']}-{default}.{fallback}",
+            "srcset": {
+                fmt: ", ".join(f"{IMAGE_URL_PREFIX}{entry['hash']}-{width}.{fmt} {width}w" for width in fmt_widths)
+                for fmt, fmt_widths in variants.items()
+            },
+        }
+
+    def rewrite(self, item: Any) -> Any:
+        """Копия записи с локальными адресами в ``image``/``photos`` и полями ``image_srcset``."""
+        changes: dict[str, Any] = {}
+        image = item.get("image")
+        if isinstance(image, str):
+            variant = self.srcset(image)
+            if variant is not None:
+                changes["image"] = variant["src"]
+                if variant["srcset"]:
+                    changes["image_srcset"] = variant["srcset"]
+        photos = item.get("photos")
+        if isinstance(photos, (list, tuple)) and photos:
+            rewritten = [self.srcset(photo) if isinstance(photo, str) else None for photo in photos]
+            if any(rewritten):
+                changes["photos"] = [
+                    variant["src"] if variant else photo for photo, variant in zip(photos, rewritten)
+                ]
+                changes["photos_srcset"] = [variant["srcset"] if variant else {} for variant in rewritten]
+        if not changes:
+            return item
+        merged = {**item, **changes}
+        return FrozenRecord(merged) if isinstance(item, FrozenRecord) else merged
+
+
+def image_urls(item: Any) -> list[str]:
+    urls = [item.get("image")] + list(item.get("photos") or [])
+    return [url for url in urls if isinstance(url, str) and url]
+
+
+def _encode(image: Any, width: int, fmt: str) -> bytes:
+    frame = image.convert("RGBA" if image.mode in ("RGBA", "LA", "P") else "RGB")
+    if frame.width > width:
+        frame = frame.resize((width, round(frame.height * width / frame.width)), Image.LANCZOS)
+    buffer = io.BytesIO()
+    frame.save(buffer, _FORMATS[fmt], quality=_QUALITY[fmt])
+    return buffer.getvalue()
+
+
+def _write_once(path: Path, data: bytes) -> None:
+    # Имя определяется содержимым, поэтому готовый файл не переписывается;
+    # запись через переименование не оставляет половину файла при параллельной загрузке
+    if path.exists():
+        return
+    path.parent.mkdir(parents=True, exist_ok=True)
+    temporary = path.with_name(f".{path.name}.{os.getpid()}.{threading.get_ident()}")
+    temporary.write_bytes(data)
+    os.replace(temporary, path)
+
+
+def _sniff_ext(data: bytes) -> str:
+    for signature, ext in (
+        (b"\xff\xd8\xff", "jpg"),
+        (b"\x89PNG", "png"),
+        (b"GIF8", "gif"),
+        (b"RIFF", "webp"),
+    ):
+        if data.startswith(signature):
+            return ext
+    raise ValueError("Неизвестный формат изображения")
+
+
+def media_type(path: Path) -> str:
+    return mimetypes.guess_type(path.name)[0] or {"avif": "image/avif", "webp": "image/webp"}.get(
+        path.suffix.lstrip("."), "application/octet-stream"
+    )
+
+
+image_store = ImageStore(catalog)
@@ -0,0 +1,236 @@
+from __future__ import annotations
+
+import json
+import logging
+import os
+import threading
+import time
+from typing import Any, Callable
+
+from .db import db_path, get_connection, transaction
+
+logger = logging.getLogger(__name__)
+
+JOB_WORKERS = int(os.environ.get("JOB_WORKERS", "1"))
+JOB_MAX_ATTEMPTS = int(os.environ.get("JOB_MAX_ATTEMPTS", "5"))
+# Задание, которое воркер взял и не закрыл за это время (процесс упал), снова становится доступным
+JOB_LEASE_SECONDS = 60.0
+_POLL_INTERVAL = 1.0
+_RETRY_BASE_DELAY = 2.0
+_DONE_RETENTION = 24 * 3600.0
+
+_SCHEMA = (
+    """
+    CREATE TABLE IF NOT EXISTS jobs (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        kind TEXT NOT NULL,
+        payload TEXT NOT NULL,
+        status TEXT NOT NULL DEFAULT 'pending',
+        attempts INTEGER NOT NULL DEFAULT 0,
+        created_at REAL NOT NULL,
+        run_at REAL NOT NULL,
+        locked_until REAL,
+        finished_at REAL,
+        last_error TEXT
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS idx_jobs_ready ON jobs (status, run_at)",
+    "CREATE INDEX IF NOT EXISTS idx_jobs_lease ON jobs (status, locked_until)",
+)
+
+
+class JobQueue:
+    """Долговечная очередь фоновых заданий в SQLite.
+
+    Задание ставится в очередь в транзакции вызывающего кода, поэтому
+    заказ и его последующая обработка фиксируются вместе. Воркеры —
+    потоки внутри каждого процесса gunicorn; задание забирается атомарно
+    с арендой на ``JOB_LEASE_SECONDS``. Упавшее задание повторяется с
+    экспоненциальной задержкой, после ``JOB_MAX_ATTEMPTS`` попыток
+    помечается failed. Незавершённые задания переживают перезапуск.
+    """
+
+    def __init__(self) -> None:
+        self._ready_for: str | None = None
+        self._handlers: dict[str, Callable[[dict[str, Any]], None]] = {}
+        # Периодические задачи процесса: [функция, интервал, время следующего запуска]
+        self._periodic: list[list[Any]] = []
+        self._periodic_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopping = threading.Event()
+        self._threads: list[threading.Thread] = []
+
+    def handler(self, kind: str) -> Callable[[Callable[[dict[str, Any]], None]], Callable[[dict[str, Any]], None]]:
+        def register(func: Callable[[dict[str, Any]], None]) -> Callable[[dict[str, Any]], None]:
+            self._handlers[kind] = func
+            return func
+
+        return register
+
+    def every(self, interval: float) -> Callable[[Callable[[], None]], Callable[[], None]]:
+        """Регистрирует задачу, которую воркер процесса выполняет раз в ``interval`` секунд и при остановке."""
+
+        def register(func: Callable[[], None]) -> Callable[[], None]:
+            self._periodic.append([func, interval, 0.0])
+            return func
+
+        return register
+
+    def run_periodic(self, force: bool = False) -> None:
+        """Выполняет периодические задачи, срок которых подошёл; при ``force`` — все сразу."""
+        # Несколько потоков-воркеров не выполняют одну задачу одновременно
+        if not self._periodic_lock.acquire(blocking=force):
+            return
+        try:
+            now = time.monotonic()
+            for task in self._periodic:
+                func, interval, due = task
+                if not force and now < due:
+                    continue
+                task[2] = now + interval
+                try:
+                    func()
+                except Exception:
+                    logger.exception("Ошибка периодической задачи %s", getattr(func, "__name__", func))
+        finally:
+            self._periodic_lock.release()
+
+    def _setup(self) -> None:
+        if self._ready_for == db_path():
+            return
+        with transaction() as conn:
+            for statement in _SCHEMA:
+                conn.execute(statement)
+        self._ready_for = db_path()
+
+    def enqueue(self, kind: str, payload: dict[str, Any], delay: float = 0.0) -> int:
+        self._setup()
+        now = time.time()
+        with transaction() as conn:
+            job_id = conn.execute(
+                "INSERT INTO jobs (kind, payload, created_at, run_at) VALUES (?, ?, ?, ?)",
+                (kind, json.dumps(payload, ensure_ascii=False), now, now + delay),
+            ).lastrowid
+        self._wakeup.set()
+        return job_id
+
+    def _claim(self) -> Any:
+        now = time.time()
+        with transaction() as conn:
+            return conn.execute(
+                """
+                UPDATE jobs SET status = 'running', attempts = attempts + 1, locked_until = ?
+                WHERE id = (
+                    SELECT id FROM jobs
+                    WHERE (status = 'pending' AND run_at <= ?) OR (status = 'running' AND locked_until < ?)
+                    ORDER BY run_at LIMIT 1
+                )
+                RETURNING id, kind, payload, attempts
+                """,
+                (now + JOB_LEASE_SECONDS, now, now),
+            ).fetchone()
+
+    def _finish(self, job: Any, error: str | None) -> None:
+        now = time.time()
+        with transaction() as conn:
+            if error is None:
+                conn.execute(
+                    "UPDATE jobs SET status = 'done', finished_at = ?, locked_until = NULL WHERE id = ?",
+                    (now, job["id"]),
+                )
+            elif job["attempts"] >= JOB_MAX_ATTEMPTS:
+                conn.execute(
+                    "UPDATE jobs SET status = 'failed', finished_at = ?, locked_until = NULL, last_error = ? WHERE id = ?",
+                    (now, error, job["id"]),
+                )
+            else:
+                conn.execute(
+                    "UPDATE jobs SET status = 'pending', run_at = ?, locked_until = NULL, last_error = ? WHERE id = ?",
+                    (now + _RETRY_BASE_DELAY ** job["attempts"], error, job["id"]),
+                )
+
+    def run_one(self) -> bool:
+        """Выполняет одно готовое задание; False, если выполнять нечего."""
+        self._setup()
+        job = self._claim()
+        if job is None:
+            return False
+        handler = self._handlers.get(job["kind"])
+        try:
+            if handler is None:
+                raise LookupError(f"Нет обработчика для задания {job['kind']}")
+            handler(json.loads(job["payload"]))
+        except Exception as exc:
+            logger.exception("Задание %s (%s) завершилось ошибкой", job["id"], job["kind"])
+            self._finish(job, f"{type(exc).__name__}: {exc}")
+        else:
+            self._finish(job, None)
+        return True
+
+    def run_pending(self) -> int:
+        done = 0
+        while self.run_one():
+            done += 1
+        return done
+
+    def _prune(self) -> None:
+        with transaction() as conn:
+            conn.execute(
+                "DELETE FROM jobs WHERE status = 'done' AND finished_at < ?", (time.time() - _DONE_RETENTION,)
+            )
+
+    def _worker(self) -> None:
+        next_prune = 0.0
+        while not self._stopping.is_set():
+            try:
+                if time.monotonic() >= next_prune:
+                    next_prune = time.monotonic() + 3600.0
+                    self._setup()
+                    self._prune()
+                self.run_periodic()
+                if self.run_one():
+                    continue
+            except Exception:
+                logger.exception("Ошибка воркера очереди заданий")
+            self._wakeup.wait(_POLL_INTERVAL)
+            self._wakeup.clear()
+
+    def start(self, workers: int = JOB_WORKERS) -> None:
+        if self._threads or workers <= 0:
+            return
+        self._stopping.clear()
+        for number in range(workers):
+            thread = threading.Thread(target=self._worker, name=f"jobs-{number}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self, timeout: float = 5.0) -> None:
+        self._stopping.set()
+        self._wakeup.set()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+        # Последний запуск периодических задач: накопленное в памяти не теряется при остановке
+        self.run_periodic(force=True)
+
+    def metrics(self) -> dict[str, Any]:
+        """Глубина очереди и задержка самого старого готового задания."""
+        self._setup()
+        now = time.time()
+        conn = get_connection()
+        rows = conn.execute("SELECT status, COUNT(*) AS jobs FROM jobs GROUP BY status")
+        counts = {row["status"]: row["jobs"] for row in rows}
+        oldest = conn.execute(
+            "SELECT MIN(run_at) FROM jobs WHERE status = 'pending' AND run_at <= ?", (now,)
+        ).fetchone()[0]
+        return {
+            "depth": counts.get("pending", 0),
+            "running": counts.get("running", 0),
+            "failed": counts.get("failed", 0),
+            "done": counts.get("done", 0),
+            "lag_seconds": round(now - oldest, 3) if oldest is not None else 0.0,
+            "workers": len(self._threads),
+        }
+
+
+job_queue = JobQueue()
@@ -1,13 +1,39 @@
 from __future__ import annotations
 
-from typing import Any
-
-from fastapi import FastAPI, HTTPException, Query
+import csv
+import io
+import json
+from contextlib import asynccontextmanager
+from datetime import date, datetime
+from typing import Any, AsyncIterator, Iterable
+
+from fastapi import Depends, FastAPI, HTTPException, Query, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel, Field
-
-# Импортируем данные (список)
-from .data import blog_posts, promo_codes, products
+from fastapi.responses import FileResponse, StreamingResponse
+from pydantic import BaseModel, Field, ValidationError
+from starlette.concurrency import run_in_threadpool
+
+from .blog import DEFAULT_BLOG_PAGE_SIZE, blog_store
+from .cache import response_cache
+from .carts import (
+    CART_COOKIE,
+    CART_HEADER,
+    CART_TTL_SECONDS,
+    add_line,
+    cart_store,
+    new_session_token,
+    remove_line,
+    set_line_qty,
+)
+from .catalog import catalog
+from .delivery import resolve_zone
+from .exports import iter_csv, iter_ndjson
+from .images import image_store, media_type
+from .jobs import job_queue
+from .metrics import PROFILE_ID_HEADER, MetricsMiddleware, load_profile, metrics
+from .popularity import popularity
+from .projections import parse_fields, present, product_shape, project
+from .promos import promo_engine
 from .schemas import (
     CartDeliveryUpdate,
     CartItemInput,
@@ -16,10 +42,13 @@ from .schemas import (
     PromoApplyRequest,
     Product,
 )
+from .serialization import json_response
 from .services import (
     checkout_order,
+    create_product,
     default_account_payload,
     empty_cart,
+    export_product_ids,
     filter_products,
     get_categories,
     get_contacts_payload,
@@ -27,14 +56,27 @@ from .services import (
     get_product_by_id,
     get_search_suggestions,
     get_special_sections,
+    import_products,
     recalc_cart,
     submit_contact_message,
+    sync_images,
+    update_product,
 )
 
+@asynccontextmanager
+async def lifespan(app: FastAPI) -> AsyncIterator[None]:
+    # Фоновые воркеры очереди живут столько же, сколько процесс приложения
+    job_queue.start()
+    yield
+    job_queue.stop()
+    metrics.flush(force=True)
+
+
 app = FastAPI(
     title="Artistic Shop API",
     version="1.0.0",
     description="API интернет-магазина художественных принадлежностей",
+    lifespan=lifespan,
 )
 
 app.add_middleware(
@@ -43,33 +85,90 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=[CART_HEADER, "X-Catalog-Version", PROFILE_ID_HEADER],
 )
-
-cart_state: dict[str, Any] = empty_cart()
-
+# Добавлен последним, поэтому внешний: учитывает и время остальных middleware
+app.add_middleware(MetricsMiddleware)
 
 class CartQtyUpdate(BaseModel):
     qty: int = Field(ge=1, le=99)
 
 
+def cart_session(request: Request, response: Response) -> str:
+    token = request.headers.get(CART_HEADER) or request.cookies.get(CART_COOKIE)
+    if not token or len(token) > 64:
+        token = new_session_token()
+    # Продлеваем cookie на каждом запросе, чтобы активная корзина не истекала
+    response.set_cookie(CART_COOKIE, token, max_age=CART_TTL_SECONDS, httponly=True, samesite="lax")
+    response.headers[CART_HEADER] = token
+    return token
+
+
+class ListProjection:
+    """Проекция товаров в списках: полная запись, карточка (view=card) или поля из fields=."""
+
+    def __init__(
+        self,
+        view: str = Query(default="full", pattern="^(full|card)$"),
+        fields: str | None = None,
+    ) -> None:
+        self.view = view
+        self.fields = parse_fields(fields)
+
+    def __call__(self, items: Iterable[Any]) -> list[Any]:
+        return project(items, self.view, self.fields)
+
+
 @app.get("/api/health")
 def health_check() -> dict[str, str]:
     return {"status": "ok"}
 
 
+@app.get("/api/metrics")
+def metrics_endpoint() -> Response:
+    """Метрики всех воркеров в текстовом формате Prometheus."""
+    jobs = job_queue.metrics()
+    # Очередь общая для всех процессов, поэтому её показатели не суммируются по воркерам
+    shared = [
+        ("shop_jobs", (("status", status),), jobs[key])
+        for status, key in (("pending", "depth"), ("running", "running"), ("failed", "failed"), ("done", "done"))
+    ]
+    shared.append(("shop_jobs_lag_seconds", (), jobs["lag_seconds"]))
+    return Response(metrics.render(shared), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+
+@app.get("/api/metrics/profiles/{profile_id}")
+def metrics_profile(profile_id: str) -> Response:
+    profile = load_profile(profile_id)
+    if profile is None:
+        raise HTTPException(status_code=404, detail="Профиль не найден")
+    return Response(profile, media_type="text/plain; charset=utf-8")
+
+
 @app.get("/api/home")
-def home() -> dict[str, Any]:
-    return get_home_payload()
+def home(request: Request, projection: ListProjection = Depends()) -> Response:
+    def build() -> dict[str, Any]:
+        payload = get_home_payload()
+        payload["popular"] = projection(payload["popular"])
+        payload["promotions"] = projection(payload["promotions"])
+        return payload
+
+    return response_cache.respond(request, ("catalog", "popularity", "stock", "images"), build)
 
 
 @app.get("/api/categories")
-def categories() -> list[dict[str, Any]]:
-    return get_categories()
+def categories(request: Request) -> Response:
+    return response_cache.respond(request, ("images",), get_categories, max_age=300)
 
-@app.get("/api/products/popular", response_model=list[Product])
-def get_popular_products():
-    # Теперь products ссылается на импортированный список, а не на функцию ниже
-    return [p for p in products if p.get("is_popular")]
+@app.get("/api/products/popular", responses={200: {"model": list[Product]}})
+def get_popular_products(request: Request, projection: ListProjection = Depends()) -> Response:
+    def build() -> list[Any]:
+        items = projection([p for p in catalog.list() if p.get("is_popular")])
+        if projection.view == "full" and not projection.fields:
+            return [product_shape(item) for item in items]
+        return items
+
+    return response_cache.respond(request, ("catalog", "stock", "images"), build)
 
 # --- ИСПРАВЛЕНИЕ ЗДЕСЬ: Переименовали функцию из products в get_products ---
 @app.get("/api/products")
@@ -83,11 +182,54 @@ def get_products(
     shape: str | None = None,
     size: str | None = None,
     hardness: str | None = None,
-) -> dict[str, Any]:
-    return filter_products(
+    limit: int | None = Query(default=None, ge=1, le=200),
+    offset: int = Query(default=0, ge=0),
+    cursor: str | None = None,
+    projection: ListProjection = Depends(),
+) -> Response:
+    try:
+        result = filter_products(
+            category=category,
+            query=q,
+            sort=sort,
+            type_filter=type,
+            brand_filter=brand,
+            color_filter=color,
+            shape_filter=shape,
+            size_filter=size,
+            hardness_filter=hardness,
+            limit=limit,
+            offset=offset,
+            cursor=cursor,
+        )
+    except ValueError as exc:
+        raise HTTPException(status_code=400, detail=str(exc)) from exc
+
+    result["items"] = projection(result["items"])
+    return json_response(result)
+
+
+@app.get("/api/products/export")
+def export_products(
+    format: str = Query(default="ndjson", pattern="^(ndjson|csv)$"),
+    category: str | None = None,
+    q: str | None = Query(default=None, alias="query"),
+    sort: str = Query(default="new", pattern="^(new|price_asc|price_desc|popular)$"),
+    type: str | None = None,
+    brand: str | None = None,
+    color: str | None = None,
+    shape: str | None = None,
+    size: str | None = None,
+    hardness: str | None = None,
+    since: int | None = Query(default=None, ge=0),
+    updated_after: datetime | None = None,
+) -> StreamingResponse:
+    version, ids, deleted = export_product_ids(
         category=category,
         query=q,
         sort=sort,
+        since=since,
+        updated_after=updated_after,
         type_filter=type,
         brand_filter=brand,
         color_filter=color,
@@ -95,40 +237,68 @@ def get_products(
         size_filter=size,
         hardness_filter=hardness,
     )
+    # Следующую инкрементальную выгрузку клиент запрашивает с since равным этой версии
+    headers = {"X-Catalog-Version": str(version)}
+    if format == "csv":
+        headers["Content-Disposition"] = 'attachment; filename="catalog.csv"'
+        return StreamingResponse(iter_csv(ids, deleted), media_type="text/csv; charset=utf-8", headers=headers)
+    return StreamingResponse(iter_ndjson(ids, deleted), media_type="application/x-ndjson", headers=headers)
 
 
 @app.get("/api/products/{product_id}")
-def product_details(product_id: int) -> dict[str, Any]:
-    for p in products:
-        if p.get("id") == product_id:
-            return p
-            
+def product_details(product_id: int) -> Response:
+    product = catalog.get(product_id)
+    if product:
+        popularity.record_view(product_id)
+        return json_response(present(product))
+
     raise HTTPException(status_code=404, detail="Товар не найден")
 
 
+@app.get("/api/images/{name}")
+def image_file(name: str) -> FileResponse:
+    path = image_store.path_for(name)
+    if path is None:
+        raise HTTPException(status_code=404, detail="Изображение не найдено")
+    # Имя файла — хеш содержимого, поэтому ответ можно кешировать навсегда
+    return FileResponse(
+        path,
+        media_type=media_type(path),
+        headers={"Cache-Control": "public, max-age=31536000, immutable"},
+    )
+
+
 @app.get("/api/search/suggest")
 def search_suggest(q: str = Query(min_length=2)) -> list[dict[str, Any]]:
     return get_search_suggestions(q)
 
 
 @app.get("/api/specials")
-def specials() -> list[dict[str, Any]]:
-    return get_special_sections()
+def specials(request: Request, projection: ListProjection = Depends()) -> Response:
+    def build() -> list[dict[str, Any]]:
+        sections = get_special_sections()
+        for section in sections:
+            section["products"] = projection(section["products"])
+        return sections
+
+    return response_cache.respond(request, ("catalog", "stock", "images"), build)
 
 
 @app.get("/api/account")
-def account() -> dict[str, Any]:
-    return default_account_payload()
+def account(projection: ListProjection = Depends()) -> dict[str, Any]:
+    payload = default_account_payload()
+    payload["favorites"] = projection(payload["favorites"])
+    return payload
 
 
 @app.get("/api/contacts")
-def contacts() -> dict[str, Any]:
-    return get_contacts_payload()
+def contacts(request: Request) -> Response:
+    return response_cache.respond(request, (), get_contacts_payload, max_age=300)
 
 
 @app.get("/api/cart")
-def get_cart() -> dict[str, Any]:
-    return recalc_cart(cart_state)
+def get_cart(session: str = Depends(cart_session)) -> dict[str, Any]:
+    return recalc_cart(cart_store.load(session))
 
 
 class OrderStatusUpdate(BaseModel):
@@ -142,6 +312,15 @@ class AdminProductUpsert(BaseModel):
     image: str | None = None
     description: str | None = None
     in_stock: bool | None = None
+    stock: int | None = Field(default=None, ge=0)
+
+
+class AdminPriceUpdate(BaseModel):
+    price: float = Field(ge=0)
+
+
+IMPORT_MAX_ROWS = 50_000
+IMPORT_OPS = ("upsert", "price", "delete")
 
 
 class AdminBlogPostUpsert(BaseModel):
@@ -155,14 +334,43 @@ class AdminBlogPostUpsert(BaseModel):
     content: str | None = None
 
 @app.get("/api/admin/stats")
-def admin_stats():
+def admin_stats(
+    days: int = Query(default=30, ge=1, le=366),
+    bucket: str = Query(default="day", pattern="^(day|week|month)$"),
+):
     from .services import get_admin_stats
-    return get_admin_stats()
+    return get_admin_stats(days, bucket)
 
 @app.get("/api/admin/orders")
-def admin_orders():
+def admin_orders(
+    status: str | None = None,
+    date_from: date | None = None,
+    date_to: date | None = None,
+    phone: str | None = None,
+    limit: int = Query(default=50, ge=1, le=200),
+    cursor: str | None = None,
+):
     from .services import get_all_orders
-    return get_all_orders()
+    try:
+        return get_all_orders(
+            status=status,
+            date_from=date_from.isoformat() if date_from else None,
+            date_to=date_to.isoformat() if date_to else None,
+            phone=phone,
+            limit=limit,
+            cursor=cursor,
+        )
+    except ValueError as exc:
+        raise HTTPException(status_code=400, detail=str(exc)) from exc
+
+@app.post("/api/admin/images/sync")
+def admin_sync_images() -> dict[str, Any]:
+    return {"queued": sync_images()}
+
+
+@app.get("/api/admin/jobs")
+def admin_jobs() -> dict[str, Any]:
+    return job_queue.metrics()
 
 @app.patch("/api/admin/orders/{order_id}/status")
 def admin_update_order(order_id: str, payload: OrderStatusUpdate):
@@ -181,187 +389,221 @@ def admin_delete_product(product_id: int):
 
 
 @app.get("/api/blog")
-def get_blog_posts() -> list[dict[str, Any]]:
-    return blog_posts
+def get_blog_posts(
+    request: Request,
+    category: str | None = None,
+    limit: int = Query(default=DEFAULT_BLOG_PAGE_SIZE, ge=1, le=100),
+    cursor: str | None = None,
+) -> Response:
+    try:
+        # Ответ с некорректным курсором не строится и в кеш не попадает
+        return response_cache.respond(
+            request, ("blog",), lambda: blog_store.list(category, limit, cursor), max_age=60
+        )
+    except ValueError as exc:
+        raise HTTPException(status_code=400, detail=str(exc)) from exc
+
+
+@app.get("/api/blog/{post_id}")
+def get_blog_post(post_id: int) -> dict[str, Any]:
+    post = blog_store.get(post_id)
+    if post is None:
+        raise HTTPException(status_code=404, detail="Пост не найден")
+    return post
+
+
+def _save_blog_post(post_id: int | None, payload: AdminBlogPostUpsert) -> dict[str, Any] | None:
+    fields = payload.model_dump(exclude={"featured"})
+    try:
+        return blog_store.save(post_id, fields, bool(payload.featured))
+    except ValueError as exc:
+        raise HTTPException(status_code=400, detail=str(exc)) from exc
 
 
 @app.post("/api/admin/blog")
 def admin_create_blog_post(payload: AdminBlogPostUpsert) -> dict[str, Any]:
-    new_id = max((int(p.get("id", 0)) for p in blog_posts), default=0) + 1
-    post: dict[str, Any] = {
-        "id": new_id,
-        "title": payload.title,
-        "excerpt": payload.excerpt,
-        "category": payload.category,
-        "date": payload.date,
-        "readTime": payload.readTime,
-        "featured": bool(payload.featured),
-    }
-    if payload.image is not None:
-        post["image"] = payload.image
-    if payload.content is not None:
-        post["content"] = payload.content
-
-    if post.get("featured"):
-        for existing in blog_posts:
-            existing["featured"] = False
-
-    blog_posts.insert(0, post)
-    return post
+    return _save_blog_post(None, payload)
 
 
 @app.put("/api/admin/blog/{post_id}")
 def admin_update_blog_post(post_id: int, payload: AdminBlogPostUpsert) -> dict[str, Any]:
-    for p in blog_posts:
-        if int(p.get("id")) == post_id:
-            p["title"] = payload.title
-            p["excerpt"] = payload.excerpt
-            p["category"] = payload.category
-            p["date"] = payload.date
-            p["readTime"] = payload.readTime
-            p["featured"] = bool(payload.featured)
-            if payload.image is not None:
-                p["image"] = payload.image
-            else:
-                p.pop("image", None)
-            if payload.content is not None:
-                p["content"] = payload.content
-            else:
-                p.pop("content", None)
-
-            if p.get("featured"):
-                for other in blog_posts:
-                    if other is not p:
-                        other["featured"] = False
-
-            return p
-
-    raise HTTPException(status_code=404, detail="Пост не найден")
+    post = _save_blog_post(post_id, payload)
+    if post is None:
+        raise HTTPException(status_code=404, detail="Пост не найден")
+    return post
 
 
 @app.delete("/api/admin/blog/{post_id}")
 def admin_delete_blog_post(post_id: int) -> dict[str, Any]:
-    for i in range(len(blog_posts) - 1, -1, -1):
-        if int(blog_posts[i].get("id")) == post_id:
-            blog_posts.pop(i)
-            return {"message": "Удалено успешно"}
-
+    if blog_store.delete(post_id):
+        return {"message": "Удалено успешно"}
     raise HTTPException(status_code=404, detail="Пост не найден")
 
 
 @app.post("/api/admin/products")
 def admin_create_product(payload: AdminProductUpsert) -> dict[str, Any]:
-    new_id = max((int(p.get("id", 0)) for p in products), default=0) + 1
-    product: dict[str, Any] = {
-        "id": new_id,
-        "name": payload.name,
-        "price": payload.price,
-        "category": payload.category,
-    }
-    if payload.image is not None:
-        product["image"] = payload.image
-    if payload.description is not None:
-        product["description"] = payload.description
-    if payload.in_stock is not None:
-        product["in_stock"] = payload.in_stock
-
-    products.insert(0, product)
-    return product
+    return create_product(**payload.model_dump())
 
 
 @app.put("/api/admin/products/{product_id}")
 def admin_update_product(product_id: int, payload: AdminProductUpsert) -> dict[str, Any]:
-    for p in products:
-        if int(p.get("id")) == product_id:
-            p["name"] = payload.name
-            p["price"] = payload.price
-            p["category"] = payload.category
-            if payload.image is not None:
-                p["image"] = payload.image
-            else:
-                p.pop("image", None)
-            if payload.description is not None:
-                p["description"] = payload.description
-            else:
-                p.pop("description", None)
-            if payload.in_stock is not None:
-                p["in_stock"] = payload.in_stock
-            return p
+    product = update_product(product_id, **payload.model_dump())
+    if product:
+        return product
 
     raise HTTPException(status_code=404, detail="Товар не найден")
 
+
+def _validation_message(exc: ValidationError) -> str:
+    return "; ".join(f"{'.'.join(str(part) for part in error['loc'])}: {error['msg']}" for error in exc.errors())
+
+
+async def _import_rows(request: Request) -> list[dict[str, Any]]:
+    body = await request.body()
+    try:
+        if "csv" in request.headers.get("content-type", ""):
+            # Пустая ячейка CSV означает отсутствие значения
+            reader = csv.DictReader(io.StringIO(body.decode("utf-8-sig")))
+            rows: Any = [{key: value or None for key, value in row.items() if key} for row in reader]
+        else:
+            rows = json.loads(body)
+    except (UnicodeDecodeError, ValueError, csv.Error) as exc:
+        raise HTTPException(status_code=400, detail=f"Не удалось разобрать файл: {exc}") from exc
+    if not isinstance(rows, list):
+        raise HTTPException(status_code=400, detail="Ожидается массив товаров или CSV")
+    if len(rows) > IMPORT_MAX_ROWS:
+        raise HTTPException(status_code=400, detail=f"Не больше {IMPORT_MAX_ROWS} строк за раз")
+    return rows
+
+
+def _import_operation(row: Any) -> dict[str, Any]:
+    if not isinstance(row, dict):
+        raise ValueError("Строка должна быть объектом")
+    # Tombstone из инкрементальной выгрузки (deleted = true / 1) импортируется как удаление
+    op = row.get("op") or ("delete" if row.get("deleted") in (True, 1, "1", "true") else "upsert")
+    if op not in IMPORT_OPS:
+        raise ValueError(f"Неизвестная операция: {op}")
+    raw_id = row.get("id")
+    try:
+        product_id = int(raw_id) if raw_id not in (None, "") else None
+    except (TypeError, ValueError):
+        raise ValueError("id должен быть числом") from None
+    if product_id is None and op != "upsert":
+        raise ValueError("Для этой операции нужен id")
+
+    if op == "delete":
+        fields: dict[str, Any] = {}
+    elif op == "price":
+        fields = AdminPriceUpdate.model_validate(row).model_dump()
+    else:
+        fields = AdminProductUpsert.model_validate(row).model_dump()
+    return {"op": op, "id": product_id, "fields": fields}
+
+
+@app.post("/api/admin/products/import")
+async def admin_import_products(request: Request) -> dict[str, Any]:
+    """Пакетная загрузка товаров: JSON-массив или CSV с колонками товара и необязательными id и op."""
+    operations: list[dict[str, Any]] = []
+    errors: list[dict[str, Any]] = []
+    for row_number, row in enumerate(await _import_rows(request), start=1):
+        try:
+            operations.append({"row": row_number, **_import_operation(row)})
+        except ValidationError as exc:
+            errors.append({"row": row_number, "id": row.get("id"), "error": _validation_message(exc)})
+        except ValueError as exc:
+            errors.append({"row": row_number, "id": row.get("id") if isinstance(row, dict) else None, "error": str(exc)})
+
+    result = await run_in_threadpool(import_products, operations)
+    result["errors"] = sorted(errors + result["errors"], key=lambda error: error["row"])
+    return result
+
+
 @app.post("/api/cart/items")
-def add_to_cart(payload: CartItemInput) -> dict[str, Any]:
-    for line in cart_state["items"]:
-        if line["product_id"] == payload.product_id:
-            line["qty"] += payload.qty
-            return recalc_cart(cart_state)
-        
-    cart_state["items"].append({
-        "product_id": payload.product_id, 
-        "qty": payload.qty
-    })
-    
-    return recalc_cart(cart_state)
+def add_to_cart(payload: CartItemInput, session: str = Depends(cart_session)) -> dict[str, Any]:
+    try:
+        cart = cart_store.update(session, lambda cart: add_line(cart, payload.product_id, payload.qty, session))
+    except ValueError as exc:
+        raise HTTPException(status_code=400, detail=str(exc)) from exc
+    return recalc_cart(cart)
 
 
 @app.patch("/api/cart/items/{product_id}")
-def update_cart_item(product_id: int, payload: CartQtyUpdate) -> dict[str, Any]:
-    for line in cart_state["items"]:
-        if line["product_id"] == product_id:
-            line["qty"] = payload.qty
-            return recalc_cart(cart_state)
-
-    raise HTTPException(status_code=404, detail="Позиция в корзине не найдена")
+def update_cart_item(
+    product_id: int,
+    payload: CartQtyUpdate,
+    session: str = Depends(cart_session),
+) -> dict[str, Any]:
+    try:
+        cart = cart_store.update(session, lambda cart: set_line_qty(cart, product_id, payload.qty, session))
+    except LookupError as exc:
+        raise HTTPException(status_code=404, detail=str(exc)) from exc
+    except ValueError as exc:
+        raise HTTPException(status_code=400, detail=str(exc)) from exc
+    return recalc_cart(cart)
 
 
 @app.delete("/api/cart/items/{product_id}")
-def remove_cart_item(product_id: int) -> dict[str, Any]:
-    cart_state["items"] = [line for line in cart_state["items"] if line["product_id"] != product_id]
-    return recalc_cart(cart_state)
+def remove_cart_item(product_id: int, session: str = Depends(cart_session)) -> dict[str, Any]:
+    cart = cart_store.update(session, lambda cart: remove_line(cart, product_id, session))
+    return recalc_cart(cart)
 
 
 @app.patch("/api/cart/delivery")
-def update_delivery(payload: CartDeliveryUpdate) -> dict[str, Any]:
-    cart_state["delivery_method"] = payload.delivery_method
-    return recalc_cart(cart_state)
+def update_delivery(payload: CartDeliveryUpdate, session: str = Depends(cart_session)) -> dict[str, Any]:
+    def choose(cart: dict[str, Any]) -> None:
+        cart["delivery_method"] = payload.delivery_method
+        if payload.address is not None:
+            cart["delivery_zone"] = resolve_zone(payload.address)
+
+    cart = cart_store.update(session, choose)
+    return recalc_cart(cart)
 
 
 @app.post("/api/cart/promo")
-def apply_promo(payload: PromoApplyRequest) -> dict[str, Any]:
+def apply_promo(payload: PromoApplyRequest, session: str = Depends(cart_session)) -> dict[str, Any]:
     code = payload.code.strip().upper()
-    if code not in promo_codes:
-        raise HTTPException(status_code=400, detail="Промокод не найден")
+    try:
+        promo_engine.check(code)
+    except (LookupError, ValueError) as exc:
+        raise HTTPException(status_code=400, detail=str(exc)) from exc
 
-    cart_state["promo_code"] = code
-    return recalc_cart(cart_state)
+    cart = cart_store.update(session, lambda cart: cart.update(promo_code=code))
+    return recalc_cart(cart)
 
 
 @app.delete("/api/cart/promo")
-def clear_promo() -> dict[str, Any]:
-    cart_state["promo_code"] = None
-    return recalc_cart(cart_state)
+def clear_promo(session: str = Depends(cart_session)) -> dict[str, Any]:
+    cart = cart_store.update(session, lambda cart: cart.update(promo_code=None))
+    return recalc_cart(cart)
 
 
 @app.post("/api/checkout")
-def checkout(payload: CheckoutRequest) -> dict[str, Any]:
+def checkout(payload: CheckoutRequest, session: str = Depends(cart_session)) -> dict[str, Any]:
     if payload.delivery_method == "courier" and not payload.address:
         raise HTTPException(status_code=422, detail="Для курьерской доставки нужен адрес")
 
-    try:
-        order = checkout_order(
-            cart=cart_state,
+    placed: dict[str, Any] = {}
+
+    def place_order(cart: dict[str, Any]) -> None:
+        # Заказ оформляется и корзина очищается в одной атомарной операции хранилища
+        placed["order"] = checkout_order(
+            cart=cart,
             full_name=payload.full_name,
             phone=payload.phone,
             delivery_method=payload.delivery_method,
             payment_method=payload.payment_method,
             address=payload.address,
+            session=session,
         )
+        cart.clear()
+        cart.update(empty_cart())
+
+    try:
+        cart_store.update(session, place_order)
     except ValueError as exc:
         raise HTTPException(status_code=400, detail=str(exc)) from exc
 
-    cart_state.update(empty_cart())
-    return {"message": "Заказ успешно оформлен", "order": order}
+    return {"message": "Заказ успешно оформлен", "order": placed["order"]}
 
 
 @app.post("/api/contact")
@@ -0,0 +1,324 @@
+from __future__ import annotations
+
+import functools
+import json
+import logging
+import os
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from collections import Counter
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Callable, Iterator, TypeVar
+
+METRICS_DIR = Path(os.environ.get("METRICS_DIR", os.path.join(tempfile.gettempdir(), "shop-metrics")))
+# Профилирование по заголовку включается только явно: оно замедляет весь процесс на время запроса
+PROFILING_ENABLED = os.environ.get("METRICS_PROFILING", "0") == "1"
+PROFILE_HEADER = "X-Profile"
+PROFILE_ID_HEADER = "X-Profile-Id"
+_FLUSH_INTERVAL = 1.0
+_SAMPLE_INTERVAL = 0.005
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+
+_HELP = {
+    "shop_http_request_duration_seconds": ("histogram", "Время обработки запроса по маршруту"),
+    "shop_http_response_size_bytes": ("histogram", "Размер тела ответа по маршруту"),
+    "shop_http_requests_in_flight": ("gauge", "Запросы в обработке"),
+    "shop_span_duration_seconds": ("histogram", "Время участков кода"),
+    "shop_jobs": ("gauge", "Задания очереди по статусам"),
+    "shop_jobs_lag_seconds": ("gauge", "Ожидание самого старого готового задания"),
+}
+
+logger = logging.getLogger(__name__)
+
+F = TypeVar("F", bound=Callable[..., Any])
+Labels = tuple[tuple[str, str], ...]
+
+
+class MetricsRegistry:
+    """Метрики процесса с агрегацией по всем воркерам gunicorn через файлы.
+
+    Каждый процесс держит счётчики в памяти и не чаще раза в секунду
+    сбрасывает снимок в ``METRICS_DIR/metrics-<pid>.json`` (запись через
+    переименование, поэтому читатель не увидит половину файла). Эндпоинт
+    метрик складывает снимки всех живых процессов; файлы завершившихся
+    процессов удаляются, и их счётчики для Prometheus выглядят как сброс.
+    """
+
+    def __init__(self, directory: Path = METRICS_DIR) -> None:
+        self._directory = directory
+        self._lock = threading.Lock()
+        # (метрика, метки) → счётчики по границам корзин, затем сумма и количество
+        self._histograms: dict[tuple[str, Labels], list[float]] = {}
+        self._buckets: dict[str, tuple[float, ...]] = {}
+        self._gauges: dict[tuple[str, Labels], float] = {}
+        self._next_flush = 0.0
+
+    def observe(self, name: str, value: float, buckets: tuple[float, ...], **labels: str) -> None:
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._buckets.setdefault(name, buckets)
+            series = self._histograms.get(key)
+            if series is None:
+                series = self._histograms[key] = [0.0] * (len(buckets) + 2)
+            for index, bound in enumerate(buckets):
+                if value <= bound:
+                    series[index] += 1
+                    break
+            series[-2] += value
+            series[-1] += 1
+
+    def add(self, name: str, delta: float, **labels: str) -> None:
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._gauges[key] = self._gauges.get(key, 0.0) + delta
+
+    @contextmanager
+    def span(self, name: str) -> Iterator[None]:
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe("shop_span_duration_seconds", time.perf_counter() - started, LATENCY_BUCKETS, span=name)
+
+    def timed(self, name: str) -> Callable[[F], F]:
+        """Декоратор: время каждого вызова функции попадает в span ``name``."""
+
+        def decorate(func: F) -> F:
+            @functools.wraps(func)
+            def wrapper(*args: Any, **kwargs: Any) -> Any:
+                with self.span(name):
+                    return func(*args, **kwargs)
+
+            return wrapper  # type: ignore[return-value]
+
+        return decorate
+
+    def _snapshot(self) -> dict[str, Any]:
+        with self._lock:
+            return {
+                "pid": os.getpid(),
+                "buckets": dict(self._buckets),
+                "histograms": [[name, labels, list(series)] for (name, labels), series in self._histograms.items()],
+                "gauges": [[name, labels, value] for (name, labels), value in self._gauges.items()],
+            }
+
+    def flush(self, force: bool = False) -> None:
+        now = time.monotonic()
+        if not force and now < self._next_flush:
+            return
+        self._next_flush = now + _FLUSH_INTERVAL
+        path = self._directory / f"metrics-{os.getpid()}.json"
+        temporary = path.with_suffix(".tmp")
+        try:
+            self._directory.mkdir(parents=True, exist_ok=True)
+            temporary.write_text(json.dumps(self._snapshot()), encoding="utf-8")
+            os.replace(temporary, path)
+        except OSError:
+            # Метрики не должны ронять запросы; этот процесс просто не виден в сводке
+            logger.warning("Не удалось записать метрики в %s", self._directory, exc_info=True)
+
+    def _snapshots(self) -> list[dict[str, Any]]:
+        snapshots = [self._snapshot()]
+        for path in self._directory.glob("metrics-*.json"):
+            try:
+                snapshot = json.loads(path.read_text(encoding="utf-8"))
+            except (OSError, ValueError):
+                continue
+            if snapshot["pid"] == os.getpid():
+                continue
+            if not _alive(snapshot["pid"]):
+                path.unlink(missing_ok=True)
+                continue
+            snapshots.append(snapshot)
+        return snapshots
+
+    def render(self, extra: list[tuple[str, Labels, float]] = ()) -> str:
+        """Текстовый формат Prometheus по всем процессам; ``extra`` — общие для всех значения."""
+        buckets: dict[str, tuple[float, ...]] = {}
+        histograms: dict[tuple[str, Labels], list[float]] = {}
+        gauges: dict[tuple[str, Labels], float] = {}
+        for snapshot in self._snapshots():
+            buckets.update({name: tuple(bounds) for name, bounds in snapshot["buckets"].items()})
+            for name, labels, series in snapshot["histograms"]:
+                key = (name, tuple(tuple(pair) for pair in labels))
+                total = histograms.setdefault(key, [0.0] * len(series))
+                if len(total) != len(series):
+                    # Процесс со старыми границами корзин (идёт перезапуск) — не смешиваем
+                    continue
+                for index, value in enumerate(series):
+                    total[index] += value
+            for name, labels, value in snapshot["gauges"]:
+                key = (name, tuple(tuple(pair) for pair in labels))
+                gauges[key] = gauges.get(key, 0.0) + value
+        for name, labels, value in extra:
+            gauges[(name, labels)] = value
+
+        lines: list[str] = []
+        for name in sorted({key[0] for key in histograms} | {key[0] for key in gauges}):
+            kind, description = _HELP.get(name, ("gauge", name))
+            lines.append(f"# HELP {name} {description}")
+            lines.append(f"# TYPE {name} {kind}")
+            for (metric, labels), series in sorted(histograms.items()):
+                if metric != name:
+                    continue
+                cumulative = 0.0
+                for bound, count in zip(buckets[name], series):
+                    cumulative += count
+                    lines.append(f"{name}_bucket{_labels(labels, le=_number(bound))} {_number(cumulative)}")
+                lines.append(f'{name}_bucket{_labels(labels, le="+Inf")} {_number(series[-1])}')
+                lines.append(f"{name}_sum{_labels(labels)} {series[-2]!r}")
+                lines.append(f"{name}_count{_labels(labels)} {_number(series[-1])}")
+            for (metric, labels), value in sorted(gauges.items()):
+                if metric == name:
+                    lines.append(f"{name}{_labels(labels)} {_number(value)}")
+        return "\n".join(lines) + "\n"
+
+
+def _alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def _number(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+def _labels(labels: Labels, **extra: str) -> str:
+    pairs = [*labels, *extra.items()]
+    if not pairs:
+        return ""
+    escaped = (
+        f'{key}="{str(value).replace(chr(92), chr(92) * 2).replace(chr(34), chr(92) + chr(34)).replace(chr(10), " ")}"'
+        for key, value in pairs
+    )
+    return "{" + ",".join(escaped) + "}"
+
+
+class StackSampler:
+    """Сэмплирующий профилировщик: раз в ``interval`` снимает стеки всех потоков процесса.
+
+    Синхронные эндпоинты выполняются в пуле потоков, поэтому снимаются все
+    потоки, кроме самого сэмплера; при параллельных запросах в профиль
+    попадут и они. Результат — свёрнутые стеки (формат flamegraph.pl).
+    """
+
+    def __init__(self, interval: float = _SAMPLE_INTERVAL) -> None:
+        self._interval = interval
+        self._stacks: Counter[str] = Counter()
+        self._stopping = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="profiler", daemon=True)
+
+    def _run(self) -> None:
+        own = threading.get_ident()
+        while not self._stopping.wait(self._interval):
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own:
+                    continue
+                stack: list[str] = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+                    frame = frame.f_back
+                self._stacks[";".join(reversed(stack))] += 1
+
+    def __enter__(self) -> StackSampler:
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc: Any) -> None:
+        self._stopping.set()
+        self._thread.join()
+
+    def collapsed(self) -> str:
+        return "".join(f"{stack} {count}\n" for stack, count in self._stacks.most_common())
+
+
+def load_profile(profile_id: str) -> str | None:
+    if not profile_id.isalnum():
+        return None
+    path = METRICS_DIR / "profiles" / f"{profile_id}.txt"
+    return path.read_text(encoding="utf-8") if path.exists() else None
+
+
+class MetricsMiddleware:
+    """ASGI-middleware: время, размер ответа и число запросов в обработке по маршрутам.
+
+    Маршрут берётся из шаблона пути FastAPI (``/api/products/{product_id}``),
+    поэтому число рядов не растёт от значений параметров.
+    """
+
+    def __init__(self, app: Callable[..., Any], registry: MetricsRegistry | None = None) -> None:
+        self.app = app
+        self.registry = registry or metrics
+
+    async def __call__(self, scope: dict[str, Any], receive: Callable[..., Any], send: Callable[..., Any]) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        registry = self.registry
+        method = scope["method"]
+        state = {"status": 500, "size": 0}
+        profile = PROFILING_ENABLED and _header(scope, PROFILE_HEADER) == "1"
+        sampler = StackSampler() if profile else None
+
+        async def send_wrapper(message: dict[str, Any]) -> None:
+            if message["type"] == "http.response.start":
+                state["status"] = message["status"]
+                if sampler is not None:
+                    # Идентификатор известен заранее, профиль сохраняется после ответа
+                    state["profile_id"] = uuid.uuid4().hex
+                    header = (PROFILE_ID_HEADER.lower().encode(), state["profile_id"].encode())
+                    message["headers"] = [*message.get("headers", []), header]
+            elif message["type"] == "http.response.body":
+                state["size"] += len(message.get("body", b""))
+            await send(message)
+
+        registry.add("shop_http_requests_in_flight", 1)
+        started = time.perf_counter()
+        try:
+            if sampler is not None:
+                with sampler:
+                    await self.app(scope, receive, send_wrapper)
+            else:
+                await self.app(scope, receive, send_wrapper)
+        finally:
+            elapsed = time.perf_counter() - started
+            route = getattr(scope.get("route"), "path", None) or "unmatched"
+            registry.add("shop_http_requests_in_flight", -1)
+            registry.observe(
+                "shop_http_request_duration_seconds", elapsed, LATENCY_BUCKETS,
+                method=method, route=route, status=str(state["status"]),
+            )
+            registry.observe("shop_http_response_size_bytes", state["size"], SIZE_BUCKETS, method=method, route=route)
+            if sampler is not None and "profile_id" in state:
+                _store_profile(state["profile_id"], sampler)
+            registry.flush()
+
+
+def _store_profile(profile_id: str, sampler: StackSampler) -> None:
+    directory = METRICS_DIR / "profiles"
+    directory.mkdir(parents=True, exist_ok=True)
+    (directory / f"{profile_id}.txt").write_text(sampler.collapsed(), encoding="utf-8")
+
+
+def _header(scope: dict[str, Any], name: str) -> str | None:
+    target = name.lower().encode()
+    for key, value in scope.get("headers", []):
+        if key == target:
+            return value.decode("latin-1")
+    return None
+
+
+metrics = MetricsRegistry()
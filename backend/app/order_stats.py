@@ -0,0 +1,158 @@
+from __future__ import annotations
+
+import sqlite3
+from datetime import date, datetime, timedelta
+from typing import Any
+
+from .db import db_path, transaction
+from .orders import OrderStore, order_store
+
+_SCHEMA = (
+    """
+    CREATE TABLE IF NOT EXISTS order_daily_stats (
+        day TEXT NOT NULL,
+        status TEXT NOT NULL,
+        orders INTEGER NOT NULL DEFAULT 0,
+        amount_cents INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (day, status)
+    ) WITHOUT ROWID
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS order_status_stats (
+        status TEXT PRIMARY KEY,
+        orders INTEGER NOT NULL DEFAULT 0,
+        amount_cents INTEGER NOT NULL DEFAULT 0
+    )
+    """,
+    "CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)",
+)
+
+def counts_as_revenue(status: str) -> bool:
+    return status.lower() != "отменен"
+
+
+def _bucket_key(day: date, bucket: str) -> str:
+    if bucket == "week":
+        return (day - timedelta(days=day.weekday())).isoformat()
+    if bucket == "month":
+        return day.strftime("%Y-%m")
+    return day.isoformat()
+
+
+class OrderStats:
+    """Накопительные агрегаты по заказам: итоги по статусам и по дням.
+
+    Агрегаты обновляются в той же транзакции, что и сам заказ (оформление
+    или смена статуса), поэтому чтение статистики не перебирает заказы:
+    это несколько строк по статусам и по одной строке на день периода.
+    Выручка и ряд по дням считаются по дате оформления заказа.
+    """
+
+    def __init__(self, store: OrderStore) -> None:
+        self._ready_for: str | None = None
+        store.subscribe(self)
+
+    def _setup(self) -> bool:
+        """Создаёт таблицы; возвращает True, если агрегаты только что пересчитаны из заказов."""
+        if self._ready_for == db_path():
+            return False
+        backfilled = False
+        with transaction() as conn:
+            for statement in _SCHEMA:
+                conn.execute(statement)
+            if not conn.execute("SELECT 1 FROM meta WHERE key = 'order_stats_built'").fetchone():
+                self._backfill(conn)
+                conn.execute("INSERT INTO meta (key, value) VALUES ('order_stats_built', '1')")
+                backfilled = True
+        self._ready_for = db_path()
+        return backfilled
+
+    @staticmethod
+    def _backfill(conn: sqlite3.Connection) -> None:
+        # Заказы, оформленные до появления агрегатов, учитываются один раз
+        if not conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'orders'").fetchone():
+            return
+        conn.execute(
+            """
+            INSERT INTO order_daily_stats (day, status, orders, amount_cents)
+            SELECT date, status, COUNT(*), SUM(CAST(ROUND(json_extract(data, '$.total') * 100) AS INTEGER))
+            FROM orders GROUP BY date, status
+            """
+        )
+        conn.execute(
+            """
+            INSERT INTO order_status_stats (status, orders, amount_cents)
+            SELECT status, SUM(orders), SUM(amount_cents) FROM order_daily_stats GROUP BY status
+            """
+        )
+
+    def apply(self, conn: sqlite3.Connection, old: dict[str, Any] | None, new: dict[str, Any]) -> None:
+        if self._setup():
+            # Пересчёт внутри этой же транзакции уже учёл изменённый заказ
+            return
+        if old is not None:
+            self._add(conn, old, -1)
+        self._add(conn, new, 1)
+
+    @staticmethod
+    def _add(conn: sqlite3.Connection, order: dict[str, Any], sign: int) -> None:
+        amount = round(float(order.get("total", 0)) * 100) * sign
+        conn.execute(
+            """
+            INSERT INTO order_daily_stats (day, status, orders, amount_cents) VALUES (?, ?, ?, ?)
+            ON CONFLICT (day, status) DO UPDATE SET
+                orders = orders + excluded.orders,
+                amount_cents = amount_cents + excluded.amount_cents
+            """,
+            (order["date"], order["status"], sign, amount),
+        )
+        conn.execute(
+            """
+            INSERT INTO order_status_stats (status, orders, amount_cents) VALUES (?, ?, ?)
+            ON CONFLICT (status) DO UPDATE SET
+                orders = orders + excluded.orders,
+                amount_cents = amount_cents + excluded.amount_cents
+            """,
+            (order["status"], sign, amount),
+        )
+
+    def summary(self, days: int = 30, bucket: str = "day", today: date | None = None) -> dict[str, Any]:
+        self._setup()
+        # Дата заказа записывается по UTC, поэтому и период отсчитывается по UTC
+        today = today or datetime.utcnow().date()
+        start = today - timedelta(days=days - 1)
+        with transaction("DEFERRED") as conn:
+            statuses = conn.execute(
+                "SELECT status, orders, amount_cents FROM order_status_stats WHERE orders > 0"
+            ).fetchall()
+            daily = conn.execute(
+                "SELECT day, status, orders, amount_cents FROM order_daily_stats WHERE day >= ? AND day <= ?",
+                (start.isoformat(), today.isoformat()),
+            ).fetchall()
+
+        series: dict[str, dict[str, Any]] = {}
+        for offset in range(days):
+            key = _bucket_key(start + timedelta(days=offset), bucket)
+            series.setdefault(key, {"date": key, "orders": 0, "revenue_cents": 0})
+        for row in daily:
+            point = series[_bucket_key(date.fromisoformat(row["day"]), bucket)]
+            point["orders"] += row["orders"]
+            if counts_as_revenue(row["status"]):
+                point["revenue_cents"] += row["amount_cents"]
+
+        revenue_cents = sum(row["amount_cents"] for row in statuses if counts_as_revenue(row["status"]))
+        return {
+            "revenue": revenue_cents / 100,
+            "ordersCount": sum(row["orders"] for row in statuses),
+            "byStatus": {
+                row["status"]: {"orders": row["orders"], "total": row["amount_cents"] / 100} for row in statuses
+            },
+            "series": [
+                {"date": point["date"], "orders": point["orders"], "revenue": point["revenue_cents"] / 100}
+                for point in series.values()
+            ],
+            "bucket": bucket,
+        }
+
+
+order_stats = OrderStats(order_store)
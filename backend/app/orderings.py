@@ -0,0 +1,144 @@
+from __future__ import annotations
+
+import base64
+import json
+import threading
+from bisect import bisect_right, insort
+from typing import Any, Callable, Iterable
+
+from .catalog import CatalogRepository, FrozenRecord, catalog
+from .popularity import PopularityTracker, popularity
+
+# Ключ сортировки всегда заканчивается на -id: это делает его уникальным
+# и сохраняет прежний порядок при равных значениях (сначала новые товары)
+SORT_KEYS: dict[str, Callable[[FrozenRecord], tuple[Any, ...]]] = {
+    "new": lambda item: (-item["id"],),
+    "price_asc": lambda item: (item["price"], -item["id"]),
+    "price_desc": lambda item: (-item["price"], -item["id"]),
+    "popular": lambda item: (-popularity.score(item), -item["id"]),
+}
+# Режимы, чей ключ зависит не только от записи, но и от сигналов популярности
+POPULARITY_SORTS = ("popular",)
+
+
+_KEY_SIZES = {"new": 1, "price_asc": 2, "price_desc": 2, "popular": 2}
+
+
+def encode_cursor(sort: str, key: tuple[Any, ...]) -> str:
+    raw = json.dumps([sort, *key], separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(sort: str, cursor: str) -> tuple[Any, ...]:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        cursor_sort, *key = json.loads(raw)
+    except (ValueError, TypeError):
+        raise ValueError("Некорректный курсор") from None
+    if cursor_sort != sort or len(key) != _KEY_SIZES[sort]:
+        raise ValueError("Курсор относится к другой сортировке")
+    if not all(isinstance(value, (int, float)) for value in key):
+        raise ValueError("Некорректный курсор")
+    return tuple(key)
+
+
+class CatalogOrderings:
+    """Заранее отсортированные порядки каталога для каждого режима сортировки.
+
+    Порядки обновляются точечно при изменении товара, поэтому страница
+    выборки не требует пересортировки: либо идём по готовому порядку и
+    отбираем нужные id, либо (для маленькой выборки) сортируем только её.
+    """
+
+    def __init__(self, repository: CatalogRepository, tracker: PopularityTracker) -> None:
+        self._repository = repository
+        self._tracker = tracker
+        self._lock = threading.Lock()
+        self._orders: dict[str, list[tuple[Any, ...]]] = {sort: [] for sort in SORT_KEYS}
+        self._keys: dict[int, dict[str, tuple[Any, ...]]] = {}
+        repository.subscribe(self)
+        tracker.subscribe(self.rescore)
+
+    def reset(self, records: Iterable[FrozenRecord]) -> None:
+        with self._lock:
+            self._keys = {record["id"]: _record_keys(record) for record in records}
+            self._orders = {
+                sort: sorted(keys[sort] for keys in self._keys.values()) for sort in SORT_KEYS
+            }
+
+    def apply(self, old: FrozenRecord | None, new: FrozenRecord | None) -> None:
+        with self._lock:
+            if old is not None:
+                for sort, key in self._keys.pop(old["id"], {}).items():
+                    _remove_sorted(self._orders[sort], key)
+            if new is not None:
+                keys = self._keys[new["id"]] = _record_keys(new)
+                for sort, key in keys.items():
+                    insort(self._orders[sort], key)
+
+    def rescore(self, product_ids: Iterable[int]) -> None:
+        """Переставляет товары, у которых изменилась популярность."""
+        records = self._repository.get_many(product_ids)
+        with self._lock:
+            for record in records:
+                keys = self._keys.get(record["id"])
+                if keys is None:
+                    continue
+                for sort in POPULARITY_SORTS:
+                    key = SORT_KEYS[sort](record)
+                    if key != keys[sort]:
+                        _remove_sorted(self._orders[sort], keys[sort])
+                        insort(self._orders[sort], key)
+                        keys[sort] = key
+
+    def page(
+        self,
+        sort: str,
+        ids: set[int] | None,
+        limit: int | None,
+        offset: int = 0,
+        after: tuple[Any, ...] | None = None,
+    ) -> tuple[list[int], tuple[Any, ...] | None]:
+        """Возвращает id товаров страницы и ключ последнего из них, если дальше есть ещё."""
+        self._repository.sync()
+        if sort in POPULARITY_SORTS:
+            self._tracker.sync()
+        with self._lock:
+            order = self._orders[sort]
+            start = bisect_right(order, after) if after is not None else 0
+            wanted = None if limit is None else offset + limit + 1
+
+            if ids is None:
+                window = order[start + offset:None if wanted is None else start + wanted]
+            elif wanted is not None and ids and wanted * len(order) <= len(ids) * len(ids):
+                # Выборка большая: идём по готовому порядку и выходим, набрав страницу
+                window = []
+                for position in range(start, len(order)):
+                    key = order[position]
+                    if -key[-1] in ids:
+                        window.append(key)
+                        if len(window) >= wanted:
+                            break
+                window = window[offset:]
+            else:
+                subset = sorted(self._keys[pid][sort] for pid in ids if pid in self._keys)
+                subset_start = bisect_right(subset, after) if after is not None else 0
+                window = subset[subset_start + offset:None if wanted is None else subset_start + wanted]
+
+        has_more = limit is not None and len(window) > limit
+        window = window[:limit] if limit is not None else window
+        last_key = window[-1] if has_more and window else None
+        return [-key[-1] for key in window], last_key
+
+
+def _record_keys(record: FrozenRecord) -> dict[str, tuple[Any, ...]]:
+    return {sort: key(record) for sort, key in SORT_KEYS.items()}
+
+
+def _remove_sorted(order: list[tuple[Any, ...]], key: tuple[Any, ...]) -> None:
+    position = bisect_right(order, key) - 1
+    if position >= 0 and order[position] == key:
+        del order[position]
+
+
+orderings = CatalogOrderings(catalog, popularity)
@@ -0,0 +1,156 @@
+from __future__ import annotations
+
+import json
+import re
+import sqlite3
+from datetime import datetime
+from typing import Any, Protocol
+
+from .db import db_path, get_connection, transaction
+from .ids import id_allocator
+
+_SCHEMA = (
+    """
+    CREATE TABLE IF NOT EXISTS orders (
+        id TEXT PRIMARY KEY,
+        seq INTEGER NOT NULL UNIQUE,
+        status TEXT NOT NULL,
+        date TEXT NOT NULL,
+        phone TEXT NOT NULL DEFAULT '',
+        data TEXT NOT NULL
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS idx_orders_status ON orders (status, seq)",
+    "CREATE INDEX IF NOT EXISTS idx_orders_date ON orders (date, seq)",
+    "CREATE INDEX IF NOT EXISTS idx_orders_phone ON orders (phone, seq)",
+)
+
+DEFAULT_PAGE_SIZE = 50
+
+
+def normalize_phone(phone: str | None) -> str:
+    return re.sub(r"\D", "", phone or "")
+
+
+def _decode_cursor(cursor: str) -> int:
+    try:
+        return int(cursor)
+    except ValueError:
+        raise ValueError("Некорректный курсор") from None
+
+
+class OrderListener(Protocol):
+    def apply(self, conn: sqlite3.Connection, old: dict[str, Any] | None, new: dict[str, Any]) -> None:
+        """Вызывается внутри транзакции записи заказа, поэтому изменение и его последствия атомарны."""
+        ...
+
+
+class OrderStore:
+    """Заказы в SQLite с индексами по id, статусу, дате и телефону.
+
+    Порядок списка — по номеру заказа от новых к старым; страницы
+    выбираются курсором по номеру, поэтому их стоимость не зависит от
+    глубины. Смена статуса — одна запись по первичному ключу.
+    """
+
+    def __init__(self) -> None:
+        self._ready_for: str | None = None
+        self._listeners: list[OrderListener] = []
+
+    def subscribe(self, listener: OrderListener) -> None:
+        self._listeners.append(listener)
+
+    def _setup(self) -> None:
+        if self._ready_for == db_path():
+            return
+        with transaction() as conn:
+            for statement in _SCHEMA:
+                conn.execute(statement)
+        self._ready_for = db_path()
+
+    def _notify(self, conn: sqlite3.Connection, old: dict[str, Any] | None, new: dict[str, Any]) -> None:
+        for listener in self._listeners:
+            listener.apply(conn, old, new)
+
+    def create(self, fields: dict[str, Any]) -> dict[str, Any]:
+        self._setup()
+        now = datetime.utcnow()
+        with transaction() as conn:
+            seq = id_allocator.allocate("orders")
+            order = {
+                "id": f"A-{now.year}-{seq:04d}",
+                "date": now.date().isoformat(),
+                "status": "Принят",
+                **fields,
+            }
+            conn.execute(
+                "INSERT INTO orders (id, seq, status, date, phone, data) VALUES (?, ?, ?, ?, ?, ?)",
+                (
+                    order["id"],
+                    seq,
+                    order["status"],
+                    order["date"],
+                    normalize_phone(order.get("phone")),
+                    json.dumps(order, ensure_ascii=False),
+                ),
+            )
+            self._notify(conn, None, order)
+        return order
+
+    def get(self, order_id: str) -> dict[str, Any] | None:
+        self._setup()
+        row = get_connection().execute("SELECT data FROM orders WHERE id = ?", (order_id,)).fetchone()
+        return json.loads(row["data"]) if row else None
+
+    def set_status(self, order_id: str, status: str) -> dict[str, Any] | None:
+        self._setup()
+        with transaction() as conn:
+            row = conn.execute("SELECT data FROM orders WHERE id = ?", (order_id,)).fetchone()
+            if not row:
+                return None
+            old = json.loads(row["data"])
+            order = {**old, "status": status}
+            conn.execute(
+                "UPDATE orders SET status = ?, data = json_set(data, '$.status', ?) WHERE id = ?",
+                (status, status, order_id),
+            )
+            self._notify(conn, old, order)
+        return order
+
+    def list(
+        self,
+        status: str | None = None,
+        date_from: str | None = None,
+        date_to: str | None = None,
+        phone: str | None = None,
+        limit: int = DEFAULT_PAGE_SIZE,
+        cursor: str | None = None,
+    ) -> dict[str, Any]:
+        self._setup()
+        conditions: list[str] = []
+        params: list[Any] = []
+        for clause, value in (
+            ("status = ?", status),
+            ("date >= ?", date_from),
+            ("date <= ?", date_to),
+            ("phone = ?", normalize_phone(phone) if phone else None),
+            ("seq < ?", _decode_cursor(cursor) if cursor else None),
+        ):
+            if value is not None:
+                conditions.append(clause)
+                params.append(value)
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        rows = get_connection().execute(
+            f"SELECT seq, data FROM orders {where} ORDER BY seq DESC LIMIT ?", (*params, limit + 1)
+        ).fetchall()
+
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+        return {
+            "items": [json.loads(row["data"]) for row in rows],
+            "limit": limit,
+            "next_cursor": str(rows[-1]["seq"]) if has_more else None,
+        }
+
+
+order_store = OrderStore()
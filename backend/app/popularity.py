@@ -0,0 +1,190 @@
+from __future__ import annotations
+
+import threading
+import time
+from collections import Counter
+from typing import Any, Callable, Iterable
+
+from .db import db_path, get_connection, transaction
+
+# Покупка весит заметно больше просмотра карточки
+SOLD_WEIGHT = 10.0
+VIEW_WEIGHT = 1.0
+# Просмотры копятся в памяти и сбрасываются в базу пачкой
+VIEW_FLUSH_INTERVAL = 2.0
+_VIEW_FLUSH_SIZE = 200
+
+_SCHEMA = (
+    """
+    CREATE TABLE IF NOT EXISTS product_stats (
+        product_id INTEGER PRIMARY KEY,
+        views INTEGER NOT NULL DEFAULT 0,
+        sold INTEGER NOT NULL DEFAULT 0,
+        version INTEGER NOT NULL DEFAULT 0
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS idx_product_stats_version ON product_stats (version)",
+    # Заказы, продажи которых уже учтены: повтор задания order_placed не считает их дважды
+    "CREATE TABLE IF NOT EXISTS popularity_orders (order_id TEXT PRIMARY KEY)",
+    "CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)",
+    "INSERT OR IGNORE INTO meta (key, value) VALUES ('popularity_version', '0')",
+)
+
+
+class PopularityTracker:
+    """Сигналы популярности товаров: просмотры и проданные штуки.
+
+    Счётчики хранятся в SQLite и общие для всех воркеров. Просмотры копятся
+    в памяти и сбрасываются пачкой — по размеру пачки и периодической
+    задачей очереди заданий (а также при остановке), продажи пишутся сразу
+    вместе с отметкой об учтённом заказе. Каждый сброс
+    помечается версией, поэтому воркер подтягивает только изменившиеся
+    товары. Подписчики (упорядочивания каталога, поиск) получают id
+    товаров, чей вес изменился, и точечно переставляют их.
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.RLock()
+        self._ready_for: str | None = None
+        self._version: int | None = None
+        self._stats: dict[int, tuple[int, int]] = {}
+        self._pending_views: Counter[int] = Counter()
+        self._last_flush = time.monotonic()
+        self._listeners: list[Callable[[Iterable[int]], None]] = []
+
+    def subscribe(self, listener: Callable[[Iterable[int]], None]) -> None:
+        self._listeners.append(listener)
+
+    def _setup(self) -> None:
+        if self._ready_for == db_path():
+            return
+        with transaction() as conn:
+            for statement in _SCHEMA:
+                conn.execute(statement)
+        with self._lock:
+            self._ready_for = db_path()
+            self._version = None
+            self._stats = {}
+
+    @staticmethod
+    def _current_version(conn: Any) -> int:
+        return conn.execute(
+            "SELECT CAST(value AS INTEGER) FROM meta WHERE key = 'popularity_version'"
+        ).fetchone()[0]
+
+    def sync(self) -> None:
+        self._setup()
+        conn = get_connection()
+        if self._version == self._current_version(conn):
+            return
+
+        with self._lock, transaction("DEFERRED") as conn:
+            version = self._current_version(conn)
+            if self._version == version:
+                return
+            rows = conn.execute(
+                "SELECT product_id, views, sold FROM product_stats WHERE version > ?",
+                (self._version if self._version is not None else -1,),
+            ).fetchall()
+            for row in rows:
+                self._stats[row["product_id"]] = (row["views"], row["sold"])
+            initial = self._version is None
+            self._version = version
+
+        if not initial:
+            self._notify(row["product_id"] for row in rows)
+
+    def _notify(self, product_ids: Iterable[int]) -> None:
+        # Вызывается вне своей блокировки: подписчики берут собственные
+        product_ids = list(product_ids)
+        if not product_ids:
+            return
+        for listener in self._listeners:
+            listener(product_ids)
+
+    @property
+    def version(self) -> int:
+        self.sync()
+        return self._version or 0
+
+    def score(self, record: dict[str, Any]) -> float:
+        if self._version is None:
+            self.sync()
+        # Учитываются только сброшенные в базу счётчики, поэтому все воркеры
+        # ранжируют одинаково, а порядок меняется не чаще раза в пару секунд
+        views, sold = self._stats.get(record["id"], (0, 0))
+        base = float(record.get("popularity", 0) or 0)
+        return base + SOLD_WEIGHT * sold + VIEW_WEIGHT * views
+
+    def record_view(self, product_id: int) -> None:
+        self._setup()
+        with self._lock:
+            self._pending_views[product_id] += 1
+            due = (
+                len(self._pending_views) >= _VIEW_FLUSH_SIZE
+                or time.monotonic() - self._last_flush >= VIEW_FLUSH_INTERVAL
+            )
+        if due:
+            self.flush()
+
+    def record_order(self, items: Iterable[dict[str, Any]], order_id: str | None = None) -> None:
+        """Учитывает продажи заказа; заказ с уже учтённым ``order_id`` пропускается."""
+        sold = Counter()
+        for item in items:
+            sold[int(item["product_id"])] += int(item["qty"])
+        self.flush(sold, order_id)
+
+    def flush(self, sold: Counter[int] | None = None, order_id: str | None = None) -> None:
+        self._setup()
+        with self._lock:
+            views = self._pending_views
+            self._pending_views = Counter()
+            self._last_flush = time.monotonic()
+        try:
+            self._write(views, sold or Counter(), order_id)
+        except Exception:
+            # Несохранённые просмотры вернутся в следующую пачку
+            with self._lock:
+                self._pending_views.update(views)
+            raise
+
+    def _write(self, views: Counter[int], sold: Counter[int], order_id: str | None) -> None:
+        if not views and not sold:
+            return
+
+        with transaction() as conn:
+            if order_id is not None and sold:
+                recorded = conn.execute(
+                    "INSERT OR IGNORE INTO popularity_orders (order_id) VALUES (?)", (order_id,)
+                ).rowcount
+                if not recorded:
+                    sold = Counter()
+            changed = set(views) | set(sold)
+            if not changed:
+                return
+            conn.execute("UPDATE meta SET value = CAST(value AS INTEGER) + 1 WHERE key = 'popularity_version'")
+            version = self._current_version(conn)
+            totals = [
+                conn.execute(
+                    """
+                    INSERT INTO product_stats (product_id, views, sold, version) VALUES (?, ?, ?, ?)
+                    ON CONFLICT (product_id) DO UPDATE SET
+                        views = views + excluded.views,
+                        sold = sold + excluded.sold,
+                        version = excluded.version
+                    RETURNING product_id, views, sold
+                    """,
+                    (product_id, views.get(product_id, 0), sold.get(product_id, 0), version),
+                ).fetchone()
+                for product_id in sorted(changed)
+            ]
+
+        with self._lock:
+            for row in totals:
+                self._stats[row["product_id"]] = (row["views"], row["sold"])
+            if self._version is not None and self._version + 1 == version:
+                self._version = version
+        self._notify(changed)
+
+
+popularity = PopularityTracker()
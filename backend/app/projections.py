@@ -0,0 +1,132 @@
+from __future__ import annotations
+
+import threading
+from typing import Any, Iterable, Mapping
+
+from .catalog import CatalogRepository, FrozenRecord, catalog
+from .images import image_store
+from .schemas import Product
+from .stock import stock_levels
+
+# Поля, которые показывает карточка товара в списках
+CARD_FIELDS = (
+    "id",
+    "name",
+    "price",
+    "old_price",
+    "image",
+    "category",
+    "brand",
+    "slug",
+    "is_popular",
+    "in_stock",
+    "stock",
+)
+
+
+def _card(record: FrozenRecord) -> FrozenRecord:
+    return FrozenRecord({key: record[key] for key in CARD_FIELDS if key in record})
+
+
+def parse_fields(raw: str | None) -> tuple[str, ...] | None:
+    if not raw:
+        return None
+    fields = [name.strip() for name in raw.split(",") if name.strip()]
+    # id нужен клиенту всегда, чтобы ссылаться на товар
+    return tuple(dict.fromkeys(["id", *fields]))
+
+
+def _stock_fields(record: Any, available: int) -> dict[str, Any]:
+    return {"stock": available, "in_stock": bool(record.get("in_stock", True)) and available > 0}
+
+
+class CardProjections:
+    """Готовые облегчённые карточки товаров, обновляются вместе с каталогом.
+
+    Для выдачи запись дополняется остатком (``stock``, ``in_stock``) и
+    локальными адресами изображений с ``image_srcset``; дополненная копия
+    переиспользуется, пока не изменились запись, остаток или набор
+    загруженных изображений.
+    """
+
+    def __init__(self, repository: CatalogRepository) -> None:
+        self._lock = threading.Lock()
+        self._cards: dict[int, tuple[FrozenRecord, FrozenRecord]] = {}
+        self._presented: dict[tuple[int, bool], tuple[FrozenRecord, int | None, int, FrozenRecord]] = {}
+        repository.subscribe(self)
+
+    def reset(self, records: Iterable[FrozenRecord]) -> None:
+        with self._lock:
+            self._cards = {record["id"]: (record, _card(record)) for record in records}
+            self._presented = {}
+
+    def apply(self, old: FrozenRecord | None, new: FrozenRecord | None) -> None:
+        with self._lock:
+            if old is not None:
+                self._cards.pop(old["id"], None)
+                self._presented.pop((old["id"], False), None)
+                self._presented.pop((old["id"], True), None)
+            if new is not None:
+                self._cards[new["id"]] = (new, _card(new))
+
+    def card(self, record: FrozenRecord) -> FrozenRecord:
+        cached = self._cards.get(record["id"])
+        # Карточка годится, только если построена из этой же версии записи
+        if cached is not None and cached[0] is record:
+            return cached[1]
+        return _card(record)
+
+    def present(
+        self,
+        record: FrozenRecord,
+        levels: Mapping[int, int],
+        images_version: int,
+        card: bool = False,
+    ) -> FrozenRecord:
+        available = levels.get(record["id"])
+        key = (record["id"], card)
+        cached = self._presented.get(key)
+        if cached is not None and cached[0] is record and cached[1] == available and cached[2] == images_version:
+            return cached[3]
+        presented = image_store.rewrite(self.card(record) if card else record)
+        if available is not None:
+            presented = FrozenRecord({**presented, **_stock_fields(record, available)})
+        with self._lock:
+            self._presented[key] = (record, available, images_version, presented)
+        return presented
+
+
+def product_shape(record: Mapping[str, Any]) -> dict[str, Any]:
+    """Запись в форме схемы ``Product``: только её поля, отсутствующие — со значениями по умолчанию."""
+    return {
+        name: record[name] if name in record else field.get_default(call_default_factory=True)
+        for name, field in Product.model_fields.items()
+        if name in record or not field.is_required()
+    }
+
+
+def present(record: FrozenRecord) -> FrozenRecord:
+    return card_projections.present(record, stock_levels.levels(), image_store.version)
+
+
+def project(
+    items: Iterable[FrozenRecord],
+    view: str = "full",
+    fields: tuple[str, ...] | None = None,
+) -> list[Any]:
+    levels = stock_levels.levels()
+    images_version = image_store.version
+    if fields:
+        projected = []
+        for item in items:
+            row = {key: item[key] for key in fields if key in item}
+            if "image" in row or "photos" in row:
+                row = image_store.rewrite(row)
+            if item["id"] in levels:
+                row.update({key: value for key, value in _stock_fields(item, levels[item["id"]]).items() if key in fields})
+            projected.append(row)
+        return projected
+    return [card_projections.present(item, levels, images_version, card=view == "card") for item in items]
+
+
+card_projections = CardProjections(catalog)
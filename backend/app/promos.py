@@ -0,0 +1,245 @@
+from __future__ import annotations
+
+import threading
+import time
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+from typing import Any, Callable, Iterable, Mapping
+
+from .data import promo_codes
+from .db import db_path, transaction
+
+PROMO_MEMO_SIZE = 4096
+PROMO_TYPES = ("percent", "fixed", "bogo")
+
+# Скидка в копейках по строкам области действия: (product_id, qty, цена в копейках)
+Evaluator = Callable[[list[tuple[int, int, int]]], int]
+
+_SCHEMA = (
+    """
+    CREATE TABLE IF NOT EXISTS promo_usage (
+        code TEXT NOT NULL,
+        customer TEXT NOT NULL,
+        uses INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (code, customer)
+    )
+    """,
+)
+# Строка с пустым customer — общий счётчик применений кода
+_TOTAL = ""
+
+
+class PromoLimitError(ValueError):
+    pass
+
+
+def _parse_moment(value: str | None) -> float | None:
+    """Срок «2026-12-31» действует до конца дня, время без пояса считается UTC."""
+    if not value:
+        return None
+    moment = datetime.fromisoformat(value)
+    if len(value) == 10:
+        moment += timedelta(days=1)
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=timezone.utc)
+    return moment.timestamp()
+
+
+def _percent(value: float) -> Evaluator:
+    return lambda lines: round(sum(qty * price for _, qty, price in lines) * value / 100)
+
+
+def _fixed(value: float) -> Evaluator:
+    cents = round(value * 100)
+    return lambda lines: min(cents, sum(qty * price for _, qty, price in lines))
+
+
+def _bogo(buy: int, get: int) -> Evaluator:
+    # Из каждых buy + get единиц в области действия бесплатны get самых дешёвых
+    def evaluate(lines: list[tuple[int, int, int]]) -> int:
+        free = sum(qty for _, qty, _ in lines) // (buy + get) * get
+        discount = 0
+        for _, qty, price in sorted(lines, key=lambda line: line[2]):
+            if free <= 0:
+                break
+            taken = min(qty, free)
+            discount += taken * price
+            free -= taken
+        return discount
+
+    return evaluate
+
+
+@dataclass(frozen=True)
+class PromoRule:
+    code: str
+    evaluate: Evaluator
+    product_ids: frozenset[int]
+    categories: frozenset[str]
+    min_subtotal_cents: int
+    expires_at: float | None
+    per_customer_limit: int | None
+    max_uses: int | None
+
+    @property
+    def scoped(self) -> bool:
+        return bool(self.product_ids or self.categories)
+
+
+def compile_rule(code: str, spec: Mapping[str, Any]) -> PromoRule:
+    """Переводит описание промокода из ``promo_codes`` в правило с готовой функцией скидки.
+
+    Поля описания: ``type`` (percent, fixed или bogo), ``value``, для bogo —
+    ``buy`` и ``get``; необязательные ``categories`` и ``product_ids``
+    ограничивают действие товарами, ``min_subtotal`` — порог суммы корзины в
+    рублях, ``expires_at`` — дата окончания, ``per_customer_limit`` и
+    ``max_uses`` — лимиты применений на покупателя и всего.
+    """
+    kind = spec.get("type")
+    if kind == "percent":
+        evaluate = _percent(float(spec["value"]))
+    elif kind == "fixed":
+        evaluate = _fixed(float(spec["value"]))
+    elif kind == "bogo":
+        buy, get = int(spec.get("buy", 1)), int(spec.get("get", 1))
+        if buy < 1 or get < 1:
+            raise ValueError(f"Промокод {code}: buy и get должны быть положительными")
+        evaluate = _bogo(buy, get)
+    else:
+        raise ValueError(f"Промокод {code}: неизвестный тип {kind!r}")
+    return PromoRule(
+        code=code,
+        evaluate=evaluate,
+        product_ids=frozenset(int(product_id) for product_id in spec.get("product_ids", ())),
+        categories=frozenset(spec.get("categories", ())),
+        min_subtotal_cents=round(float(spec.get("min_subtotal", 0)) * 100),
+        expires_at=_parse_moment(spec.get("expires_at")),
+        per_customer_limit=spec.get("per_customer_limit"),
+        max_uses=spec.get("max_uses"),
+    )
+
+
+class PromoEngine:
+    """Промокоды, скомпилированные в правила, и атомарные счётчики их применений.
+
+    Описания из ``promo_codes`` компилируются один раз при создании движка;
+    правила с ограничением по товарам или категориям попадают в индексы
+    ``product_id → коды`` и ``категория → коды``. Скидка считается только по
+    строкам корзины, которых касается правило, и запоминается по этим
+    строкам: изменение корзины вне области действия промокода берёт
+    готовый результат, а не пересчитывает правило.
+
+    Счётчики применений лежат в SQLite и увеличиваются условным ``UPDATE
+    ... WHERE uses < лимит`` в транзакции оформления заказа, поэтому лимит
+    не превышается при оформлении в нескольких воркерах одновременно.
+    """
+
+    def __init__(self, specs: Mapping[str, Mapping[str, Any]]) -> None:
+        self._rules = {code.upper(): compile_rule(code.upper(), spec) for code, spec in specs.items()}
+        self._by_product: dict[int, set[str]] = {}
+        self._by_category: dict[str, set[str]] = {}
+        for rule in self._rules.values():
+            for product_id in rule.product_ids:
+                self._by_product.setdefault(product_id, set()).add(rule.code)
+            for category in rule.categories:
+                self._by_category.setdefault(category, set()).add(rule.code)
+        self._lock = threading.Lock()
+        self._memo: dict[tuple[Any, ...], int] = {}
+        self._ready_for: str | None = None
+
+    def _setup(self) -> None:
+        if self._ready_for == db_path():
+            return
+        with transaction() as conn:
+            for statement in _SCHEMA:
+                conn.execute(statement)
+        self._ready_for = db_path()
+
+    def __contains__(self, code: str) -> bool:
+        return code in self._rules
+
+    def codes_for(self, product_id: int, category: str | None) -> set[str]:
+        """Коды с ограниченной областью действия, которые касаются товара."""
+        return self._by_product.get(product_id, set()) | self._by_category.get(category or "", set())
+
+    def check(self, code: str, now: float | None = None) -> PromoRule:
+        rule = self._rules.get(code)
+        if rule is None:
+            raise LookupError("Промокод не найден")
+        if rule.expires_at is not None and (now if now is not None else time.time()) >= rule.expires_at:
+            raise ValueError("Срок действия промокода истёк")
+        return rule
+
+    def evaluate(
+        self,
+        code: str,
+        lines: Iterable[Mapping[str, Any]],
+        products: Mapping[int, Mapping[str, Any]],
+        subtotal_cents: int,
+    ) -> tuple[int, str | None]:
+        """Скидка в копейках по коду для строк корзины и причина, если код не сработал."""
+        try:
+            rule = self.check(code)
+        except (LookupError, ValueError) as exc:
+            return 0, str(exc)
+        if subtotal_cents < rule.min_subtotal_cents:
+            return 0, f"Промокод действует от {rule.min_subtotal_cents // 100} ₽"
+
+        scope = tuple(
+            (line["product_id"], max(1, int(line.get("qty", 1))), int(line.get("price", 0)))
+            for line in lines
+            if line["product_id"] in products
+            and (
+                not rule.scoped
+                or code in self.codes_for(line["product_id"], products[line["product_id"]].get("category"))
+            )
+        )
+        if not scope:
+            return 0, "В корзине нет товаров, на которые действует промокод"
+
+        key = (code, scope)
+        with self._lock:
+            discount = self._memo.get(key)
+        if discount is None:
+            discount = min(rule.evaluate(list(scope)), subtotal_cents)
+            with self._lock:
+                if len(self._memo) >= PROMO_MEMO_SIZE:
+                    self._memo.clear()
+                self._memo[key] = discount
+        return discount, None
+
+    def redeem(self, code: str, customer: str) -> None:
+        """Учитывает применение кода покупателем; при исчерпанном лимите бросает PromoLimitError.
+
+        Вызывается внутри транзакции оформления заказа: если заказ не
+        создан, применение не засчитывается.
+        """
+        rule = self.check(code)
+        self._setup()
+        limits = ((customer, rule.per_customer_limit), (_TOTAL, rule.max_uses))
+        with transaction() as conn:
+            for who, limit in limits:
+                if limit is None:
+                    continue
+                conn.execute(
+                    "INSERT OR IGNORE INTO promo_usage (code, customer, uses) VALUES (?, ?, 0)", (code, who)
+                )
+                updated = conn.execute(
+                    "UPDATE promo_usage SET uses = uses + 1 WHERE code = ? AND customer = ? AND uses < ?",
+                    (code, who, limit),
+                ).rowcount
+                if not updated:
+                    raise PromoLimitError(
+                        "Промокод уже использован" if who != _TOTAL else "Лимит применений промокода исчерпан"
+                    )
+
+    def usage(self, code: str, customer: str = _TOTAL) -> int:
+        self._setup()
+        with transaction("DEFERRED") as conn:
+            row = conn.execute(
+                "SELECT uses FROM promo_usage WHERE code = ? AND customer = ?", (code, customer)
+            ).fetchone()
+        return row["uses"] if row else 0
+
+
+promo_engine = PromoEngine(promo_codes)
@@ -1,6 +1,6 @@
 from __future__ import annotations
 
-from typing import Any, Literal, Optional, List
+from typing import Any, Dict, Literal, Optional, List
 
 from pydantic import BaseModel, Field
 
@@ -23,9 +23,13 @@ class Product(BaseModel):
     category: str
     description: Optional[str] = None
     is_popular: bool = False
+    in_stock: bool = True
+    stock: Optional[int] = None
     photos: List[str] = []
     specs: List[ProductSpec] = []
     reviews: List[Review] = []
+    image_srcset: Dict[str, str] = {}
+    photos_srcset: List[Dict[str, str]] = []
 
 class CartItemInput(BaseModel):
     product_id: int
@@ -34,6 +38,7 @@ class CartItemInput(BaseModel):
 
 class CartDeliveryUpdate(BaseModel):
     delivery_method: Literal["courier", "pickup"]
+    address: str | None = Field(default=None, max_length=200)
 
 
 class PromoApplyRequest(BaseModel):
@@ -0,0 +1,304 @@
+from __future__ import annotations
+
+import heapq
+import re
+import threading
+from bisect import bisect_left, insort
+from typing import Any, Callable, Iterable, Iterator, NamedTuple
+
+from .catalog import CatalogRepository, FrozenRecord, catalog
+from .popularity import PopularityTracker, popularity
+
+SUGGEST_FIELDS = ("name", "brand", "color", "type", "shape")
+QUERY_FIELDS = ("name", "brand", "color")
+GRAM_SIZE = 3
+SUGGEST_CACHE_SIZE = 4096
+
+_TOKEN_RE = re.compile(r"\w+")
+
+
+class _Document(NamedTuple):
+    id: int
+    name: str
+    # Строка для подсказок: name, brand, color, type, shape через пробел
+    suggest_text: str
+    # Поля для поиска каталога: name, brand, color и теги через пробел
+    query_fields: tuple[str, ...]
+    rank: tuple[float, int]
+    suggestion: dict[str, Any]
+
+
+def _rank(record: FrozenRecord) -> tuple[float, int]:
+    # Чем меньше ключ, тем выше товар: сначала популярные, затем новые
+    return (-popularity.score(record), -record["id"])
+
+
+def _document(record: FrozenRecord) -> _Document:
+    suggest_text = " ".join(str(record.get(key) or "") for key in SUGGEST_FIELDS).lower()
+    query_fields = tuple(str(record.get(key) or "").lower() for key in QUERY_FIELDS) + (
+        " ".join(record.get("tags", [])).lower(),
+    )
+    return _Document(
+        id=record["id"],
+        name=record["name"].lower(),
+        suggest_text=suggest_text,
+        query_fields=query_fields,
+        rank=_rank(record),
+        suggestion={
+            "id": record["id"],
+            "name": record["name"],
+            "brand": record.get("brand"),
+            "color": record.get("color"),
+            "slug": record.get("slug", ""),
+            "image": record.get("image", ""),
+        },
+    )
+
+
+def _grams(text: str) -> Iterator[str]:
+    for start in range(len(text) - GRAM_SIZE + 1):
+        yield text[start:start + GRAM_SIZE]
+
+
+def _document_grams(doc: _Document) -> set[str]:
+    grams = set(_grams(doc.suggest_text))
+    for value in doc.query_fields:
+        grams.update(_grams(value))
+    return grams
+
+
+def _short_fields(doc: _Document) -> set[str]:
+    # Поля короче триграммы не попадают в индекс триграмм и хранятся целиком
+    return {value for value in doc.query_fields if 0 < len(value) < GRAM_SIZE}
+
+
+class SearchIndex:
+    """Инвертированный индекс каталога для поиска и подсказок.
+
+    Слова и названия хранятся в отсортированных списках, поэтому совпадения
+    по префиксу находятся бинарным поиском. Триграммы дают кандидатов для
+    поиска подстроки, которые затем проверяются по исходному тексту.
+    Порядок популярности поддерживается отсортированным при каждом изменении,
+    а готовые подсказки кешируются до следующего изменения каталога.
+    """
+
+    def __init__(self, repository: CatalogRepository, tracker: PopularityTracker) -> None:
+        self._repository = repository
+        self._tracker = tracker
+        self._lock = threading.Lock()
+        self._docs: dict[int, _Document] = {}
+        self._tokens: dict[str, set[int]] = {}
+        self._sorted_tokens: list[str] = []
+        self._names: list[tuple[str, int]] = []
+        self._grams: dict[str, set[int]] = {}
+        self._grams_by_pair: dict[str, set[str]] = {}
+        self._short_fields: dict[str, set[int]] = {}
+        self._ranked: list[tuple[float, int]] = []
+        self._suggest_cache: dict[tuple[str, int], list[dict[str, Any]]] = {}
+        repository.subscribe(self)
+        tracker.subscribe(self.rescore)
+
+    def reset(self, records: Iterable[FrozenRecord]) -> None:
+        with self._lock:
+            self._docs = {}
+            self._tokens = {}
+            self._grams = {}
+            self._grams_by_pair = {}
+            self._short_fields = {}
+            self._suggest_cache = {}
+            for record in records:
+                self._index(_document(record))
+            self._sorted_tokens = sorted(self._tokens)
+            self._names = sorted((doc.name, doc.id) for doc in self._docs.values())
+            self._ranked = sorted(doc.rank for doc in self._docs.values())
+
+    def apply(self, old: FrozenRecord | None, new: FrozenRecord | None) -> None:
+        with self._lock:
+            self._suggest_cache = {}
+            if old is not None and old["id"] in self._docs:
+                self._remove(self._docs[old["id"]])
+            if new is not None:
+                doc = _document(new)
+                for token in self._index(doc):
+                    insort(self._sorted_tokens, token)
+                insort(self._names, (doc.name, doc.id))
+                insort(self._ranked, doc.rank)
+
+    def rescore(self, product_ids: Iterable[int]) -> None:
+        records = self._repository.get_many(product_ids)
+        with self._lock:
+            for record in records:
+                doc = self._docs.get(record["id"])
+                if doc is None:
+                    continue
+                rank = _rank(record)
+                if rank != doc.rank:
+                    _remove_sorted(self._ranked, doc.rank)
+                    insort(self._ranked, rank)
+                    self._docs[doc.id] = doc._replace(rank=rank)
+                    self._suggest_cache = {}
+
+    def _index(self, doc: _Document) -> list[str]:
+        self._docs[doc.id] = doc
+        new_tokens: list[str] = []
+        for token in set(_TOKEN_RE.findall(doc.suggest_text)):
+            ids = self._tokens.get(token)
+            if ids is None:
+                ids = self._tokens[token] = set()
+                new_tokens.append(token)
+            ids.add(doc.id)
+        for gram in _document_grams(doc):
+            ids = self._grams.get(gram)
+            if ids is None:
+                ids = self._grams[gram] = set()
+                self._grams_by_pair.setdefault(gram[:2], set()).add(gram)
+                self._grams_by_pair.setdefault(gram[1:], set()).add(gram)
+            ids.add(doc.id)
+        for value in _short_fields(doc):
+            self._short_fields.setdefault(value, set()).add(doc.id)
+        return new_tokens
+
+    def _remove(self, doc: _Document) -> None:
+        del self._docs[doc.id]
+        for token in set(_TOKEN_RE.findall(doc.suggest_text)):
+            ids = self._tokens[token]
+            ids.discard(doc.id)
+            if not ids:
+                del self._tokens[token]
+                _remove_sorted(self._sorted_tokens, token)
+        for gram in _document_grams(doc):
+            ids = self._grams[gram]
+            ids.discard(doc.id)
+            if not ids:
+                del self._grams[gram]
+                for pair in (gram[:2], gram[1:]):
+                    grams = self._grams_by_pair[pair]
+                    grams.discard(gram)
+                    if not grams:
+                        del self._grams_by_pair[pair]
+        for value in _short_fields(doc):
+            ids = self._short_fields[value]
+            ids.discard(doc.id)
+            if not ids:
+                del self._short_fields[value]
+        _remove_sorted(self._names, (doc.name, doc.id))
+        _remove_sorted(self._ranked, doc.rank)
+
+    def _name_prefix_ids(self, q: str) -> set[int]:
+        result: set[int] = set()
+        position = bisect_left(self._names, (q,))
+        while position < len(self._names) and self._names[position][0].startswith(q):
+            result.add(self._names[position][1])
+            position += 1
+        return result
+
+    def _token_prefix_ids(self, q: str) -> set[int]:
+        result: set[int] = set()
+        position = bisect_left(self._sorted_tokens, q)
+        while position < len(self._sorted_tokens) and self._sorted_tokens[position].startswith(q):
+            result |= self._tokens[self._sorted_tokens[position]]
+            position += 1
+        return result
+
+    def _substring_candidates(self, q: str) -> set[int]:
+        """Кандидаты (без проверки), у которых q может встречаться как подстрока."""
+        if len(q) >= GRAM_SIZE:
+            postings = [self._grams.get(gram) for gram in set(_grams(q))]
+            if any(ids is None for ids in postings):
+                return set()
+            postings.sort(key=len)
+            result = set(postings[0])
+            for ids in postings[1:]:
+                if not result:
+                    break
+                result &= ids
+            return result
+
+        if len(q) < 2:
+            return set(self._docs)
+
+        # Запрос из двух символов либо лежит внутри какой-то триграммы, либо совпадает с коротким полем целиком
+        result = set(self._short_fields.get(q, ()))
+        for gram in self._grams_by_pair.get(q, ()):
+            result |= self._grams[gram]
+        return result
+
+    def _top(self, ids: set[int], limit: int, accept: Callable[[_Document], bool] | None = None) -> list[_Document]:
+        if limit <= 0 or not ids:
+            return []
+        docs = self._docs
+        if len(ids) * len(ids) > limit * len(docs):
+            # Большое множество: идём по готовому порядку популярности и выходим на лимите
+            result: list[_Document] = []
+            for _, negative_id in self._ranked:
+                pid = -negative_id
+                if pid in ids and (accept is None or accept(docs[pid])):
+                    result.append(docs[pid])
+                    if len(result) >= limit:
+                        break
+            return result
+
+        candidates = (docs[pid] for pid in ids)
+        if accept is not None:
+            candidates = (doc for doc in candidates if accept(doc))
+        return heapq.nsmallest(limit, candidates, key=lambda doc: doc.rank)
+
+    def suggest(self, query: str, limit: int = 8) -> list[dict[str, Any]]:
+        q = query.lower().strip()
+        if len(q) < 2:
+            return []
+
+        self._repository.sync()
+        self._tracker.sync()
+        with self._lock:
+            cached = self._suggest_cache.get((q, limit))
+            if cached is not None:
+                return cached
+
+            # Сначала совпадения с начала названия, затем с начала слова, затем подстрока
+            name_ids = self._name_prefix_ids(q)
+            ranked = self._top(name_ids, limit)
+            seen = set(name_ids)
+            if len(ranked) < limit:
+                token_ids = self._token_prefix_ids(q) - seen
+                ranked += self._top(token_ids, limit - len(ranked))
+                seen |= token_ids
+            if len(ranked) < limit:
+                ranked += self._top(
+                    self._substring_candidates(q) - seen,
+                    limit - len(ranked),
+                    accept=lambda doc: q in doc.suggest_text,
+                )
+
+            result = [doc.suggestion for doc in ranked]
+            if len(self._suggest_cache) >= SUGGEST_CACHE_SIZE:
+                self._suggest_cache.clear()
+            self._suggest_cache[(q, limit)] = result
+            return result
+
+    def match(self, query: str) -> set[int] | None:
+        """Возвращает id товаров, у которых запрос встречается в name, brand, color или тегах.
+
+        ``None`` означает пустой запрос, то есть подходит весь каталог.
+        """
+        q = query.lower().strip()
+        if not q:
+            return None
+
+        self._repository.sync()
+        with self._lock:
+            docs = self._docs
+            return {
+                pid
+                for pid in self._substring_candidates(q)
+                if any(q in value for value in docs[pid].query_fields)
+            }
+
+
+def _remove_sorted(items: list[Any], value: Any) -> None:
+    position = bisect_left(items, value)
+    if position < len(items) and items[position] == value:
+        del items[position]
+
+
+search_index = SearchIndex(catalog, popularity)
@@ -0,0 +1,88 @@
+from __future__ import annotations
+
+import json
+import threading
+from typing import Any, Iterable
+
+from fastapi import Response
+
+from .catalog import CatalogRepository, FrozenRecord, catalog
+
+try:
+    import orjson
+except ImportError:  # orjson необязателен: без него работает стандартный json
+    orjson = None
+
+JSON_MEDIA_TYPE = "application/json"
+# Сколько закодированных вариантов одного товара держать (полная запись, карточка)
+_FRAGMENTS_PER_RECORD = 4
+
+
+def dumps(value: Any) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(value, option=orjson.OPT_NON_STR_KEYS)
+    # Те же параметры, что у JSONResponse в FastAPI
+    return json.dumps(value, ensure_ascii=False, allow_nan=False, indent=None, separators=(",", ":")).encode("utf-8")
+
+
+class RecordFragments:
+    """Записи каталога, уже закодированные в JSON.
+
+    Запись неизменяема, поэтому её байты можно посчитать один раз и
+    вклеивать в любой ответ. Кодирование ленивое; при изменении товара
+    его фрагменты выбрасываются.
+    """
+
+    def __init__(self, repository: CatalogRepository) -> None:
+        self._lock = threading.Lock()
+        self._fragments: dict[int, list[tuple[FrozenRecord, bytes]]] = {}
+        repository.subscribe(self)
+
+    def reset(self, records: Iterable[FrozenRecord]) -> None:
+        with self._lock:
+            self._fragments = {}
+
+    def apply(self, old: FrozenRecord | None, new: FrozenRecord | None) -> None:
+        with self._lock:
+            for record in (old, new):
+                if record is not None:
+                    self._fragments.pop(record["id"], None)
+
+    def encode(self, record: FrozenRecord) -> bytes:
+        entries = self._fragments.get(record["id"], ())
+        for cached, body in entries:
+            # Фрагмент годится, только если закодирован из этого же объекта
+            if cached is record:
+                return body
+
+        body = dumps(record)
+        with self._lock:
+            entries = self._fragments.get(record["id"], [])
+            self._fragments[record["id"]] = [*entries[-(_FRAGMENTS_PER_RECORD - 1):], (record, body)]
+        return body
+
+
+def _is_container(value: Any) -> bool:
+    return isinstance(value, (dict, list, tuple))
+
+
+def encode_json(content: Any) -> bytes:
+    """Кодирует ответ, вклеивая готовые фрагменты для записей каталога."""
+    if type(content) is FrozenRecord and "id" in content:
+        return record_fragments.encode(content)
+    if isinstance(content, dict):
+        if not any(_is_container(value) for value in content.values()):
+            return dumps(content)
+        return b"{" + b",".join(dumps(str(key)) + b":" + encode_json(value) for key, value in content.items()) + b"}"
+    if isinstance(content, (list, tuple)):
+        if not any(_is_container(item) for item in content):
+            return dumps(content)
+        return b"[" + b",".join(encode_json(item) for item in content) + b"]"
+    return dumps(content)
+
+
+def json_response(content: Any, status_code: int = 200) -> Response:
+    return Response(content=encode_json(content), status_code=status_code, media_type=JSON_MEDIA_TYPE)
+
+
+record_fragments = RecordFragments(catalog)
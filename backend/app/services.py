@@ -4,6 +4,22 @@ from copy import deepcopy
 from datetime import datetime
 from typing import Any
 
+from .carts import ensure_priced, public_cart
+from .catalog import catalog
+from .db import transaction
+from .delivery import DEFAULT_DELIVERY_ZONE, DELIVERY_METHODS, cart_weight, delivery_quoter, resolve_zone
+from .facets import facet_index
+from .ids import id_allocator
+from .images import image_store, image_urls
+from .jobs import job_queue
+from .metrics import metrics
+from .order_stats import order_stats
+from .orders import DEFAULT_PAGE_SIZE, normalize_phone, order_store
+from .orderings import SORT_KEYS, decode_cursor, encode_cursor, orderings
+from .popularity import VIEW_FLUSH_INTERVAL, popularity
+from .promos import promo_engine
+from .search import search_index
+from .stock import stock_levels
 from .data import (
     account_demo,
     benefits,
@@ -12,40 +28,130 @@ from .data import (
     contacts_info,
     favorites_demo,
     home_slider,
-    orders_demo,
-    products,
-    promo_codes,
     special_sections,
 )
 
 
-def get_admin_stats() -> dict[str, Any]:
-    valid_orders = [o for o in orders_demo if str(o.get("status")).lower() != "отменен"]
-    revenue = sum(float(o.get("total", 0)) for o in valid_orders)
-    return {
-        "revenue": format_price(revenue),
-        "ordersCount": len(orders_demo)
-    }
+def get_admin_stats(days: int = 30, bucket: str = "day") -> dict[str, Any]:
+    return order_stats.summary(days, bucket)
 
-def get_all_orders() -> list[dict[str, Any]]:
-    return orders_demo
+def get_all_orders(
+    status: str | None = None,
+    date_from: str | None = None,
+    date_to: str | None = None,
+    phone: str | None = None,
+    limit: int = DEFAULT_PAGE_SIZE,
+    cursor: str | None = None,
+) -> dict[str, Any]:
+    return order_store.list(status, date_from, date_to, phone, limit, cursor)
 
 def update_order_status(order_id: str, new_status: str) -> dict[str, Any]:
-    for o in orders_demo:
-        if o["id"] == order_id:
-            o["status"] = new_status
-            return o
-    raise ValueError("Заказ не найден")
+    order = order_store.set_status(order_id, new_status)
+    if order is None:
+        raise ValueError("Заказ не найден")
+    return order
+
+def _product_fields(
+    name: str,
+    price: float,
+    category: str,
+    image: str | None,
+    description: str | None,
+    in_stock: bool | None,
+) -> tuple[dict[str, Any], list[str]]:
+    changes: dict[str, Any] = {"name": name, "price": price, "category": category}
+    remove: list[str] = []
+    for key, value in (("image", image), ("description", description)):
+        if value is not None:
+            changes[key] = value
+        else:
+            remove.append(key)
+    if in_stock is not None:
+        changes["in_stock"] = in_stock
+    return changes, remove
+
+
+def create_product(
+    name: str,
+    price: float,
+    category: str,
+    image: str | None = None,
+    description: str | None = None,
+    in_stock: bool | None = None,
+    stock: int | None = None,
+) -> dict[str, Any]:
+    fields, _ = _product_fields(name, price, category, image, description, in_stock)
+    with catalog.batch() as batch:
+        product = batch.create(fields)
+        if stock is not None:
+            stock_levels.set_on_hand(product["id"], stock)
+    return product
+
+
+def update_product(
+    product_id: int,
+    name: str,
+    price: float,
+    category: str,
+    image: str | None = None,
+    description: str | None = None,
+    in_stock: bool | None = None,
+    stock: int | None = None,
+) -> dict[str, Any] | None:
+    changes, remove = _product_fields(name, price, category, image, description, in_stock)
+    with catalog.batch() as batch:
+        product = batch.update(product_id, changes, remove)
+        if product is not None and stock is not None:
+            stock_levels.set_on_hand(product_id, stock)
+    return product
+
 
 def delete_product(product_id: int) -> bool:
-    for i in range(len(products) - 1, -1, -1):
-        if products[i].get("id") == product_id:
-            products.pop(i)
-            return True
-    return False
+    with catalog.batch() as batch:
+        deleted = batch.delete(product_id)
+        if deleted:
+            stock_levels.forget(product_id)
+    return deleted
+
+
+def import_products(operations: list[dict[str, Any]]) -> dict[str, Any]:
+    """Применяет пачку операций над товарами в одной транзакции.
+
+    Операция: ``{"row", "op", "id", "fields"}``, где op — upsert (без id
+    создаёт товар), price или delete. Поле ``stock`` в upsert задаёт
+    остаток на складе. Строки с ошибками пропускаются и попадают в
+    ``errors``, остальные применяются вместе.
+    """
+    counts = {"created": 0, "updated": 0, "deleted": 0}
+    errors: list[dict[str, Any]] = []
+    with catalog.batch() as batch:
+        for operation in operations:
+            product_id = operation.get("id")
+            fields = dict(operation["fields"])
+            stock = fields.pop("stock", None)
+            if operation["op"] == "delete":
+                applied = batch.delete(product_id)
+                if applied:
+                    stock_levels.forget(product_id)
+                counts["deleted"] += applied
+            elif operation["op"] == "price":
+                applied = batch.update(product_id, {"price": fields["price"]}) is not None
+                counts["updated"] += applied
+            elif product_id is None:
+                changes, _ = _product_fields(**fields)
+                product_id = batch.create(changes)["id"]
+                applied = True
+                counts["created"] += 1
+            else:
+                changes, remove = _product_fields(**fields)
+                applied = batch.update(product_id, changes, remove) is not None
+                counts["updated"] += applied
+            if applied and stock is not None:
+                stock_levels.set_on_hand(product_id, stock)
+            if not applied:
+                errors.append({"row": operation["row"], "id": product_id, "error": "Товар не найден"})
+    return {**counts, "errors": errors}
 
-def _product_index() -> dict[int, dict[str, Any]]:
-    return {product["id"]: product for product in products}
 
 
 def format_price(value: float) -> float:
@@ -53,11 +159,14 @@ def format_price(value: float) -> float:
 
 
 def get_home_payload() -> dict[str, Any]:
-    popular = sorted(products, key=lambda item: item.get("popularity", 0), reverse=True)[:6]
+    products = catalog.list()
+    popular_ids, _ = orderings.page("popular", None, 6)
+    popular = catalog.get_many(popular_ids)
     promotions = [product for product in products if product.get("old_price")][:4]
+    image_store.sync()
     return {
-        "slider": home_slider,
-        "categories": categories,
+        "slider": [image_store.rewrite(slide) for slide in home_slider],
+        "categories": [image_store.rewrite(category) for category in categories],
         "popular": popular,
         "promotions": promotions,
         "benefits": benefits,
@@ -65,7 +174,8 @@ def get_home_payload() -> dict[str, Any]:
 
 
 def get_categories() -> list[dict[str, Any]]:
-    return categories
+    image_store.sync()
+    return [image_store.rewrite(category) for category in categories]
 
 
 def category_filters_map() -> dict[str, list[str]]:
@@ -79,27 +189,54 @@ def category_filters_map() -> dict[str, list[str]]:
     }
 
 
-def get_filters_for_category(category: str | None) -> dict[str, list[str]]:
+def get_facets_for_category(category: str | None) -> dict[str, list[dict[str, Any]]]:
     if not category:
         return {}
 
-    allowed_keys = category_filters_map().get(category, [])
-    scoped_products = [product for product in products if product["category"] == category]
-    result: dict[str, list[str]] = {}
+    return facet_index.facet_counts(category, category_filters_map().get(category, []))
 
-    for key in allowed_keys:
-        values = sorted(
-            {
-                str(product[key]).strip()
-                for product in scoped_products
-                if key in product and str(product[key]).strip()
-            }
-        )
-        result[key] = values
 
-    return result
+def get_filters_for_category(category: str | None) -> dict[str, list[str]]:
+    return {
+        key: [entry["value"] for entry in values]
+        for key, values in get_facets_for_category(category).items()
+    }
 
 
+def match_product_ids(
+    category: str | None,
+    query: str | None,
+    type_filter: str | None = None,
+    brand_filter: str | None = None,
+    color_filter: str | None = None,
+    shape_filter: str | None = None,
+    size_filter: str | None = None,
+    hardness_filter: str | None = None,
+) -> set[int] | None:
+    exact_filters = {
+        "type": type_filter,
+        "brand": brand_filter,
+        "color": color_filter,
+        "shape": shape_filter,
+        "size": size_filter,
+        "hardness": hardness_filter,
+    }
+
+    # Категория, точные фильтры и текстовый запрос — пересечение множеств id из индексов.
+    # None означает, что подходит весь каталог
+    scoped_category = category if category and category != "Все" else None
+    matched_ids = facet_index.match(
+        scoped_category,
+        {key: value for key, value in exact_filters.items() if value},
+    )
+    if query:
+        query_ids = search_index.match(query)
+        if query_ids is not None:
+            matched_ids = query_ids if matched_ids is None else matched_ids & query_ids
+    return matched_ids
+
+
+@metrics.timed("filter_products")
 def filter_products(
     category: str | None,
     query: str | None,
@@ -110,59 +247,70 @@ def filter_products(
     shape_filter: str | None,
     size_filter: str | None,
     hardness_filter: str | None,
+    limit: int | None = None,
+    offset: int = 0,
+    cursor: str | None = None,
 ) -> dict[str, Any]:
-    result = deepcopy(products)
+    if sort not in SORT_KEYS:
+        sort = "new"
+    after = decode_cursor(sort, cursor) if cursor else None
 
-    if category and category != "Все":
-        result = [item for item in result if item.get("category") == category]
+    matched_ids = match_product_ids(
+        category, query, type_filter, brand_filter, color_filter, shape_filter, size_filter, hardness_filter
+    )
 
-    if query:
-        q = query.lower().strip()
-        result = [
-            item
-            for item in result
-            if q in item["name"].lower()
-            or q in item.get("brand", "").lower()
-            or q in item.get("color", "").lower()
-            or q in " ".join(item.get("tags", [])).lower()
-        ]
+    # Порядки сортировки поддерживаются заранее, поэтому страница не требует пересортировки
+    page_ids, last_key = orderings.page(sort, matched_ids, limit, offset, after)
+    total = catalog.count() if matched_ids is None else len(matched_ids)
 
-    exact_filters = {
-        "type": type_filter,
-        "brand": brand_filter,
-        "color": color_filter,
-        "shape": shape_filter,
-        "size": size_filter,
-        "hardness": hardness_filter,
+    facets = get_facets_for_category(category)
+    return {
+        "items": catalog.get_many(page_ids),
+        "filters": {key: [entry["value"] for entry in values] for key, values in facets.items()},
+        "facets": facets,
+        "count": total,
+        "limit": limit,
+        "offset": offset,
+        "next_cursor": encode_cursor(sort, last_key) if last_key is not None else None,
     }
 
-    for key, value in exact_filters.items():
-        if value:
-            result = [item for item in result if str(item.get(key, "")).lower() == value.lower()]
-
-    if sort == "price_asc":
-        result.sort(key=lambda item: item["price"])
-    elif sort == "price_desc":
-        result.sort(key=lambda item: item["price"], reverse=True)
-    elif sort == "popular":
-        result.sort(key=lambda item: item.get("popularity", 0), reverse=True)
-    else:
-        result.sort(key=lambda item: item["id"], reverse=True)
 
-    return {
-        "items": result,
-        "filters": get_filters_for_category(category),
-        "count": len(result),
-    }
+def export_product_ids(
+    category: str | None,
+    query: str | None,
+    sort: str = "new",
+    since: int | None = None,
+    updated_after: datetime | None = None,
+    **filters: str | None,
+) -> tuple[int, list[int], list[int]]:
+    """Версия каталога, id товаров для выгрузки в порядке сортировки и id удалённых.
+
+    Удалённые возвращаются только для выгрузки изменений с версии ``since``.
+    """
+    if sort not in SORT_KEYS:
+        sort = "new"
+    # Версию фиксируем до выборки: всё, что изменится позже, попадёт в следующую выгрузку
+    version = catalog.version
+    matched_ids = match_product_ids(category, query, **filters)
+    deleted: list[int] = []
+
+    if since is not None:
+        changed, deleted = catalog.changed_since(since)
+        matched_ids = set(changed) if matched_ids is None else matched_ids & set(changed)
+    if updated_after is not None:
+        recent = set(catalog.updated_after(updated_after))
+        matched_ids = recent if matched_ids is None else matched_ids & recent
+
+    ids, _ = orderings.page(sort, matched_ids, None)
+    return version, ids, deleted
 
 
 def get_product_by_id(product_id: int) -> dict[str, Any] | None:
-    product_map = _product_index()
-    product = product_map.get(product_id)
+    product = catalog.get(product_id)
     if not product:
         return None
 
-    related = [product_map[rel_id] for rel_id in product.get("related_ids", []) if rel_id in product_map]
+    related = catalog.get_many(product.get("related_ids", []))
     reviews = [
         {
             "author": "Екатерина",
@@ -178,129 +326,123 @@ def get_product_by_id(product_id: int) -> dict[str, Any] | None:
         },
     ]
 
-    payload = deepcopy(product)
+    payload = dict(product)
     payload["related"] = related
     payload["reviews"] = reviews
     return payload
 
 
 def get_special_sections() -> list[dict[str, Any]]:
-    product_map = _product_index()
     items: list[dict[str, Any]] = []
+    image_store.sync()
     for section in special_sections:
-        section_copy = deepcopy(section)
-        section_copy["products"] = [
-            product_map[pid] for pid in section.get("product_ids", []) if pid in product_map
-        ]
+        section_copy = image_store.rewrite(deepcopy(section))
+        section_copy["products"] = catalog.get_many(section.get("product_ids", []))
         items.append(section_copy)
     return items
 
 
+@metrics.timed("get_search_suggestions")
 def get_search_suggestions(query: str) -> list[dict[str, Any]]:
     if not query or len(query.strip()) < 2:
         return []
 
-    q = query.lower().strip()
-    suggestions: list[dict[str, Any]] = []
-
-    for item in products:
-        haystack = " ".join(
-            [
-                item["name"],
-                item.get("brand", ""),
-                item.get("color", ""),
-                item.get("type", ""),
-                item.get("shape", ""),
-            ]
-        ).lower()
-
-        if q in haystack:
-            suggestions.append(
-                {
-                    "id": item["id"],
-                    "name": item["name"],
-                    "brand": item.get("brand"),
-                    "color": item.get("color"),
-                    "slug": item.get("slug", ""),
-                    "image": item.get("image", ""),
-                }
-            )
-
-    return suggestions[:8]
+    return search_index.suggest(query, limit=8)
 
 
 def empty_cart() -> dict[str, Any]:
+    quote = delivery_quoter.quote("courier", DEFAULT_DELIVERY_ZONE, 0.0)
+    delivery_cost = format_price(quote.cost_for(0) / 100) if quote else 0.0
     return {
         "items": [],
         "promo_code": None,
+        "promo_error": None,
         "discount": 0.0,
         "subtotal": 0.0,
         "delivery_method": "courier",
-        "delivery_cost": 350.0,
-        "total": 350.0,
+        "delivery_zone": None,
+        "delivery_cost": delivery_cost,
+        "total": delivery_cost,
     }
 
 
-def _base_delivery_cost(method: str) -> float:
-    return 350.0 if method == "courier" else 0.0
+def _delivery_options(cart: dict[str, Any], products_by_id: dict[int, Any]) -> dict[str, Any]:
+    # Один пакетный расчёт на все способы: из него берутся и стоимость
+    # выбранного способа, и цены вариантов для выбора
+    quotes = delivery_quoter.quote_many(
+        DELIVERY_METHODS,
+        cart.get("delivery_zone") or DEFAULT_DELIVERY_ZONE,
+        cart_weight(cart["items"], products_by_id),
+    )
+    return {
+        method: {
+            "method": method,
+            "cost": format_price(quote.cost_for(cart["subtotal_cents"]) / 100),
+            "eta_days": quote.eta_days,
+        }
+        for method, quote in quotes.items()
+        if quote is not None
+    }
 
 
+@metrics.timed("recalc_cart")
 def recalc_cart(cart: dict[str, Any]) -> dict[str, Any]:
-    product_map = _product_index()
-    subtotal = 0.0
+    # Сумма товаров поддерживается операциями над строками корзины;
+    # полный пересчёт цен происходит только после изменения каталога
+    ensure_priced(cart)
+    subtotal = cart["subtotal_cents"] / 100
+    products_by_id = {product["id"]: product for product in catalog.get_many(line["product_id"] for line in cart["items"])}
     detailed_items: list[dict[str, Any]] = []
 
     for line in cart.get("items", []):
-        product = product_map.get(line["product_id"])
+        product = products_by_id.get(line["product_id"])
         if not product:
             continue
         qty = max(1, int(line.get("qty", 1)))
-        line_total = product["price"] * qty
-        subtotal += line_total
         detailed_items.append(
             {
                 "product": product,
                 "qty": qty,
-                "line_total": format_price(line_total),
+                "line_total": format_price(line["price"] * qty / 100),
             }
         )
 
     cart["subtotal"] = format_price(subtotal)
 
-    discount = 0.0
+    # Скидку считает скомпилированное правило по строкам корзины, которых оно касается
+    discount_cents, cart["promo_error"] = 0, None
     code = cart.get("promo_code")
-    if code and code in promo_codes:
-        promo = promo_codes[code]
-        if promo["type"] == "percent":
-            discount = subtotal * (promo["value"] / 100)
-        else:
-            discount = float(promo["value"])
+    if code:
+        discount_cents, cart["promo_error"] = promo_engine.evaluate(
+            code, cart["items"], products_by_id, cart["subtotal_cents"]
+        )
 
-    cart["discount"] = format_price(min(discount, subtotal))
+    cart["discount"] = format_price(discount_cents / 100)
 
-    method = cart.get("delivery_method", "courier")
-    delivery_cost = _base_delivery_cost(method)
-    if subtotal >= 3500:
-        delivery_cost = 0.0
+    options = _delivery_options(cart, products_by_id)
+    chosen = options.get(cart.get("delivery_method", "courier"))
+    cart["delivery_options"] = list(options.values())
+    cart["delivery_error"] = None if chosen else "Способ доставки недоступен для этого адреса"
+    delivery_cost = chosen["cost"] if chosen else 0.0
     cart["delivery_cost"] = format_price(delivery_cost)
 
     total = max(0.0, subtotal - cart["discount"] + delivery_cost)
     cart["total"] = format_price(total)
     cart["detailed_items"] = detailed_items
-    return cart
+    return public_cart(cart)
 
 
 def default_account_payload() -> dict[str, Any]:
     return {
         "profile": account_demo,
-        "orders": orders_demo,
-        "favorites": [product for product in products if product["id"] in favorites_demo],
+        "orders": order_store.list(limit=20)["items"],
+        "favorites": catalog.get_many(favorites_demo),
     }
 
 
 def submit_contact_message(name: str, email: str, message: str) -> dict[str, Any]:
     entry = {
-        "id": len(contact_messages) + 1,
+        "id": id_allocator.allocate("contact_messages"),
         "name": name,
         "email": email,
         "message": message,
@@ -310,6 +452,7 @@ def submit_contact_message(name: str, email: str, message: str) -> dict[str, Any
     return entry
 
 
+@metrics.timed("checkout_order")
 def checkout_order(
     cart: dict[str, Any],
     full_name: str,
@@ -317,29 +460,70 @@ def checkout_order(
     delivery_method: str,
     payment_method: str,
     address: str | None,
+    session: str | None = None,
 ) -> dict[str, Any]:
+    # Доставка считается по способу и адресу из формы оформления
+    cart["delivery_method"] = delivery_method
+    if address:
+        cart["delivery_zone"] = resolve_zone(address)
     updated = recalc_cart(cart)
     if not updated.get("detailed_items"):
         raise ValueError("Корзина пуста")
+    if updated["delivery_error"]:
+        raise ValueError(updated["delivery_error"])
+
+    items = [{"product_id": item["product"]["id"], "qty": item["qty"]} for item in updated["detailed_items"]]
+    promo = {"promo_code": updated["promo_code"], "discount": updated["discount"]} if updated["discount"] else {}
+    # Списание со склада, применение промокода, заказ и задание на его обработку
+    # фиксируются вместе: если товара не хватило или лимит кода исчерпан, не создаётся ничего
+    with transaction():
+        stock_levels.commit(session, items)
+        if promo:
+            promo_engine.redeem(promo["promo_code"], normalize_phone(phone))
+        order = order_store.create(
+            {
+                "total": updated["total"],
+                "delivery_cost": updated["delivery_cost"],
+                **promo,
+                "delivery_method": delivery_method,
+                "payment_method": payment_method,
+                "address": address,
+                "recipient": full_name,
+                "phone": phone,
+                "items": items,
+            }
+        )
+        job_queue.enqueue("order_placed", {"order_id": order["id"], "items": order["items"]})
+    return order
 
-    order = {
-        "id": f"A-{datetime.utcnow().year}-{len(orders_demo) + 1:04d}",
-        "date": datetime.utcnow().date().isoformat(),
-        "status": "Принят",
-        "total": updated["total"],
-        "delivery_method": delivery_method,
-        "payment_method": payment_method,
-        "address": address,
-        "recipient": full_name,
-        "phone": phone,
-        "items": [
-            {"product_id": item["product"]["id"], "qty": item["qty"]}
-            for item in updated["detailed_items"]
-        ],
-    }
 
-    orders_demo.insert(0, order)
-    return order
+@job_queue.handler("order_placed")
+def process_placed_order(payload: dict[str, Any]) -> None:
+    # Побочные эффекты оформления выполняются в фоне и не задерживают ответ покупателю
+    popularity.record_order(payload["items"], payload["order_id"])
+
+
+@job_queue.every(VIEW_FLUSH_INTERVAL)
+def flush_product_views() -> None:
+    popularity.flush()
+
+
+def sync_images() -> int:
+    """Ставит в очередь загрузку всех ещё не загруженных изображений каталога, витрины и слайдера."""
+    urls: list[str] = []
+    for item in [*catalog.list(), *categories, *special_sections, *home_slider]:
+        urls.extend(image_urls(item))
+    return image_store.request(urls)
+
+
+@job_queue.every(1.0)
+def queue_catalog_images() -> None:
+    image_store.flush_pending()
+
+
+@job_queue.handler("image_ingest")
+def ingest_image(payload: dict[str, Any]) -> None:
+    image_store.ingest(payload["url"])
 
 
 def get_contacts_payload() -> dict[str, Any]:
@@ -0,0 +1,271 @@
+from __future__ import annotations
+
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Iterable, Mapping
+
+from .db import db_path, get_connection, transaction
+
+STOCK_RESERVATION_SECONDS = float(os.environ.get("STOCK_RESERVATION_SECONDS", str(15 * 60)))
+_SWEEP_INTERVAL = 10.0
+
+_SCHEMA = (
+    """
+    CREATE TABLE IF NOT EXISTS stock (
+        product_id INTEGER PRIMARY KEY,
+        on_hand INTEGER NOT NULL CHECK (on_hand >= 0),
+        reserved INTEGER NOT NULL DEFAULT 0 CHECK (reserved >= 0),
+        version INTEGER NOT NULL DEFAULT 0
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS idx_stock_version ON stock (version)",
+    """
+    CREATE TABLE IF NOT EXISTS stock_reservations (
+        token TEXT NOT NULL,
+        product_id INTEGER NOT NULL,
+        qty INTEGER NOT NULL,
+        expires_at REAL NOT NULL,
+        PRIMARY KEY (token, product_id)
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS idx_stock_reservations_expires ON stock_reservations (expires_at)",
+    # Товары, переставшие учитываться: по версии tombstone другие воркеры убирают их из памяти
+    """
+    CREATE TABLE IF NOT EXISTS stock_tombstones (
+        product_id INTEGER PRIMARY KEY,
+        version INTEGER NOT NULL
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS idx_stock_tombstones_version ON stock_tombstones (version)",
+    "CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)",
+    "INSERT OR IGNORE INTO meta (key, value) VALUES ('stock_version', '0')",
+)
+
+
+class OutOfStockError(ValueError):
+    pass
+
+
+class StockLevels:
+    """Остатки товаров: на складе (on_hand) и в резерве корзин (reserved).
+
+    Товар без строки в ``stock`` не учитывается и считается доступным, как
+    раньше. Резерв и списание — условный ``UPDATE ... WHERE on_hand -
+    reserved >= ?`` (сравнение с обменом): строка меняется, только если
+    товара хватает, поэтому параллельные оформления в разных воркерах не
+    продадут больше, чем есть. Резерв корзины живёт
+    ``STOCK_RESERVATION_SECONDS``, просроченные возвращаются в продажу.
+
+    Доступные остатки кешируются в памяти и подтягиваются по версии, как
+    каталог, — для выдачи в проекциях без запроса на каждый товар.
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._ready_for: str | None = None
+        self._version: int | None = None
+        self._available: dict[int, int] = {}
+        self._next_sweep = 0.0
+
+    def _setup(self) -> None:
+        if self._ready_for == db_path():
+            return
+        with transaction() as conn:
+            for statement in _SCHEMA:
+                conn.execute(statement)
+        with self._lock:
+            self._ready_for = db_path()
+            self._version = None
+            self._available = {}
+
+    @staticmethod
+    def _current_version(conn: sqlite3.Connection) -> int:
+        return conn.execute("SELECT CAST(value AS INTEGER) FROM meta WHERE key = 'stock_version'").fetchone()[0]
+
+    @staticmethod
+    def _bump_version(conn: sqlite3.Connection) -> int:
+        conn.execute("UPDATE meta SET value = CAST(value AS INTEGER) + 1 WHERE key = 'stock_version'")
+        return StockLevels._current_version(conn)
+
+    def sync(self) -> None:
+        self._setup()
+        if self._version == self._current_version(get_connection()):
+            return
+        with transaction("DEFERRED") as conn:
+            version = self._current_version(conn)
+            since = self._version if self._version is not None else -1
+            rows = conn.execute(
+                """
+                SELECT product_id, on_hand - reserved AS available, version FROM stock WHERE version > ?
+                UNION ALL
+                SELECT product_id, NULL, version FROM stock_tombstones WHERE version > ?
+                ORDER BY version
+                """,
+                (since, since),
+            ).fetchall()
+        with self._lock:
+            for row in rows:
+                if row["available"] is None:
+                    self._available.pop(row["product_id"], None)
+                else:
+                    self._available[row["product_id"]] = row["available"]
+            self._version = version
+
+    @property
+    def version(self) -> int:
+        self.sync()
+        return self._version or 0
+
+    def levels(self) -> Mapping[int, int]:
+        """Доступный остаток по id учитываемых товаров."""
+        self.sync()
+        return self._available
+
+    def set_on_hand(self, product_id: int, on_hand: int) -> None:
+        self._setup()
+        with transaction() as conn:
+            version = self._bump_version(conn)
+            reserved = conn.execute(
+                "SELECT reserved FROM stock WHERE product_id = ?", (product_id,)
+            ).fetchone()
+            if reserved and reserved["reserved"] > on_hand:
+                # Склад уменьшили ниже резерва: резервы корзин на этот товар снимаются
+                conn.execute("DELETE FROM stock_reservations WHERE product_id = ?", (product_id,))
+            conn.execute("DELETE FROM stock_tombstones WHERE product_id = ?", (product_id,))
+            conn.execute(
+                """
+                INSERT INTO stock (product_id, on_hand, reserved, version) VALUES (?, ?, 0, ?)
+                ON CONFLICT (product_id) DO UPDATE SET
+                    on_hand = excluded.on_hand,
+                    reserved = CASE WHEN reserved > excluded.on_hand THEN 0 ELSE reserved END,
+                    version = excluded.version
+                """,
+                (product_id, on_hand, version),
+            )
+
+    def forget(self, product_id: int) -> None:
+        """Перестаёт учитывать остаток удалённого товара; id товаров не переиспользуются."""
+        self._setup()
+        with transaction() as conn:
+            conn.execute("DELETE FROM stock_reservations WHERE product_id = ?", (product_id,))
+            if conn.execute("DELETE FROM stock WHERE product_id = ?", (product_id,)).rowcount:
+                version = self._bump_version(conn)
+                conn.execute(
+                    "INSERT OR REPLACE INTO stock_tombstones (product_id, version) VALUES (?, ?)",
+                    (product_id, version),
+                )
+        with self._lock:
+            self._available.pop(product_id, None)
+
+    def _sweep(self, conn: sqlite3.Connection) -> None:
+        now = time.time()
+        if now < self._next_sweep:
+            return
+        self._next_sweep = now + _SWEEP_INTERVAL
+        expired = conn.execute(
+            "SELECT product_id, SUM(qty) AS qty FROM stock_reservations WHERE expires_at <= ? GROUP BY product_id",
+            (now,),
+        ).fetchall()
+        if not expired:
+            return
+        version = self._bump_version(conn)
+        conn.executemany(
+            "UPDATE stock SET reserved = MAX(0, reserved - ?), version = ? WHERE product_id = ?",
+            [(row["qty"], version, row["product_id"]) for row in expired],
+        )
+        conn.execute("DELETE FROM stock_reservations WHERE expires_at <= ?", (now,))
+
+    @staticmethod
+    def _held(conn: sqlite3.Connection, token: str, product_id: int) -> int:
+        row = conn.execute(
+            "SELECT qty FROM stock_reservations WHERE token = ? AND product_id = ?", (token, product_id)
+        ).fetchone()
+        return row["qty"] if row else 0
+
+    def reserve(self, token: str, product_id: int, qty: int) -> None:
+        """Устанавливает резерв корзины ``token`` на товар равным ``qty`` (0 — снять резерв)."""
+        self._setup()
+        with transaction() as conn:
+            self._sweep(conn)
+            tracked = conn.execute("SELECT 1 FROM stock WHERE product_id = ?", (product_id,)).fetchone()
+            if not tracked:
+                return
+            delta = qty - self._held(conn, token, product_id)
+            if delta == 0:
+                conn.execute(
+                    "UPDATE stock_reservations SET expires_at = ? WHERE token = ? AND product_id = ?",
+                    (time.time() + STOCK_RESERVATION_SECONDS, token, product_id),
+                )
+                return
+            version = self._bump_version(conn)
+            updated = conn.execute(
+                "UPDATE stock SET reserved = reserved + ?, version = ? WHERE product_id = ? AND on_hand - reserved >= ?",
+                (delta, version, product_id, delta),
+            ).rowcount
+            if not updated:
+                raise OutOfStockError("Недостаточно товара на складе")
+            if qty > 0:
+                conn.execute(
+                    "INSERT OR REPLACE INTO stock_reservations (token, product_id, qty, expires_at) VALUES (?, ?, ?, ?)",
+                    (token, product_id, qty, time.time() + STOCK_RESERVATION_SECONDS),
+                )
+            else:
+                conn.execute(
+                    "DELETE FROM stock_reservations WHERE token = ? AND product_id = ?", (token, product_id)
+                )
+
+    def release(self, token: str, product_ids: Iterable[int] | None = None) -> None:
+        self._setup()
+        with transaction() as conn:
+            rows = conn.execute(
+                "SELECT product_id, qty FROM stock_reservations WHERE token = ?", (token,)
+            ).fetchall()
+            wanted = None if product_ids is None else set(product_ids)
+            rows = [row for row in rows if wanted is None or row["product_id"] in wanted]
+            if not rows:
+                return
+            version = self._bump_version(conn)
+            for row in rows:
+                conn.execute(
+                    "UPDATE stock SET reserved = MAX(0, reserved - ?), version = ? WHERE product_id = ?",
+                    (row["qty"], version, row["product_id"]),
+                )
+                conn.execute(
+                    "DELETE FROM stock_reservations WHERE token = ? AND product_id = ?", (token, row["product_id"])
+                )
+
+    def commit(self, token: str | None, items: Iterable[dict[str, Any]]) -> None:
+        """Списывает товары заказа со склада с учётом резерва корзины ``token``.
+
+        Если какого-то товара не хватает, бросает ``OutOfStockError`` и ничего не списывает.
+        """
+        self._setup()
+        with transaction() as conn:
+            self._sweep(conn)
+            version: int | None = None
+            for item in items:
+                product_id, qty = int(item["product_id"]), int(item["qty"])
+                # Неучитываемые товары не трогают склад и не сдвигают версию остатков
+                if not conn.execute("SELECT 1 FROM stock WHERE product_id = ?", (product_id,)).fetchone():
+                    continue
+                if version is None:
+                    version = self._bump_version(conn)
+                held = self._held(conn, token, product_id) if token else 0
+                updated = conn.execute(
+                    """
+                    UPDATE stock SET on_hand = on_hand - ?, reserved = reserved - ?, version = ?
+                    WHERE product_id = ? AND on_hand - (reserved - ?) >= ?
+                    """,
+                    (qty, held, version, product_id, held, qty),
+                ).rowcount
+                if not updated:
+                    raise OutOfStockError(f"Недостаточно товара на складе (id {product_id})")
+                if held:
+                    conn.execute(
+                        "DELETE FROM stock_reservations WHERE token = ? AND product_id = ?", (token, product_id)
+                    )
+
+
+stock_levels = StockLevels()
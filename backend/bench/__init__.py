@@ -0,0 +1,4 @@
+"""Нагрузочные и микро-бенчмарки API на синтетических каталогах.
+
+Запуск из каталога backend: ``python -m bench --help``.
+"""
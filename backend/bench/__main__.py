@@ -0,0 +1,89 @@
+from __future__ import annotations
+
+import argparse
+import json
+import multiprocessing
+import sys
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Any
+
+from .suite import run_size
+
+MODES = ("asgi", "uvicorn", "micro")
+# По этим метрикам сравнение с базовым прогоном ищет регрессии
+REGRESSION_METRICS = ("p95_ms", "p50_us")
+
+
+def _parse_args(argv: list[str] | None = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(prog="python -m bench", description="Бенчмарки API магазина")
+    parser.add_argument("--sizes", default="1000,10000,100000", help="размеры каталога через запятую")
+    parser.add_argument("--modes", default=",".join(MODES), help=f"режимы через запятую: {', '.join(MODES)}")
+    parser.add_argument("--concurrency", type=int, default=8, help="одновременных покупателей")
+    parser.add_argument("--rounds", type=int, default=20, help="сценариев на покупателя")
+    parser.add_argument("--workers", type=int, default=1, help="воркеров uvicorn")
+    parser.add_argument("--iterations", type=int, default=200, help="вызовов на микро-бенчмарк")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--data-dir", type=Path, default=Path(tempfile.gettempdir()) / "shop-bench")
+    parser.add_argument("--output", type=Path, help="сохранить результаты в JSON")
+    parser.add_argument("--baseline", type=Path, help="JSON прошлого прогона для поиска регрессий")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="допустимое замедление, доля")
+    return parser.parse_args(argv)
+
+
+def _print_report(results: dict[str, Any]) -> None:
+    for size, modes in results.items():
+        for mode, rows in modes.items():
+            print(f"\n== {size} товаров, {mode}")
+            columns = list(next(iter(rows.values())).keys()) if rows else []
+            width = max((len(name) for name in rows), default=0)
+            print(f"{'':{width}}  " + "  ".join(f"{column:>9}" for column in columns))
+            for name, row in rows.items():
+                print(f"{name:{width}}  " + "  ".join(f"{row[column]:>9}" for column in columns))
+
+
+def find_regressions(results: dict[str, Any], baseline: dict[str, Any], tolerance: float) -> list[str]:
+    found: list[str] = []
+    for size, modes in results.items():
+        for mode, rows in modes.items():
+            for name, row in rows.items():
+                before = baseline.get(size, {}).get(mode, {}).get(name)
+                if not before:
+                    continue
+                for metric in REGRESSION_METRICS:
+                    if metric in row and before.get(metric) and row[metric] > before[metric] * (1 + tolerance):
+                        found.append(f"{size}/{mode}/{name}: {metric} {before[metric]} → {row[metric]}")
+    return found
+
+
+def main(argv: list[str] | None = None) -> int:
+    args = _parse_args(argv)
+    unknown = set(args.modes.split(",")) - set(MODES)
+    if unknown:
+        print(f"Неизвестные режимы: {', '.join(sorted(unknown))}", file=sys.stderr)
+        return 2
+    args.data_dir.mkdir(parents=True, exist_ok=True)
+
+    results: dict[str, Any] = {}
+    # Каждый размер — в свежем процессе: синглтоны приложения привязываются к одной базе
+    context = multiprocessing.get_context("spawn")
+    for size in (int(value) for value in args.sizes.split(",")):
+        with ProcessPoolExecutor(max_workers=1, mp_context=context) as pool:
+            results[str(size)] = pool.submit(run_size, size, args).result()
+    _print_report(results)
+
+    if args.output:
+        args.output.write_text(json.dumps(results, ensure_ascii=False, indent=2), encoding="utf-8")
+    if args.baseline:
+        regressions = find_regressions(results, json.loads(args.baseline.read_text(encoding="utf-8")), args.tolerance)
+        if regressions:
+            print("\nРегрессии относительно базового прогона:")
+            for line in regressions:
+                print(f"  {line}")
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,93 @@
+from __future__ import annotations
+
+import os
+import random
+import sqlite3
+from pathlib import Path
+from typing import Any, Iterator
+
+# Слаги категорий из app.data: по ним category_filters_map выбирает фасеты
+CATEGORIES = ("paints", "brushes", "paper", "pencils", "sets", "easels")
+# Значения поля type внутри категории
+TYPES = {
+    "paints": ("Акварель", "Масло", "Акрил", "Гуашь"),
+    "brushes": ("Синтетика", "Белка", "Щетина", "Колонок"),
+    "paper": ("Акварельная", "Скетчбук", "Холст", "Картон"),
+    "pencils": ("Графитный", "Цветной", "Пастельный", "Угольный"),
+    "sets": ("Для начинающих", "Подарочный", "Профессиональный"),
+    "easels": ("Настольный", "Напольный", "Этюдник"),
+}
+BRANDS = ("Белые ночи", "Сонет", "Winsor & Newton", "Royal Talens", "Гамма", "Малевичъ", "Pinax", "Fabriano")
+COLORS = ("Белый", "Чёрный", "Красный", "Синий", "Жёлтый", "Зелёный", "Охра", "Умбра")
+SHAPES = ("Круглая", "Плоская", "Веерная", "Овальная", "Кювета", "Туба")
+SIZES = ("10 мл", "46 мл", "200 мл", "30×40", "40×50", "A4", "A3", "№2", "№6", "№12")
+HARDNESS = ("Мягкая", "Средняя", "Жёсткая")
+NOUNS = ("Набор", "Краска", "Холст", "Кисть", "Скетчбук", "Палитра", "Карандаш", "Бумага")
+ADJECTIVES = ("художественная", "профессиональная", "студийная", "учебная", "акварельная", "масляная")
+# Меняется при изменении формы товаров: закешированные базы старой формы не переиспользуются
+CATALOG_FORMAT = 2
+IMAGE = "https://images.unsplash.com/photo-1513364776144-60967b0f800f?auto=format&fit=crop&w={width}&q=80"
+
+
+def generate_products(count: int, seed: int = 0) -> Iterator[dict[str, Any]]:
+    """Товары в форме ``app.data.products`` с фасетами для фильтров; id выдаёт каталог."""
+    rng = random.Random(seed)
+    for number in range(count):
+        category = rng.choice(CATEGORIES)
+        kind = rng.choice(TYPES[category])
+        brand = rng.choice(BRANDS)
+        price = rng.randrange(90, 25_000, 10)
+        product: dict[str, Any] = {
+            "name": f"{rng.choice(NOUNS)} {rng.choice(ADJECTIVES)} {brand} {number}",
+            "price": price,
+            "image": IMAGE.format(width=500),
+            "category": category,
+            "description": f"{kind}: {rng.choice(ADJECTIVES)} серия от {brand}.",
+            "is_popular": rng.random() < 0.05,
+            "popularity": rng.randrange(1000),
+            "photos": [IMAGE.format(width=1000) for _ in range(rng.randrange(1, 4))],
+            "specs": [
+                {"label": "Форма", "value": rng.choice(SHAPES)},
+                {"label": "Объём", "value": rng.choice(SIZES)},
+            ],
+            "reviews": [
+                {"id": 1, "user": "Анна", "date": "10.02.2026", "text": "Хорошее качество.", "rating": rng.randrange(3, 6)}
+            ]
+            if rng.random() < 0.3
+            else [],
+            "type": kind,
+            "brand": brand,
+            "color": rng.choice(COLORS),
+            "shape": rng.choice(SHAPES),
+            "size": rng.choice(SIZES),
+            "hardness": rng.choice(HARDNESS),
+        }
+        if rng.random() < 0.15:
+            product["old_price"] = round(price * 1.2)
+        yield product
+
+
+def prepare_database(size: int, data_dir: Path, seed: int = 0) -> Path:
+    """Создаёт (или переиспользует) базу с каталогом из ``size`` товаров и делает её текущей."""
+    path = data_dir / f"bench-{size}-{seed}-v{CATALOG_FORMAT}.sqlite3"
+    os.environ["SHOP_DB_PATH"] = str(path)
+    if path.exists() and _catalog_size(path) >= size:
+        return path
+
+    # Импорт после выбора базы: репозиторий привязывается к текущему SHOP_DB_PATH
+    from app.catalog import catalog
+
+    missing = size - len(catalog.list())
+    if missing > 0:
+        with catalog.batch() as batch:
+            for product in generate_products(missing, seed):
+                batch.create(product)
+    return path
+
+
+def _catalog_size(path: Path) -> int:
+    try:
+        with sqlite3.connect(path) as conn:
+            return conn.execute("SELECT COUNT(*) FROM products").fetchone()[0]
+    except sqlite3.Error:
+        return 0
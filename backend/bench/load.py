@@ -0,0 +1,199 @@
+from __future__ import annotations
+
+import asyncio
+import os
+import random
+import socket
+import subprocess
+import sys
+import time
+from collections import defaultdict
+from pathlib import Path
+from typing import Any, Awaitable, Callable
+
+import httpx
+
+from .catalog import BRANDS, CATEGORIES
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+SUGGEST_QUERIES = ("акв", "кист", "холст", "масл", "набор", "бумага", "winsor", "сонет")
+SEARCH_QUERIES = ("акварель", "кисть", "холст", "профессиональная", "набор")
+
+
+def percentile(samples: list[float], share: float) -> float:
+    """Перцентиль по ближайшему рангу; ``samples`` должны быть отсортированы."""
+    if not samples:
+        return 0.0
+    rank = max(1, round(share * len(samples) + 0.5))
+    return samples[min(rank, len(samples)) - 1]
+
+
+def summarize(latencies: dict[str, list[float]], errors: dict[str, int], elapsed: float) -> dict[str, dict[str, Any]]:
+    """Итоги по эндпоинтам и общая строка ``total`` по всем запросам."""
+    groups = {name: latencies.get(name, []) for name in sorted(set(latencies) | set(errors))}
+    groups["total"] = [sample for samples in latencies.values() for sample in samples]
+    errors = {**errors, "total": sum(errors.values())}
+    report: dict[str, dict[str, Any]] = {}
+    for name, group in groups.items():
+        samples = sorted(group)
+        report[name] = {
+            "requests": len(samples),
+            "errors": errors.get(name, 0),
+            "rps": round(len(samples) / elapsed, 1) if elapsed else 0.0,
+            "p50_ms": round(percentile(samples, 0.50) * 1000, 2),
+            "p95_ms": round(percentile(samples, 0.95) * 1000, 2),
+            "p99_ms": round(percentile(samples, 0.99) * 1000, 2),
+        }
+    return report
+
+
+class Recorder:
+    def __init__(self) -> None:
+        self.latencies: dict[str, list[float]] = defaultdict(list)
+        self.errors: dict[str, int] = defaultdict(int)
+
+    async def call(self, name: str, request: Awaitable[httpx.Response]) -> httpx.Response | None:
+        started = time.perf_counter()
+        try:
+            response = await request
+        except httpx.HTTPError:
+            self.errors[name] += 1
+            return None
+        elapsed = time.perf_counter() - started
+        if response.status_code >= 400:
+            self.errors[name] += 1
+        else:
+            self.latencies[name].append(elapsed)
+        return response
+
+
+async def _shopper(client: httpx.AsyncClient, recorder: Recorder, product_ids: list[int], rng: random.Random, rounds: int) -> None:
+    """Один покупатель: листает каталог, ищет, собирает корзину и оформляет заказ."""
+    for _ in range(rounds):
+        category = rng.choice(CATEGORIES)
+        await recorder.call(
+            "GET /api/products?category",
+            client.get("/api/products", params={"category": category, "limit": 24, "view": "card"}),
+        )
+        await recorder.call(
+            "GET /api/products?filters",
+            client.get(
+                "/api/products",
+                params={"category": category, "brand": rng.choice(BRANDS), "sort": "price_asc", "limit": 24},
+            ),
+        )
+        await recorder.call(
+            "GET /api/products?query",
+            client.get("/api/products", params={"query": rng.choice(SEARCH_QUERIES), "limit": 24, "sort": "popular"}),
+        )
+        await recorder.call(
+            "GET /api/search/suggest",
+            client.get("/api/search/suggest", params={"q": rng.choice(SUGGEST_QUERIES)}),
+        )
+        product_id = rng.choice(product_ids)
+        await recorder.call("GET /api/products/{id}", client.get(f"/api/products/{product_id}"))
+        await recorder.call("POST /api/cart/items", client.post("/api/cart/items", json={"product_id": product_id, "qty": 1}))
+        await recorder.call(
+            "PATCH /api/cart/items/{id}", client.patch(f"/api/cart/items/{product_id}", json={"qty": rng.randrange(1, 4)})
+        )
+        await recorder.call(
+            "POST /api/checkout",
+            client.post(
+                "/api/checkout",
+                json={
+                    "full_name": "Нагрузочный Тест",
+                    "phone": f"+7999{rng.randrange(10**7):07d}",
+                    "delivery_method": "pickup",
+                    "payment_method": "card",
+                },
+            ),
+        )
+
+
+async def drive(
+    make_client: Callable[[], httpx.AsyncClient],
+    product_ids: list[int],
+    concurrency: int,
+    rounds: int,
+    seed: int = 0,
+) -> dict[str, dict[str, Any]]:
+    recorder = Recorder()
+    clients = [make_client() for _ in range(concurrency)]
+    # Прогрев: первые запросы строят индексы и кеши и не должны попадать в замеры
+    warmup = Recorder()
+    await _shopper(clients[0], warmup, product_ids, random.Random(seed), 1)
+
+    started = time.perf_counter()
+    await asyncio.gather(
+        *(
+            _shopper(client, recorder, product_ids, random.Random(seed + number + 1), rounds)
+            for number, client in enumerate(clients)
+        )
+    )
+    elapsed = time.perf_counter() - started
+    for client in clients:
+        await client.aclose()
+    return summarize(recorder.latencies, recorder.errors, elapsed)
+
+
+def run_asgi(product_ids: list[int], concurrency: int, rounds: int, seed: int = 0) -> dict[str, dict[str, Any]]:
+    """Приложение в этом же процессе через ASGI-транспорт httpx, без сети."""
+    from app.main import app
+
+    transport = httpx.ASGITransport(app=app)
+    return asyncio.run(
+        drive(lambda: httpx.AsyncClient(transport=transport, base_url="http://bench"), product_ids, concurrency, rounds, seed)
+    )
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def run_uvicorn(
+    product_ids: list[int],
+    concurrency: int,
+    rounds: int,
+    workers: int = 1,
+    seed: int = 0,
+) -> dict[str, dict[str, Any]]:
+    """Локальный uvicorn в отдельном процессе на текущей базе SHOP_DB_PATH."""
+    port = _free_port()
+    server = subprocess.Popen(
+        [
+            sys.executable, "-m", "uvicorn", "app.main:app",
+            "--host", "127.0.0.1", "--port", str(port),
+            "--workers", str(workers), "--log-level", "warning", "--no-access-log",
+        ],
+        cwd=BACKEND_DIR,
+        env=os.environ.copy(),
+    )
+    base_url = f"http://127.0.0.1:{port}"
+    try:
+        _wait_ready(base_url, server)
+        limits = httpx.Limits(max_connections=1, max_keepalive_connections=1)
+        return asyncio.run(
+            drive(lambda: httpx.AsyncClient(base_url=base_url, limits=limits), product_ids, concurrency, rounds, seed)
+        )
+    finally:
+        server.terminate()
+        try:
+            server.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            server.kill()
+
+
+def _wait_ready(base_url: str, server: subprocess.Popen[Any], timeout: float = 30.0) -> None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if server.poll() is not None:
+            raise RuntimeError(f"uvicorn завершился с кодом {server.returncode}")
+        try:
+            if httpx.get(f"{base_url}/api/health", timeout=1.0).status_code == 200:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.1)
+    raise RuntimeError("uvicorn не запустился вовремя")
@@ -0,0 +1,69 @@
+from __future__ import annotations
+
+import random
+import time
+from typing import Any, Callable
+
+from .catalog import BRANDS, CATEGORIES
+from .load import SEARCH_QUERIES, SUGGEST_QUERIES, percentile
+
+
+def _measure(func: Callable[[], Any], iterations: int) -> dict[str, Any]:
+    func()
+    samples: list[float] = []
+    for _ in range(iterations):
+        started = time.perf_counter()
+        func()
+        samples.append(time.perf_counter() - started)
+    samples.sort()
+    return {
+        "calls": iterations,
+        "mean_us": round(sum(samples) / len(samples) * 1e6, 1),
+        "p50_us": round(percentile(samples, 0.50) * 1e6, 1),
+        "p99_us": round(percentile(samples, 0.99) * 1e6, 1),
+    }
+
+
+def run_micro(product_ids: list[int], iterations: int, seed: int = 0) -> dict[str, dict[str, Any]]:
+    """Время функций сервисного слоя без HTTP и сериализации."""
+    from app.carts import add_line
+    from app.services import (
+        empty_cart,
+        filter_products,
+        get_filters_for_category,
+        get_search_suggestions,
+        recalc_cart,
+    )
+
+    rng = random.Random(seed)
+    filters = {
+        "type_filter": None,
+        "brand_filter": None,
+        "color_filter": None,
+        "shape_filter": None,
+        "size_filter": None,
+        "hardness_filter": None,
+    }
+    cart = empty_cart()
+    for product_id in rng.sample(product_ids, min(10, len(product_ids))):
+        add_line(cart, product_id, rng.randrange(1, 4))
+
+    # Пустые фасеты значат, что бенчмарк меряет ранний выход, а не подсчёт
+    for category in CATEGORIES:
+        assert get_filters_for_category(category), f"нет фильтров для категории {category}"
+
+    cases: dict[str, Callable[[], Any]] = {
+        "filter_products(category)": lambda: filter_products(
+            rng.choice(CATEGORIES), None, "new", **filters, limit=24
+        ),
+        "filter_products(category, brand, price_asc)": lambda: filter_products(
+            rng.choice(CATEGORIES), None, "price_asc", **{**filters, "brand_filter": rng.choice(BRANDS)}, limit=24
+        ),
+        "filter_products(query, popular)": lambda: filter_products(
+            None, rng.choice(SEARCH_QUERIES), "popular", **filters, limit=24
+        ),
+        "get_filters_for_category": lambda: get_filters_for_category(rng.choice(CATEGORIES)),
+        "get_search_suggestions": lambda: get_search_suggestions(rng.choice(SUGGEST_QUERIES)),
+        "recalc_cart(10 lines)": lambda: recalc_cart(cart),
+    }
+    return {name: _measure(func, iterations) for name, func in cases.items()}
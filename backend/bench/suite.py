@@ -0,0 +1,24 @@
+from __future__ import annotations
+
+import argparse
+from typing import Any
+
+from .catalog import prepare_database
+from .load import run_asgi, run_uvicorn
+from .micro import run_micro
+
+
+def run_size(size: int, args: argparse.Namespace) -> dict[str, Any]:
+    prepare_database(size, args.data_dir, args.seed)
+    from app.catalog import catalog
+
+    product_ids = [product["id"] for product in catalog.list()]
+    modes = args.modes.split(",")
+    results: dict[str, Any] = {}
+    if "micro" in modes:
+        results["micro"] = run_micro(product_ids, args.iterations, args.seed)
+    if "asgi" in modes:
+        results["asgi"] = run_asgi(product_ids, args.concurrency, args.rounds, args.seed)
+    if "uvicorn" in modes:
+        results["uvicorn"] = run_uvicorn(product_ids, args.concurrency, args.rounds, args.workers, args.seed)
+    return results